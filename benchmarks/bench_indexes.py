@@ -0,0 +1,234 @@
+"""
+Benchmark of chart queries on a big trading_prices table.
+Prices of --instruments bench_* instruments, --rows in total one per second up to now,
+are seeded into PostgreSQL from .env settings (use a local database), with partitions
+and migrations of price db updater. For typical chart queries the plan, which EXPLAIN
+returns, has to scan the expected index without sequential scans, and p99 latency
+has to be within the target. Exits with 1 if any check fails.
+Run from this folder:
+    python bench_indexes.py --rows 20000000 --output indexes.json
+    python bench_indexes.py --skip-seed --repeat 200
+    python bench_pipeline.py --compare old.json indexes.json
+Copyright © 2022. All Rights are Reserved by Maria Chichkan
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import datetime
+import platform
+
+from bench_pipeline import ROOT, git_commit, summarize
+
+for folder in ["utils", "price_db_updater", "frontendapp"]:
+    sys.path.insert(0, os.path.join(ROOT, folder))
+# Services resolve "../utils" from their own folder
+os.chdir(os.path.join(ROOT, "benchmarks"))
+
+from sqlalchemy import text
+
+from db_orm import PRICES_COVERING_INDEX, PRICES_TIME_INDEX
+
+# Prices are inserted in time order, as price db updater saves them
+SEED_PRICES = """
+INSERT INTO trading_prices (instrument_id, created_at, price)
+SELECT 'bench_' || i, $1::TIMESTAMP + s * INTERVAL '1 second', (random() * 2000)::INTEGER
+FROM generate_series($2::INTEGER, $3::INTEGER) AS s, generate_series(0, $4 - 1) AS i
+ORDER BY s, i
+ON CONFLICT DO NOTHING
+"""
+
+LATEST_PRICE = text(
+    "SELECT MAX(created_at) FROM trading_prices WHERE instrument_id = 'bench_0'"
+)
+
+# Indexes of partitions are named after partitions, they are reported by parent names
+PARTITION_INDEXES = text(
+    """
+SELECT child.relname AS child, parent.relname AS parent
+FROM pg_inherits
+JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+WHERE parent.relname = ANY(:indexes)
+"""
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--rows", type=int, default=20000000)
+    parser.add_argument("--instruments", type=int, default=1000)
+    parser.add_argument("--selected", type=int, default=3, help="instruments on the chart")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument(
+        "--skip-seed", action="store_true", help="use prices seeded by a previous run"
+    )
+    parser.add_argument(
+        "--target-scale", type=float, default=1.0,
+        help="multiplier of latency targets, e.g. for slower machines",
+    )
+    parser.add_argument("--output", help="file to save JSON results to")
+    return parser.parse_args()
+
+
+async def prepare(args):
+    """Create tables, partitions and indexes and seed prices, returns time of the last one"""
+    import db_updater
+
+    updater = db_updater.DBUpdater()
+    await updater.init_db()
+    seconds = args.rows // args.instruments
+    end = datetime.datetime.utcnow().replace(microsecond=0)
+    start = end - datetime.timedelta(seconds=seconds - 1)
+    await updater.partitions.ensure_partitions(
+        start.date() + datetime.timedelta(days=i)
+        for i in range((end.date() - start.date()).days + 1)
+    )
+    async with updater.bulk_loader.pool.acquire() as conn:
+        # An hour of prices per statement
+        for first in range(0, seconds, 3600):
+            started_at = time.perf_counter()
+            last = min(first + 3600, seconds) - 1
+            await conn.execute(SEED_PRICES, start, first, last, args.instruments)
+            print(
+                f"Seeded {(last + 1) * args.instruments} of {args.rows} prices "
+                f"in {time.perf_counter() - started_at:.1f} s"
+            )
+        # Statistics for the planner and visibility map for index-only scans
+        await conn.execute("VACUUM ANALYZE trading_prices")
+    await updater.bulk_loader.close()
+    return end
+
+
+def chart_queries(args):
+    """
+    Typical queries of charts: instruments, period in seconds and bucket size,
+    index and node type of the expected scan and target of p99 latency in ms
+    """
+    selected = [
+        f"bench_{i * args.instruments // args.selected}" for i in range(args.selected)
+    ]
+    return {
+        # Prices of selected instruments and prices per 5 s buckets of them
+        "raw_selected_10m": dict(
+            instruments=selected, period=600, bucket_size=None,
+            index=PRICES_COVERING_INDEX, node_type="Index Only Scan", target_ms=50,
+        ),
+        "ohlc_selected_1h": dict(
+            instruments=selected, period=3600, bucket_size=5,
+            index=PRICES_COVERING_INDEX, node_type="Index Only Scan", target_ms=100,
+        ),
+        # Prices of all instruments in a short window
+        "raw_all_1m": dict(
+            instruments=[], period=60, bucket_size=None,
+            index=PRICES_TIME_INDEX, node_type="Bitmap Index Scan", target_ms=500,
+        ),
+    }
+
+
+def check_plan(plan, index_names, index, node_type):
+    """Problems of the plan: the expected scan of the index is missing or tables are read"""
+    from queries import plan_scans
+
+    scans = [(node, index_names.get(name, name)) for node, name in plan_scans(plan)]
+    problems = []
+    if (node_type, index) not in scans:
+        problems.append(f"no {node_type} using {index}")
+    problems += [f"{node} of a table" for node, _ in scans if node == "Seq Scan"]
+    return problems, scans
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    from settings import PSQL_CLIENT, PSQL_DB, REDIS_CLIENT
+    from data_access import DataAccess
+    from queries import history_query
+
+    if args.skip_seed:
+        end = None
+    else:
+        end = asyncio.run(prepare(args))
+
+    psql_url = (
+        f"postgresql://{PSQL_CLIENT.USER}:{PSQL_CLIENT.PASSWORD}@"
+        + f"{PSQL_CLIENT.HOST}"
+        + f"{':' + PSQL_CLIENT.PORT if not PSQL_CLIENT.PORT in ['False', False] else ''}"
+        + f"/{PSQL_DB}"
+    )
+    # Redis isn't used, clients connect only when they are used
+    data_access = DataAccess(
+        psql_url,
+        f"redis://{REDIS_CLIENT.HOST}:{REDIS_CLIENT.PORT}",
+        REDIS_CLIENT.PASSWORD,
+    )
+    if end is None:
+        end = data_access.read_sql(LATEST_PRICE).iloc[0, 0].to_pydatetime()
+    index_names = dict(
+        data_access.read_sql(
+            PARTITION_INDEXES, {"indexes": [PRICES_COVERING_INDEX, PRICES_TIME_INDEX]}
+        ).values
+    )
+
+    results = {}
+    checks = {}
+    for name, query in chart_queries(args).items():
+        statement, params = history_query(
+            query["instruments"],
+            end - datetime.timedelta(seconds=query["period"]),
+            end,
+            query["bucket_size"],
+        )
+        plan = data_access.explain(statement, params)
+        problems, scans = check_plan(
+            plan, index_names, query["index"], query["node_type"]
+        )
+        latencies = []
+        rows = 0
+        for _ in range(args.repeat):
+            started_at = time.perf_counter()
+            rows = data_access.read_sql(statement, params).shape[0]
+            latencies.append((time.perf_counter() - started_at) * 1000)
+        results[name] = summarize(latencies, sum(latencies) / 1000)
+        results[name]["rows"] = rows
+        target = query["target_ms"] * args.target_scale
+        if results[name]["p99_ms"] > target:
+            problems.append(f"p99 {results[name]['p99_ms']:.1f} ms > {target:.0f} ms")
+        checks[name] = {
+            "scans": scans,
+            "execution_ms": plan.get("Execution Time"),
+            "problems": problems,
+        }
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "created_at": datetime.datetime.utcnow().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            **vars(args),
+        },
+        "results": results,
+        "checks": checks,
+    }
+    for name, metrics in results.items():
+        print(
+            f"{name:<20} "
+            + " ".join(
+                f"{metric}={value:.3f}" if isinstance(value, float) else f"{metric}={value}"
+                for metric, value in metrics.items()
+            )
+            + f" {'; '.join(checks[name]['problems']) or 'OK'}"
+        )
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2, default=str)
+    sys.exit(1 if any(check["problems"] for check in checks.values()) else 0)
+
+
+if __name__ == "__main__":
+    main()
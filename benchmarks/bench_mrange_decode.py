@@ -0,0 +1,88 @@
+"""
+Micro-benchmark of decoding TS.MRANGE replies to DataFrames:
+the previous per-series DataFrames vs. utils.mrange.decode_mrange.
+Run from this folder: python bench_mrange_decode.py --series 1000 10000
+Copyright © 2022. All Rights are Reserved by Maria Chichkan
+"""
+
+import os
+import sys
+import time
+import argparse
+import pandas as pd
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils")
+)
+from mrange import decode_mrange
+
+
+def make_reply(n_series, n_samples, start_time=1667260800000):
+    """Reply of TS.MRANGE with decode_responses=True: values are strings"""
+    return [
+        [
+            f"ticker_{i}",
+            [],
+            [
+                [start_time + j * 1000 + i % 1000, str(j % 7 - 3)]
+                for j in range(n_samples)
+            ],
+        ]
+        for i in range(n_series)
+    ]
+
+
+def decode_per_series(timeseries):
+    """Decoding as it was done in get_latest_prices of the frontend"""
+    ts_lst = []
+    for timeseries_ in timeseries:
+        df_ts = pd.DataFrame(timeseries_[2], columns=["created_at", "price"])
+        df_ts["instrument_id"] = timeseries_[0]
+        ts_lst.append(df_ts)
+    df_latest_prices = pd.concat(ts_lst, ignore_index=True)
+    df_latest_prices["price"] = df_latest_prices["price"].astype("int")
+    df_latest_prices["created_at"] = pd.to_datetime(
+        df_latest_prices["created_at"], unit="ms"
+    )
+    df_latest_prices["created_at"] = df_latest_prices["created_at"].apply(
+        lambda x: x.replace(microsecond=0)
+    )
+    return df_latest_prices
+
+
+def best_of(func, reply, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(reply)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--series", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--samples", type=int, default=60, help="samples per series")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(
+        f"{'series':>8} {'samples':>10} {'per series, s':>14} "
+        f"{'columnar, s':>12} {'speedup':>8}"
+    )
+    for n_series in args.series:
+        reply = make_reply(n_series, args.samples)
+        expected = decode_per_series(reply)
+        decoded = decode_mrange(reply, floor_ms=1000)
+        assert (expected["created_at"].values == decoded["created_at"].values).all()
+        assert (expected["price"].values == decoded["price"].values).all()
+        legacy = best_of(decode_per_series, reply, args.repeat)
+        columnar = best_of(lambda r: decode_mrange(r, floor_ms=1000), reply, args.repeat)
+        print(
+            f"{n_series:>8} {n_series * args.samples:>10} {legacy:>14.3f} "
+            f"{columnar:>12.3f} {legacy / columnar:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+"""
+Load test of the whole pipeline: PriceGenerator and DBUpdater run together
+for --duration seconds, then the frontend data functions are called --repeat times.
+Reports throughput, p50/p99 latency and memory and saves them to JSON,
+which can be compared with results of another commit.
+
+With --backend fake Redis Time Series and PostgreSQL are replaced by in-process fakes
+(fakes.py), with --backend real the services use Redis and PostgreSQL from .env settings.
+Run from this folder:
+    python bench_pipeline.py --instruments 1000 --tick-ms 100 --output new.json
+    python bench_pipeline.py --compare old.json new.json
+results/fake_1000x100ms.json is a baseline of the first command with --backend fake.
+Copyright © 2022. All Rights are Reserved by Maria Chichkan
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import datetime
+import platform
+import resource
+import subprocess
+import tracemalloc
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Metrics, where bigger values are worse, and where smaller ones are
+HIGHER_IS_WORSE = ("p50_ms", "p99_ms", "peak_memory_mb")
+LOWER_IS_WORSE = ("throughput_per_s",)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--backend", choices=["fake", "real"], default="fake")
+    parser.add_argument("--instruments", type=int, default=1000)
+    parser.add_argument("--tick-ms", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--selected", type=int, default=3, help="instruments on the chart")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--ingestion", choices=["timeseries", "stream"], default="timeseries")
+    parser.add_argument(
+        "--tracemalloc", action="store_true", help="measure peak of Python allocations"
+    )
+    parser.add_argument("--output", help="file to save JSON results to")
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("BASELINE", "RESULTS"),
+        help="compare two JSON results instead of running",
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2,
+        help="relative change reported as regression by --compare",
+    )
+    args = parser.parse_args()
+    if args.ingestion == "stream" and args.backend == "fake":
+        parser.error("stream ingestion needs --backend real")
+    return args
+
+
+def configure(args):
+    """
+    Pass benchmark parameters to services through their settings
+    and make their modules importable
+    """
+    os.environ.update(
+        {
+            "TICK_INTERVAL_MS": str(args.tick_ms),
+            "PRICE_BATCH_SIZE": str(args.batch_size),
+            "PRICE_EMISSION_MODE": "batch",
+            "PRICE_MODEL_SEED": str(args.seed),
+            "INGESTION_MODE": args.ingestion,
+            "METRICS_PORT": "0",
+            "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+        }
+    )
+    if args.backend == "fake":
+        os.environ.update(
+            {"PRICE_CACHE_SIZE": "0", "FRONTEND_CONCURRENT_QUERIES": "false"}
+        )
+        # Engines are created, but never connect
+        for name, value in [
+            ("PSQL_HOST", "localhost"), ("PSQL_PORT", "5432"), ("PSQL_USER", "bench"),
+            ("PSQL_PASSWORD", "bench"), ("PSQL_DB", "bench"),
+            ("REDIS_HOST", "localhost"), ("REDIS_PORT", "6379"), ("REDIS_PASSWORD", ""),
+        ]:
+            os.environ.setdefault(name, value)
+    for folder in ["utils", "price_generator", "price_db_updater", "frontendapp"]:
+        sys.path.insert(0, os.path.join(ROOT, folder))
+    # Services resolve "../utils" from their own folder
+    os.chdir(os.path.join(ROOT, "benchmarks"))
+
+
+def summarize(latencies_ms, elapsed=None, count=None, peak_memory=None):
+    """Percentiles of latencies (ms), throughput per second and peak memory (MB)"""
+    latencies_ms = np.asarray(latencies_ms, dtype="float64")
+    if peak_memory is None and not latencies_ms.size and count is None:
+        return {}
+    result = {"count": int(count if count is not None else latencies_ms.size)}
+    if latencies_ms.size:
+        result.update(
+            p50_ms=float(np.percentile(latencies_ms, 50)),
+            p99_ms=float(np.percentile(latencies_ms, 99)),
+            mean_ms=float(latencies_ms.mean()),
+        )
+    if elapsed:
+        result["throughput_per_s"] = result["count"] / elapsed
+    if peak_memory is not None:
+        result["peak_memory_mb"] = peak_memory / 2 ** 20
+    return result
+
+
+class PeakMemory:
+    """Peak of Python allocations with tracemalloc, if it is enabled"""
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.peak = None
+
+    def __enter__(self):
+        if self.enabled:
+            tracemalloc.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.enabled:
+            self.peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+
+async def run_services(args, instruments, store, database):
+    """Run price generator and price db updater together for args.duration seconds"""
+    import price_generator
+    import db_updater
+    from fakes import FakeBulkLoader, FakeRedis
+
+    generator = price_generator.PriceGenerator(instruments, args.seed)
+    updater = db_updater.DBUpdater()
+    if args.backend == "fake":
+        redis = FakeRedis(store)
+        generator.redis = redis
+        setattr(updater, "_DBUpdater__redis_session", redis)
+        updater.bulk_loader = FakeBulkLoader(database)
+
+        async def noop(*args, **kwargs):
+            pass
+
+        async def save_watermarks(watermarks):
+            updater.watermarks.update(watermarks)
+
+        updater.partitions.ensure_partitions = noop
+        updater.partitions.maintain = noop
+        updater.rollups.refresh = noop
+        updater.registry.refresh = noop
+        updater.save_watermarks = save_watermarks
+    else:
+        await updater.init_db()
+
+    # Time from the tick to prices sent to Redis, per batch of instruments
+    publish_latencies = []
+    send_trading_prices = generator.send_trading_prices
+
+    async def timed_send(batch_instruments, prices, current_time):
+        failed = await send_trading_prices(batch_instruments, prices, current_time)
+        publish_latencies.append(time.time() * 1000 - current_time)
+        return failed
+
+    generator.send_trading_prices = timed_send
+
+    # Time from the tick to the commit to database, per price
+    persist_latencies = []
+    save_batch = updater.save_batch
+
+    async def timed_save(batch):
+        await save_batch(batch)
+        persist_latencies.append(time.time() * 1000 - batch.created_at_ms)
+
+    updater.save_batch = timed_save
+
+    started_at = time.perf_counter()
+    tasks = [
+        asyncio.ensure_future(generator.generate_trading_prices()),
+        asyncio.ensure_future(updater.run_pipeline()),
+    ]
+    done, _ = await asyncio.wait(tasks, timeout=args.duration)
+    elapsed = time.perf_counter() - started_at
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for task in done:
+        # A stage failed before the end of the run
+        task.result()
+
+    persist_latencies = (
+        np.concatenate(persist_latencies) if persist_latencies else np.array([])
+    )
+    ticks = price_generator.TICKS.labels().value
+    return {
+        "generator": {
+            **summarize(
+                publish_latencies,
+                elapsed,
+                count=price_generator.PRICES.labels().value,
+            ),
+            "ticks": ticks,
+            "skipped_ticks": price_generator.SKIPPED_TICKS.labels().value,
+        },
+        "db_updater": summarize(persist_latencies, elapsed),
+    }
+
+
+def timed_calls(func, repeat):
+    latencies = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - started_at) * 1000)
+    return latencies
+
+
+def run_frontend(args, instruments, store, database):
+    """Call data functions of the frontend, as its callbacks do"""
+    import data_access
+    from fakes import FakeDataAccess
+
+    if args.backend == "fake":
+        # The frontend creates its clients and starts the instrument watcher on import
+        data_access.DataAccess = lambda *args: FakeDataAccess(store, database)
+    import main as frontend
+
+    selected = instruments[: args.selected]
+    # Prices are saved in UTC
+    date_to = datetime.datetime.utcnow()
+    date_from = date_to - datetime.timedelta(seconds=args.duration)
+    current_time = int(time.time() * 1000)
+    state = {
+        "version": 1,
+        "instruments": selected,
+        "last_times": {instrument: current_time - 5000 for instrument in selected},
+    }
+    calls = {
+        "get_historical_data": lambda: frontend.get_historical_data(
+            selected, date_from, date_to
+        ),
+        "get_latest_prices": lambda: frontend.get_latest_prices(selected),
+        "update_prices": lambda: frontend.update_prices(1, state, state),
+    }
+    results = {}
+    for name, call in calls.items():
+        with PeakMemory(args.tracemalloc) as memory:
+            latencies = timed_calls(call, args.repeat)
+        results[f"frontend.{name}"] = summarize(
+            latencies, sum(latencies) / 1000, peak_memory=memory.peak
+        )
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, results, tolerance):
+    """Print changes of metrics and problems of checks, return the number of regressions"""
+    regressions = 0
+    print(f"{'benchmark':<32} {'metric':<18} {'baseline':>12} {'results':>12} {'change':>8}")
+    for name, metrics in results["results"].items():
+        for metric, value in metrics.items():
+            old = baseline["results"].get(name, {}).get(metric)
+            if metric not in HIGHER_IS_WORSE + LOWER_IS_WORSE or not old or value is None:
+                continue
+            change = (value - old) / old
+            worse = change > tolerance if metric in HIGHER_IS_WORSE else change < -tolerance
+            regressions += worse
+            print(
+                f"{name:<32} {metric:<18} {old:>12.3f} {value:>12.3f} "
+                f"{change:>+7.0%}{' REGRESSION' if worse else ''}"
+            )
+    # Checks of plans and latency targets reported by bench_indexes.py
+    for name, check in results.get("checks", {}).items():
+        regressions += bool(check["problems"])
+        print(f"{name:<32} {'checks':<18} {'; '.join(check['problems']) or 'OK'}")
+    return regressions
+
+
+def main():
+    args = parse_args()
+    if args.compare:
+        with open(args.compare[0]) as baseline, open(args.compare[1]) as results:
+            sys.exit(1 if compare(json.load(baseline), json.load(results), args.tolerance) else 0)
+
+    configure(args)
+    from fakes import FakeDatabase, TimeSeriesStore
+
+    instruments = [f"bench_{i}" for i in range(args.instruments)]
+    import settings
+    # Names of instruments are shown on charts
+    settings.TRADING_INSTRUMENTS_WITH_NAMES.update({instr: instr for instr in instruments})
+    store, database = TimeSeriesStore(), FakeDatabase()
+
+    with PeakMemory(args.tracemalloc) as memory:
+        results = asyncio.run(run_services(args, instruments, store, database))
+    # Price generator and price db updater share the process
+    results["services"] = summarize([], peak_memory=memory.peak)
+    results.update(run_frontend(args, instruments, store, database))
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "created_at": datetime.datetime.utcnow().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            **{key: value for key, value in vars(args).items() if key != "compare"},
+        },
+        "results": results,
+    }
+    for name, metrics in results.items():
+        print(
+            f"{name:<32} "
+            + " ".join(
+                f"{metric}={value:.3f}" if isinstance(value, float) else f"{metric}={value}"
+                for metric, value in metrics.items()
+            )
+        )
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark of tick message formats: CPU time to encode and decode one tick
+of all instruments and bytes sent to Redis.
+Run from this folder: python bench_tick_codecs.py --instruments 1000 10000
+Copyright © 2022. All Rights are Reserved by Maria Chichkan
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils")
+)
+from tick_codecs import BinaryCodec, JsonCodec, decode
+
+
+def per_instrument(codec, instruments, values, current_time):
+    return [
+        (instr, codec.encode_tick(instr, current_time, value))
+        for instr, value in zip(instruments, values)
+    ]
+
+
+def batched(codec, instruments, values, current_time, batch_size):
+    return [
+        ("ticks", codec.encode_batch(
+            current_time,
+            instruments[i : i + batch_size],
+            values[i : i + batch_size],
+        ))
+        for i in range(0, len(instruments), batch_size)
+    ]
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--instruments", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    current_time = 1667260800000
+    print(
+        f"{'instruments':>11} {'format':>16} {'encode, ms':>11} "
+        f"{'decode, ms':>11} {'bytes':>10}"
+    )
+    for n_instruments in args.instruments:
+        instruments = [f"ticker_{i}" for i in range(n_instruments)]
+        values = [i % 2000 - 1000 for i in range(n_instruments)]
+        variants = [
+            ("json", lambda c=JsonCodec: per_instrument(
+                c, instruments, values, current_time
+            )),
+            ("binary", lambda c=BinaryCodec: per_instrument(
+                c, instruments, values, current_time
+            )),
+            ("json batch", lambda c=JsonCodec: batched(
+                c, instruments, values, current_time, args.batch_size
+            )),
+            ("binary batch", lambda c=BinaryCodec: batched(
+                c, instruments, values, current_time, args.batch_size
+            )),
+        ]
+        for name, encode in variants:
+            encode_time, messages = best_of(encode, args.repeat)
+            decode_time, ticks = best_of(
+                lambda: [
+                    tick
+                    for channel, payload in messages
+                    for tick in decode(payload, channel)
+                ],
+                args.repeat,
+            )
+            assert [tick[2] for tick in ticks] == values
+            size = sum(
+                len(payload if isinstance(payload, bytes) else payload.encode())
+                + len(channel)
+                for channel, payload in messages
+            )
+            print(
+                f"{n_instruments:>11} {name:>16} {encode_time * 1000:>11.2f} "
+                f"{decode_time * 1000:>11.2f} {size:>10}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+In-process fakes of Redis Time Series and PostgreSQL for bench_pipeline.py.
+They keep data in memory and implement only the commands the services send,
+so benchmarks measure the cost of the services' own code.
+Copyright © 2022. All Rights are Reserved by Maria Chichkan
+"""
+
+import time
+import bisect
+import numpy as np
+import pandas as pd
+
+from queries import SYNC_WATERMARKS, aggregate_prices
+
+
+class TimeSeriesStore:
+    """Time series with retention, queried like TS.MRANGE with decode_responses=True"""
+    def __init__(self):
+        # name -> [list of timestamps, list of values, retention in ms]
+        self.series = {}
+
+    def create(self, name, retention):
+        if name in self.series:
+            raise Exception("ERR TSDB: key already exists")
+        self.series[name] = [[], [], retention]
+
+    def add(self, name, timestamp, value):
+        times, values, retention = self.series[name]
+        if times and timestamp <= times[-1]:
+            # DUPLICATE_POLICY FIRST and no out of order samples
+            return timestamp
+        times.append(timestamp)
+        values.append(value)
+        if retention and times[0] < timestamp - retention:
+            expired = bisect.bisect_left(times, timestamp - retention)
+            del times[:expired]
+            del values[:expired]
+        return timestamp
+
+    def mrange(self, from_time, to_time, names=None):
+        timeseries = []
+        for name in names if names is not None else self.series:
+            if name not in self.series:
+                continue
+            times, values, _ = self.series[name]
+            start = bisect.bisect_left(times, from_time)
+            end = bisect.bisect_right(times, to_time)
+            timeseries.append(
+                [
+                    name,
+                    [],
+                    [[times[i], str(values[i])] for i in range(start, end)],
+                ]
+            )
+        return timeseries
+
+    def execute_command(self, command, *args):
+        if command == "TS.CREATE":
+            return self.create(args[0], int(args[args.index("RETENTION") + 1]))
+        if command == "TS.ALTER":
+            return "OK"
+        if command == "TS.ADD":
+            if args[0] not in self.series:
+                self.create(args[0], int(args[args.index("RETENTION") + 1]))
+            return self.add(args[0], int(args[1]), int(args[2]))
+        if command == "TS.MADD":
+            return [
+                self.add(args[i], int(args[i + 1]), int(args[i + 2]))
+                for i in range(0, len(args), 3)
+            ]
+        if command == "TS.MRANGE":
+            names = None
+            filters = args[args.index("FILTER") + 1 :]
+            for filter_ in filters:
+                if filter_.startswith("name=("):
+                    names = filter_[len("name=(") : -1].split(",")
+            return self.mrange(int(args[0]), int(args[1]), names)
+        raise NotImplementedError(command)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def execute_command(self, *args):
+        self.commands.append(("execute_command", args, {}))
+        return self
+
+    def publish(self, *args):
+        self.commands.append(("publish", args, {}))
+        return self
+
+    def xadd(self, *args, **kwargs):
+        self.commands.append(("xadd", args, kwargs))
+        return self
+
+    async def execute(self, raise_on_error=True):
+        results = []
+        for method, args, kwargs in self.commands:
+            try:
+                results.append(await getattr(self.redis, method)(*args, **kwargs))
+            except Exception as ex:
+                if raise_on_error:
+                    raise
+                results.append(ex)
+        self.commands = []
+        return results
+
+
+class FakePubSub:
+    async def psubscribe(self, *channels):
+        pass
+
+
+class FakeRedis:
+    """Asyncio Redis client of price generator and price db updater"""
+    def __init__(self, store):
+        self.store = store
+        self.keys = {}
+        self.published = 0
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def pubsub(self, **kwargs):
+        return FakePubSub()
+
+    async def execute_command(self, *args):
+        return self.store.execute_command(*args)
+
+    async def publish(self, channel, message):
+        self.published += 1
+        return 0
+
+    async def xadd(self, *args, **kwargs):
+        raise NotImplementedError("Streams need a real Redis")
+
+    async def set(self, key, value, **kwargs):
+        self.keys[key] = value
+
+    async def mget(self, keys):
+        return [self.keys.get(key) for key in keys]
+
+    async def scan_iter(self, match=None):
+        prefix = (match or "*").rstrip("*")
+        for key in list(self.keys):
+            if key.startswith(prefix):
+                yield key
+
+
+class FakeDatabase:
+    """trading_prices kept as chunks of columns"""
+    def __init__(self):
+        self.chunks = []
+
+    def insert(self, instrument_ids, created_at_ms, prices):
+        self.chunks.append(
+            (
+                np.asarray(instrument_ids, dtype=object),
+                np.asarray(created_at_ms, dtype="int64"),
+                np.asarray(prices, dtype="int64"),
+            )
+        )
+        return len(prices)
+
+    def prices(self):
+        if not self.chunks:
+            return pd.DataFrame({"instrument_id": [], "created_at": [], "price": []})
+        return pd.DataFrame(
+            {
+                "instrument_id": np.concatenate([chunk[0] for chunk in self.chunks]),
+                "created_at": np.concatenate([chunk[1] for chunk in self.chunks])
+                .astype("datetime64[ms]")
+                .astype("datetime64[ns]"),
+                "price": np.concatenate([chunk[2] for chunk in self.chunks]),
+            }
+        )
+
+
+class FakeBulkLoader:
+    """BulkLoader of price db updater writing to FakeDatabase"""
+    def __init__(self, database):
+        self.database = database
+
+    async def connect(self):
+        pass
+
+    async def load(self, instrument_ids, created_at_ms, prices):
+        return self.database.insert(instrument_ids, created_at_ms, prices)
+
+
+class FakeFrontendPubSub:
+    """Notifications of the registry, which never come"""
+    def subscribe(self, *channels):
+        pass
+
+    def get_message(self, timeout=0.0):
+        time.sleep(timeout)
+        return None
+
+
+class FakeFrontendRedis:
+    """Redis client of the frontend without a mirror of the registry"""
+    def get(self, key):
+        return None
+
+    def pubsub(self, **kwargs):
+        return FakeFrontendPubSub()
+
+
+class FakeDataAccess:
+    """DataAccess of the frontend reading FakeDatabase and TimeSeriesStore"""
+    def __init__(self, store, database):
+        self.store = store
+        self.database = database
+        # The price cache of the frontend is off with fakes, so it never uses its client
+        self.redis_bytes = None
+        # The instrument watcher of the frontend finds no registry and keeps its instruments
+        self.redis = FakeFrontendRedis()
+
+    def read_sql(self, statement, params=None):
+        """Result of history_query and SYNC_WATERMARKS statements, computed with pandas"""
+        df = self.database.prices()
+        if statement is SYNC_WATERMARKS:
+            synced_at = df.groupby("instrument_id")["created_at"].max()
+            return pd.DataFrame(
+                {
+                    "instrument_id": synced_at.index,
+                    "synced_at": synced_at.values.astype("int64") // 1000000,
+                }
+            )
+        df = df[df["created_at"].between(params["date_from"], params["date_to"])]
+        if "instruments" in params:
+            df = df[df["instrument_id"].isin(params["instruments"])]
+        if "bucket_size" not in params:
+            return df
+        return aggregate_prices(df, params["bucket_size"])
+
+    def execute_command(self, *args):
+        return self.store.execute_command(*args)
+
+    def submit(self, func, *args, **kwargs):
+        raise NotImplementedError("Concurrent queries are disabled with fakes")
@@ -0,0 +1,68 @@
+/*
+ * Streaming of new prices to the price chart with server-sent events
+ * Copyright © 2022. All Rights are Reserved by Maria Chichkan
+ */
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    stream: {
+        source: null,
+
+        /*
+         * Open stream of prices of instruments on the chart and close the previous one.
+         * Prices are appended to the chart in the browser, without callbacks.
+         * Returns true, if prices are streamed, so that polling by the interval is disabled.
+         */
+        subscribe: function (historicalData, config) {
+            var stream = window.dash_clientside.stream;
+            if (stream.source !== null) {
+                stream.source.close();
+                stream.source = null;
+            }
+            if (!config.enabled || !window.EventSource) {
+                return false;
+            }
+            if (!historicalData || !historicalData.instruments ||
+                historicalData.instruments.length === 0) {
+                return false;
+            }
+            var instruments = historicalData.instruments;
+            // Prices after these timestamps (ms) aren't on the chart yet
+            var lastTimes = Object.assign({}, historicalData.last_times);
+            // Prices received before the stream opened are sent first,
+            // after reconnects the browser resumes from the id of the last event
+            var source = new EventSource(
+                config.url + "?instruments=" + encodeURIComponent(instruments.join(",")) +
+                "&last_times=" + encodeURIComponent(JSON.stringify(lastTimes))
+            );
+            source.onmessage = function (event) {
+                var ticks = JSON.parse(event.data);
+                var update = {x: [], y: []};
+                var indices = [];
+                instruments.forEach(function (instrument, i) {
+                    var x = [];
+                    var y = [];
+                    // [time in ms, time on the chart, price]
+                    (ticks[instrument] || []).forEach(function (tick) {
+                        if (lastTimes[instrument] !== undefined && tick[0] <= lastTimes[instrument]) {
+                            return;
+                        }
+                        lastTimes[instrument] = tick[0];
+                        x.push(tick[1]);
+                        y.push(tick[2]);
+                    });
+                    if (x.length > 0) {
+                        update.x.push(x);
+                        update.y.push(y);
+                        indices.push(i);
+                    }
+                });
+                var graph = document.querySelector("#" + config.graph + " .js-plotly-plot");
+                if (indices.length > 0 && graph !== null && window.Plotly) {
+                    window.Plotly.extendTraces(graph, update, indices, config.max_points);
+                }
+            };
+            stream.source = source;
+            return true;
+        }
+    }
+});
@@ -0,0 +1,103 @@
+"""
+Pooled access to PostgreSQL and Redis for frontend callbacks
+Copyright © 2022. All Rights are Reserved by Maria Chichkan
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import redis
+from sqlalchemy import create_engine, event
+
+# Connections of the Redis cap, which read without decoding:
+# pub/sub of price cache and registration of its formats
+REDIS_BYTES_CONNECTIONS = 2
+
+
+class DataAccess:
+    """
+    This class keeps explicitly sized pools of PostgreSQL and Redis connections,
+    shared by all callbacks, and a pool of threads to run lookups concurrently
+    """
+    def __init__(
+        self,
+        psql_url,
+        redis_url,
+        redis_password,
+        psql_pool_size=5,
+        psql_max_overflow=5,
+        redis_max_connections=20,
+        workers=8,
+        echo=False,
+    ):
+        """
+        Args:
+            psql_url: string
+            redis_url: string
+            redis_password: string
+            psql_pool_size: int, number of kept PostgreSQL connections
+            psql_max_overflow: int, number of extra PostgreSQL connections under load
+            redis_max_connections: int, shared by clients decoding responses and not
+            workers: int, number of threads for concurrent lookups
+            echo: bool, log every SQL statement
+        """
+        self.psql_engine = create_engine(
+            psql_url,
+            pool_size=psql_pool_size,
+            max_overflow=psql_max_overflow,
+            pool_pre_ping=True,
+            echo=echo,
+        )
+        self.redis = redis.Redis(
+            connection_pool=redis.BlockingConnectionPool.from_url(
+                redis_url,
+                password=redis_password,
+                max_connections=max(redis_max_connections - REDIS_BYTES_CONNECTIONS, 1),
+                encoding="utf-8",
+                decode_responses=True,
+            )
+        )
+        # Tick messages may be binary, so they are read without decoding.
+        # Decoding is set per connection, so these connections are pooled apart
+        self.redis_bytes = redis.Redis(
+            connection_pool=redis.BlockingConnectionPool.from_url(
+                redis_url,
+                password=redis_password,
+                max_connections=REDIS_BYTES_CONNECTIONS,
+                decode_responses=False,
+            )
+        )
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="data-access"
+        )
+
+    def read_sql(self, statement, params=None):
+        """Run statement with parameters and return its rows as DataFrame"""
+        with self.psql_engine.connect() as conn:
+            return pd.read_sql(statement, conn, params=params)
+
+    def explain(self, statement, params=None, analyze=True):
+        """
+        Plan of statement with parameters as EXPLAIN (FORMAT JSON) returns it,
+        with actual times and buffers if analyze is True (the statement is run then)
+        """
+        options = "ANALYZE, BUFFERS, " if analyze else ""
+
+        # Statement is prefixed after SQLAlchemy expanded its parameters
+        def add_explain(conn, cursor, statement_, parameters, context, executemany):
+            return f"EXPLAIN ({options}FORMAT JSON) {statement_}", parameters
+
+        with self.psql_engine.connect() as conn:
+            event.listen(conn, "before_cursor_execute", add_explain, retval=True)
+            try:
+                plan = conn.execute(statement, params or {}).scalar()
+            finally:
+                event.remove(conn, "before_cursor_execute", add_explain)
+        return plan[0]
+
+    def execute_command(self, *args):
+        """Run Redis command"""
+        return self.redis.execute_command(*args)
+
+    def submit(self, func, *args, **kwargs):
+        """Run function in the pool of threads, returns Future"""
+        return self.executor.submit(func, *args, **kwargs)
@@ -0,0 +1,256 @@
+"""
+Read-through cache of historical trading prices for charts
+Copyright © 2022. All Rights are Reserved by Maria Chichkan
+"""
+
+import io
+import time
+import datetime
+import threading
+from collections import OrderedDict
+import pandas as pd
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def to_seconds(value):
+    """Seconds since the epoch of naive UTC datetime"""
+    return (value - EPOCH).total_seconds()
+
+
+class MemoryStore:
+    """Segments kept in process, the least recently used are evicted above max_rows"""
+    def __init__(self, max_rows):
+        self.max_rows = max_rows
+        self.rows = 0
+        # key -> (DataFrame, expiry time on monotonic clock or None)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_many(self, keys):
+        found = {}
+        now = time.monotonic()
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is None:
+                    continue
+                if entry[1] is not None and entry[1] <= now:
+                    self.rows -= entry[0].shape[0]
+                    del self.entries[key]
+                    continue
+                self.entries.move_to_end(key)
+                found[key] = entry[0]
+        return found
+
+    def set_many(self, items):
+        """
+        Args:
+            items: list of (key, DataFrame, ttl in seconds or None to keep until evicted)
+        """
+        now = time.monotonic()
+        with self.lock:
+            for key, df, ttl in items:
+                previous = self.entries.pop(key, None)
+                if previous is not None:
+                    self.rows -= previous[0].shape[0]
+                self.entries[key] = (df, None if ttl is None else now + ttl)
+                self.rows += df.shape[0]
+            while self.rows > self.max_rows and self.entries:
+                _, (df, _) = self.entries.popitem(last=False)
+                self.rows -= df.shape[0]
+
+
+class RedisStore:
+    """Segments shared by all frontend processes in Redis"""
+    def __init__(self, redis_client, ttl, prefix="history:"):
+        """
+        Args:
+            redis_client: Redis client, which decodes responses
+            ttl: int, seconds to keep closed segments, Redis may evict them earlier
+            prefix: string, prefix of keys
+        """
+        self.redis = redis_client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    @staticmethod
+    def dumps(df):
+        created_at = pd.to_datetime(df["created_at"]).values.astype("datetime64[ns]")
+        df = df.assign(created_at=created_at.astype("int64"))
+        return df.to_json(orient="split", index=False)
+
+    @staticmethod
+    def loads(value):
+        df = pd.read_json(
+            io.StringIO(value), orient="split", convert_dates=False, dtype=False
+        )
+        created_at = df["created_at"].values.astype("int64")
+        df["created_at"] = created_at.astype("datetime64[ns]")
+        return df
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = self.redis.mget([self.prefix + key for key in keys])
+        return {
+            key: self.loads(value) for key, value in zip(keys, values) if value is not None
+        }
+
+    def set_many(self, items):
+        pipe = self.redis.pipeline(transaction=False)
+        for key, df, ttl in items:
+            pipe.set(self.prefix + key, self.dumps(df), ex=ttl or self.ttl)
+        pipe.execute()
+
+
+class HistoryCache:
+    """
+    This class caches historical prices in segments of time aligned to the epoch,
+    per instrument and bucket size. Closed segments, which price db updater has saved
+    completely and can't change anymore, are kept until evicted, and open segments
+    are cached only for a few seconds. A query reads cached segments and asks the database
+    only for the missing ones, so repeated and overlapping ranges mostly skip it.
+    """
+    def __init__(
+        self,
+        loader,
+        store,
+        segment_points=600,
+        settle_seconds=120,
+        open_ttl=5,
+        tick_interval_ms=1000,
+        metric=None,
+        watermarks=None,
+    ):
+        """
+        Args:
+            loader: function (instruments, date_from, date_to, bucket_size) -> DataFrame
+                with instrument_id and created_at columns
+            store: MemoryStore or RedisStore
+            segment_points: int, number of buckets or ticks in a segment
+            settle_seconds: int, prices of a segment may still be saved for this time
+                after its end at least
+            open_ttl: int, seconds to cache segments, which aren't closed yet,
+                and watermarks
+            tick_interval_ms: int, interval between prices stored without buckets
+            metric: Counter with "result" label counting hits and misses of segments
+            watermarks: function () -> dict, timestamp in ms per instrument, up to which
+                prices are saved (e.g. while price db updater catches up).
+                Without it segments are closed after settle_seconds.
+        """
+        self.loader = loader
+        self.store = store
+        self.segment_points = segment_points
+        self.settle_seconds = settle_seconds
+        self.open_ttl = open_ttl
+        self.tick_interval_ms = tick_interval_ms
+        self.metric = metric
+        self.watermarks = watermarks
+        # (dict of watermarks in seconds, monotonic time of loading)
+        self.synced = ({}, None)
+        self.lock = threading.Lock()
+
+    def segment_size(self, bucket_size):
+        """Length of a segment in seconds"""
+        if bucket_size:
+            return bucket_size * self.segment_points
+        return max(self.tick_interval_ms * self.segment_points // 1000, 1)
+
+    def synced_until(self):
+        """Seconds since the epoch per instrument, up to which prices are saved"""
+        with self.lock:
+            synced, loaded_at = self.synced
+            if loaded_at is None or time.monotonic() - loaded_at >= self.open_ttl:
+                synced = {
+                    instrument: synced_at / 1000
+                    for instrument, synced_at in self.watermarks().items()
+                }
+                self.synced = (synced, time.monotonic())
+        return synced
+
+    @staticmethod
+    def key(instrument, bucket_size, start):
+        return f"{bucket_size or 0}:{instrument}:{start}"
+
+    def read(self, instruments, date_from, date_to, bucket_size):
+        """
+        Prices of instruments from date_from to date_to as returned by loader
+        Args:
+            instruments: list
+            date_from: datetime in UTC
+            date_to: datetime in UTC
+            bucket_size: int in seconds or None for prices as they are stored
+        """
+        size = self.segment_size(bucket_size)
+        first = int(to_seconds(date_from) // size * size)
+        starts = list(range(first, int(to_seconds(date_to)) + 1, size))
+        keys = {
+            (instrument, start): self.key(instrument, bucket_size, start)
+            for instrument in instruments
+            for start in starts
+        }
+        cached = self.store.get_many(keys.values())
+        frames = list(cached.values())
+        if self.metric is not None:
+            self.metric.labels(result="hit").inc(len(cached))
+            self.metric.labels(result="miss").inc(len(keys) - len(cached))
+
+        # Consecutive segments missing for the same instruments are loaded with one query
+        ranges = []
+        for start in starts:
+            missing = tuple(
+                instrument
+                for instrument in instruments
+                if keys[(instrument, start)] not in cached
+            )
+            if not missing:
+                continue
+            if ranges and ranges[-1][0] == missing and ranges[-1][2] == start:
+                ranges[-1][2] = start + size
+            else:
+                ranges.append([missing, start, start + size])
+        settled_before = to_seconds(datetime.datetime.utcnow()) - self.settle_seconds
+        synced = self.synced_until() if ranges and self.watermarks else None
+        for missing, start, end in ranges:
+            closed_before = {
+                instrument: settled_before
+                if synced is None
+                else min(settled_before, synced.get(instrument, 0))
+                for instrument in missing
+            }
+            df = self.loader(
+                list(missing),
+                EPOCH + datetime.timedelta(seconds=start),
+                EPOCH + datetime.timedelta(seconds=end, microseconds=-1),
+                bucket_size,
+            )
+            frames.append(df)
+            seconds = pd.to_datetime(df["created_at"]).values.astype("datetime64[s]")
+            segments = seconds.astype("int64") // size * size
+            groups = dict(list(df.groupby([df["instrument_id"].values, segments])))
+            self.store.set_many(
+                [
+                    (
+                        keys[(instrument, segment)],
+                        groups.get((instrument, segment), df.iloc[:0]),
+                        None
+                        if segment + size <= closed_before[instrument]
+                        else self.open_ttl,
+                    )
+                    for instrument in missing
+                    for segment in range(start, end, size)
+                ]
+            )
+
+        if not frames:
+            return pd.DataFrame(columns=["instrument_id", "created_at", "price"])
+        df = pd.concat(frames, ignore_index=True)
+        df["created_at"] = pd.to_datetime(df["created_at"])
+        # Buckets are whole, the first one may start before date_from
+        if bucket_size:
+            date_from = EPOCH + datetime.timedelta(
+                seconds=to_seconds(date_from) // bucket_size * bucket_size
+            )
+        return df[df["created_at"].between(date_from, date_to)].reset_index(drop=True)
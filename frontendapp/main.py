@@ -4,28 +4,70 @@ Copyright © 2022. All Rights are Reserved by Maria Chichkan
 """
 
 import sys
+import json
+import time
 import datetime
+import threading
 import pandas as pd
-import redis
+from flask import Response, request
 
-from sqlalchemy import create_engine, and_
-from sqlalchemy.orm import sessionmaker
-
-from dash import Dash, Input, Output, State, dcc, html
+from dash import ClientsideFunction, Dash, Input, Output, State, dcc, html, no_update
 from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
 import plotly.graph_objects as go
 
 sys.path.insert(0, "../utils")
-from db_orm import TradingPrices
+from mrange import decode_mrange
 from settings import (
     TRADING_INSTRUMENTS_WITH_NAMES,
     PSQL_CLIENT,
     PSQL_DB,
     REDIS_CLIENT,
     REDIS_RETENTION_PERIOD,
+    CHART_WIDTH,
+    CHART_MAX_POINTS,
+    TICK_INTERVAL_MS,
+    PRICE_CACHE_SIZE,
+    TICK_BATCH_CHANNEL,
+    TICK_CODEC_NEGOTIATE_INTERVAL,
+    PSQL_POOL_SIZE,
+    PSQL_MAX_OVERFLOW,
+    PSQL_ECHO,
+    REDIS_MAX_CONNECTIONS,
+    FRONTEND_QUERY_WORKERS,
+    FRONTEND_CONCURRENT_QUERIES,
+    HISTORY_CACHE,
+    HISTORY_CACHE_MAX_ROWS,
+    HISTORY_CACHE_REDIS_TTL,
+    HISTORY_CACHE_SEGMENT_POINTS,
+    HISTORY_CACHE_SETTLE_SECONDS,
+    HISTORY_CACHE_OPEN_TTL,
+    PRICE_STREAMING,
+    STREAM_KEEPALIVE_SECONDS,
+    ARCHIVE_DIR,
+    INSTRUMENT_REGISTRY_REFRESH,
+    INSTRUMENT_OPTIONS_LIMIT,
     _logging,
 )
+from archive import archived_days, read_prices, split_period
+from instrument_registry import (
+    CHANNEL,
+    VERSION_KEY,
+    InstrumentView,
+    parse_read,
+    queue_read,
+)
+from metrics import CONTENT_TYPE, REGISTRY
+from queries import (
+    SYNC_WATERMARKS,
+    aggregate_prices,
+    choose_bucket_size,
+    history_query,
+    rollup_size,
+)
+from price_cache import PriceCache
+from data_access import DataAccess
+from history_cache import HistoryCache, MemoryStore, RedisStore
 
 # Postgresql client
 psql_url = (
@@ -34,25 +76,77 @@ psql_url = (
     + f"{':' + PSQL_CLIENT.PORT if not PSQL_CLIENT.PORT in ['False', False] else ''}"
     + f"/{PSQL_DB}"
 )
-psql_engine = create_engine(psql_url, echo=True)
-Session = sessionmaker(bind=psql_engine)
-
 # Redis client
 redis_url = f"redis://{REDIS_CLIENT.HOST}:{REDIS_CLIENT.PORT}"
-redis = redis.from_url(
-    redis_url, password=REDIS_CLIENT.PASSWORD, encoding="utf-8", decode_responses=True
+# Pools of connections shared by all callbacks
+data_access = DataAccess(
+    psql_url,
+    redis_url,
+    REDIS_CLIENT.PASSWORD,
+    PSQL_POOL_SIZE,
+    PSQL_MAX_OVERFLOW,
+    REDIS_MAX_CONNECTIONS,
+    FRONTEND_QUERY_WORKERS,
+    PSQL_ECHO,
 )
 
 app = Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
 
+CALLBACK_LATENCY = REGISTRY.histogram(
+    "frontend_callback_seconds", "Time to query prices and build chart data", ("callback",)
+)
+QUERY_LATENCY = REGISTRY.histogram(
+    "frontend_query_seconds", "Time to get prices", ("source",)
+)
+RENDER_LATENCY = REGISTRY.histogram(
+    "frontend_render_latency_seconds",
+    "Time from generation of the latest price to sending it to the chart",
+)
+CACHE_REQUESTS = REGISTRY.counter(
+    "frontend_price_cache_requests", "Requests to price cache", ("result",)
+)
+STREAMS = REGISTRY.gauge("frontend_streams", "Open streams of prices")
+STREAMED_TICKS = REGISTRY.counter("frontend_streamed_ticks", "Prices sent to streams")
+HISTORY_CACHE_SEGMENTS = REGISTRY.counter(
+    "frontend_history_cache_segments", "Segments of history cache read", ("result",)
+)
+
+
+@app.server.route("/metrics")
+def metrics():
+    """Metrics of the frontend in Prometheus text format"""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
 # Layout elements
 my_text = dcc.Markdown(children="# Trading instruments charts")
+# Options are searched in the registry of instruments by a callback
 dropdown = dcc.Dropdown(
-    TRADING_INSTRUMENTS_WITH_NAMES, multi=True, placeholder="Select an instrument",
+    id="instrument-dropdown", options=[], multi=True, placeholder="Select an instrument",
+)
+history_range = dcc.Dropdown(
+    [
+        {"label": "Last 10 minutes", "value": 10},
+        {"label": "Last hour", "value": 60},
+        {"label": "Last day", "value": 24 * 60},
+        {"label": "Last week", "value": 7 * 24 * 60},
+    ],
+    value=10,
+    clearable=False,
 )
 selected_instruments = dcc.Markdown(children="")
 historical_data = dcc.Store(id="historical-data", data={})
 up_to_date_data = dcc.Store(id="up-to-date-data", data={})
+# New prices are streamed by assets/stream.js, which turns off polling by the interval
+stream_config = dcc.Store(
+    id="stream-config",
+    data={
+        "enabled": PRICE_STREAMING and PRICE_CACHE_SIZE > 0,
+        "url": "/stream",
+        "graph": "time-series-chart",
+        "max_points": CHART_MAX_POINTS,
+    },
+)
 button = html.Button("Show instrument's prices", id="show-secret", n_clicks=0)
 graph = dcc.Graph(id="time-series-chart", figure={})
 interval = dcc.Interval(
@@ -67,20 +161,279 @@ app.layout = dbc.Container(
         my_text,
         html.Br(),
         dropdown,
+        history_range,
         button,
         selected_instruments,
         graph,
         interval,
         historical_data,
         up_to_date_data,
+        stream_config,
     ]
 )
 
 logger = _logging()
 
+# Instruments of settings are shown until the registry is read from Redis
+instrument_view = InstrumentView(TRADING_INSTRUMENTS_WITH_NAMES)
+
+# The latest prices are read from memory, the cache is fed by channels of price generator
+price_cache = PriceCache(
+    data_access.redis_bytes,
+    instrument_view.instruments,
+    PRICE_CACHE_SIZE,
+    logger,
+    TICK_BATCH_CHANNEL,
+    TICK_CODEC_NEGOTIATE_INTERVAL,
+)
+if PRICE_CACHE_SIZE > 0:
+    price_cache.start()
+STREAMS.set_function(lambda: len(price_cache.subscriptions))
 
-def get_historical_data(selected_instruments, date_from=None, date_to=None):
-    """Get historical data for selected instruments from database."""
+
+def refresh_instruments():
+    """Read the registry of instruments from Redis, if its version is newer"""
+    version = int(data_access.redis.get(VERSION_KEY) or 0)
+    if version <= instrument_view.version:
+        return
+    changes = instrument_view.update(
+        *parse_read(queue_read(data_access.redis.pipeline(transaction=True)).execute())
+    )
+    if changes:
+        price_cache.update_instruments(instrument_view.instruments)
+        logger.info(
+            f"Registry of instruments version {instrument_view.version}: "
+            f"{len(changes[0])} added, {len(changes[1])} removed"
+        )
+
+
+def watch_instruments():
+    """
+    Follow changes of the registry of instruments, which price db updater mirrors to Redis:
+    on notifications and every INSTRUMENT_REGISTRY_REFRESH seconds,
+    in case a notification is missed
+    """
+    while True:
+        try:
+            pubsub = data_access.redis.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(CHANNEL)
+            while True:
+                refresh_instruments()
+                pubsub.get_message(timeout=INSTRUMENT_REGISTRY_REFRESH)
+        except Exception as ex:
+            logger.error(f"{ex} while refreshing instruments")
+        time.sleep(INSTRUMENT_REGISTRY_REFRESH)
+
+
+threading.Thread(target=watch_instruments, name="instruments", daemon=True).start()
+
+
+@app.server.route("/instruments")
+def list_instruments():
+    """
+    Page of registered instruments as JSON, whose id or name contains "q" parameter,
+    from "offset" with up to "limit" instruments
+    """
+    page, total = instrument_view.search(
+        request.args.get("q", ""),
+        max(request.args.get("offset", 0, type=int), 0),
+        min(max(request.args.get("limit", 100, type=int), 0), 1000),
+    )
+    return {
+        "version": instrument_view.version,
+        "total": total,
+        "instruments": [{"id": instr, "name": name} for instr, name in page],
+    }
+
+
+@app.callback(
+    Output(dropdown, "options"),
+    Input(dropdown, "search_value"),
+    State(dropdown, "value"),
+)
+def search_instruments(search_value, value):
+    """
+    Options of the dropdown: selected instruments and the first INSTRUMENT_OPTIONS_LIMIT
+    instruments matching the search, so that a huge registry isn't sent to the browser
+    """
+    page, total = instrument_view.search(search_value or "", 0, INSTRUMENT_OPTIONS_LIMIT)
+    shown = {instr for instr, _ in page}
+    selected = [
+        (instr, instrument_view.name(instr))
+        for instr in value or []
+        if instr not in shown
+    ]
+    # The browser filters options by the search too, so ids are searched with names
+    options = [
+        {"label": name, "value": instr, "search": f"{instr} {name}"}
+        for instr, name in selected + page
+    ]
+    if total > len(page):
+        options.append(
+            {
+                "label": f"{total - len(page)} more, type to narrow the search",
+                "value": "",
+                "search": search_value or "",
+                "disabled": True,
+            }
+        )
+    return options
+
+
+def parse_last_times(value):
+    """Timestamps in milliseconds per instrument from JSON object, empty if it's invalid"""
+    try:
+        last_times = json.loads(value or "{}")
+        return {str(instr): int(time_ms) for instr, time_ms in last_times.items()}
+    except (ValueError, TypeError, AttributeError):
+        return {}
+
+
+def format_ticks(ticks):
+    """
+    Ticks grouped by instrument as [time in ms, time on the chart, price],
+    times on the chart are floored to TICK_INTERVAL_MS as in update_prices
+    """
+    prices = {}
+    for instrument, created_at, price in ticks:
+        floored = datetime.datetime.utcfromtimestamp(
+            (created_at - created_at % TICK_INTERVAL_MS) / 1000
+        )
+        prices.setdefault(instrument, []).append(
+            [created_at, floored.strftime("%Y-%m-%d %H:%M:%S.%f"), price]
+        )
+    return prices
+
+
+@app.server.route("/stream")
+def stream():
+    """
+    Server-sent events with new prices of instruments listed in "instruments" parameter,
+    as they arrive to price cache from Redis.
+    Cached prices after "last_times" parameter, JSON object with timestamps in ms
+    per instrument, which the chart has, are sent first. Every event has the id
+    with timestamps sent so far, so that reconnecting browsers resume from them.
+    """
+    instruments = [
+        instrument
+        for instrument in request.args.get("instruments", "").split(",")
+        if instrument in price_cache.buffers
+    ]
+    if not (PRICE_STREAMING and PRICE_CACHE_SIZE > 0) or not instruments:
+        return Response(status=404)
+    last_times = {
+        **parse_last_times(request.args.get("last_times")),
+        # Sent by the browser, when it reconnects
+        **parse_last_times(request.headers.get("Last-Event-ID")),
+    }
+    last_times = {
+        instrument: last_times[instrument]
+        for instrument in instruments
+        if instrument in last_times
+    }
+    subscription = price_cache.subscribe(instruments, last_times=last_times)
+
+    def events():
+        try:
+            # Browser reconnects after a second, if the connection is lost
+            yield "retry: 1000\n\n"
+            while True:
+                ticks = subscription.get(STREAM_KEEPALIVE_SECONDS)
+                if not ticks:
+                    # Keeps proxies from closing the connection, finds closed ones
+                    yield ": keep-alive\n\n"
+                    continue
+                started_at = time.perf_counter()
+                for instrument, created_at, _ in ticks:
+                    if created_at > last_times.get(instrument, -1):
+                        last_times[instrument] = created_at
+                STREAMED_TICKS.inc(len(ticks))
+                event = (
+                    f"id: {json.dumps(last_times, separators=(',', ':'))}\n"
+                    f"data: {json.dumps(format_ticks(ticks))}\n\n"
+                )
+                RENDER_LATENCY.observe(
+                    time.time() - max(tick[1] for tick in ticks) / 1000
+                )
+                CALLBACK_LATENCY.labels(callback="stream").observe(
+                    time.perf_counter() - started_at
+                )
+                yield event
+        finally:
+            price_cache.unsubscribe(subscription)
+
+    return Response(
+        events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def load_history(instruments, date_from, date_to, bucket_size):
+    """
+    Prices of instruments, as they are stored or per bucket.
+    Prices of archived days are read from Parquet archive and the rest from database.
+    Buckets of rollups are always read from database, as rollups are small and never dropped.
+    """
+    if not ARCHIVE_DIR or rollup_size(bucket_size) is not None:
+        parts = [(False, date_from, date_to)]
+    else:
+        parts = split_period(date_from, date_to, archived_days(ARCHIVE_DIR))
+    frames = []
+    for archived, part_from, part_to in parts:
+        started_at = time.perf_counter()
+        if archived:
+            df_prices = read_prices(ARCHIVE_DIR, instruments, part_from, part_to)
+            if bucket_size:
+                df_prices = aggregate_prices(df_prices, bucket_size)
+            QUERY_LATENCY.labels(source="archive").observe(time.perf_counter() - started_at)
+        else:
+            df_prices = data_access.read_sql(
+                *history_query(instruments, part_from, part_to, bucket_size)
+            )
+            QUERY_LATENCY.labels(source="postgres").observe(
+                time.perf_counter() - started_at
+            )
+        frames.append(df_prices)
+    return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+
+def load_watermarks():
+    """Timestamp in ms per instrument, up to which prices are saved to database"""
+    return dict(data_access.read_sql(SYNC_WATERMARKS).values)
+
+
+# Historical prices are read through the cache, which asks database only for missing segments
+history_cache = None
+if HISTORY_CACHE != "off":
+    history_cache = HistoryCache(
+        load_history,
+        RedisStore(data_access.redis, HISTORY_CACHE_REDIS_TTL)
+        if HISTORY_CACHE == "redis"
+        else MemoryStore(HISTORY_CACHE_MAX_ROWS),
+        HISTORY_CACHE_SEGMENT_POINTS,
+        HISTORY_CACHE_SETTLE_SECONDS,
+        HISTORY_CACHE_OPEN_TTL,
+        TICK_INTERVAL_MS,
+        HISTORY_CACHE_SEGMENTS,
+        load_watermarks,
+    )
+
+
+def get_historical_data(
+    selected_instruments,
+    date_from=None,
+    date_to=None,
+    chart_width=CHART_WIDTH,
+    latest_period=None,
+):
+    """
+    Get historical data for selected instruments through history cache from database.
+    Long periods are downsampled in the database to buckets of prices (open, high, low, last),
+    so that there are no more points per instrument than chart_width.
+    latest_period (timedelta) of latest prices, which are drawn after historical ones,
+    shares chart_width with them.
+    """
     if not date_to:
         date_to = datetime.datetime.now() - datetime.timedelta(
             hours=2
@@ -88,28 +441,46 @@ def get_historical_data(selected_instruments, date_from=None, date_to=None):
     if not date_from:
         date_from = date_to - datetime.timedelta(minutes=10)
 
-    filters = []
-    if len(selected_instruments) > 0:
-        filters.append(TradingPrices.instrument_id.in_(selected_instruments))
-    filters.append(TradingPrices.created_at >= date_from)
-    filters.append(TradingPrices.created_at <= date_to)
-    with Session() as session:
-        df_instrument_prices = pd.read_sql(
-            session.query(TradingPrices).filter(and_(*filters)).statement, psql_engine
+    bucket_size = choose_bucket_size(
+        date_from,
+        date_to + (latest_period or datetime.timedelta()),
+        chart_width,
+        TICK_INTERVAL_MS,
+    )
+    if history_cache is not None and selected_instruments:
+        df_instrument_prices = history_cache.read(
+            selected_instruments, date_from, date_to, bucket_size
+        )
+    else:
+        df_instrument_prices = load_history(
+            selected_instruments, date_from, date_to, bucket_size
         )
 
-    df_instrument_prices["created_at"] = df_instrument_prices["created_at"].apply(
-        lambda x: x.replace(microsecond=0)
-    )
+    df_instrument_prices["created_at"] = pd.to_datetime(
+        df_instrument_prices["created_at"]
+    ).dt.floor(f"{TICK_INTERVAL_MS}ms")
     df_instrument_prices = df_instrument_prices.sort_values(
         by=["created_at", "instrument_id"]
     )
-    logger.info(f"Got historical data for instruments: {selected_instruments}")
+    logger.debug(
+        f"Got historical data for instruments: {selected_instruments} "
+        f"with {bucket_size or 'no'} seconds buckets"
+    )
     return df_instrument_prices
 
 
-def get_latest_prices(instruments=None, prev_time=None):
-    """Get latest prices of selected or all trading instruments from Redis cache"""
+def get_latest_prices(
+    instruments=None, prev_time=None, bucket_size=None, floor_to_tick=True
+):
+    """
+    Get latest prices of selected or all trading instruments from price cache
+    or from Redis if the cache doesn't have them.
+    If bucket_size (in seconds) is given, the last price of each bucket is returned.
+    Timestamps are floored to TICK_INTERVAL_MS if floor_to_tick is set.
+    """
+    aggregation = []
+    if bucket_size:
+        aggregation = ["AGGREGATION", "last", bucket_size * 1000]
     if not instruments:
         instruments = []
     current_time = int(datetime.datetime.now().timestamp() * 1000)
@@ -118,60 +489,145 @@ def get_latest_prices(instruments=None, prev_time=None):
             current_time - REDIS_RETENTION_PERIOD * 60000
         )  # Each minute equals 60000 ms
 
+    timeseries = None
+    started_at = time.perf_counter()
+    if not bucket_size and PRICE_CACHE_SIZE > 0:
+        timeseries = price_cache.get(instruments or price_cache.instruments, prev_time)
+        CACHE_REQUESTS.labels(result="miss" if timeseries is None else "hit").inc()
     # Get latest prices of selected trading_instruments from redis
-    if len(instruments) > 0:
-        timeseries = redis.execute_command(
+    if timeseries is not None:
+        QUERY_LATENCY.labels(source="cache").observe(time.perf_counter() - started_at)
+        logger.debug(
+            f"Got latest instrument prices for instruments {instruments} from cache"
+        )
+    elif len(instruments) > 0:
+        timeseries = data_access.execute_command(
             "TS.MRANGE",
             prev_time,
             current_time,
+            *aggregation,
             "FILTER",
             "type=trading_instruments",
             f'name=({",".join(instruments)})',
         )
-        logger.info(
+        QUERY_LATENCY.labels(source="redis").observe(time.perf_counter() - started_at)
+        logger.debug(
             f"Got latest instrument prices for instruments {instruments} from Redis"
         )
     else:
-        timeseries = redis.execute_command(
-            "TS.MRANGE", prev_time, current_time, "FILTER", "type=trading_instruments"
+        timeseries = data_access.execute_command(
+            "TS.MRANGE",
+            prev_time,
+            current_time,
+            *aggregation,
+            "FILTER",
+            "type=trading_instruments",
         )
-        logger.info("Got latest instrument prices for all instruments from Redis")
+        QUERY_LATENCY.labels(source="redis").observe(time.perf_counter() - started_at)
+        logger.debug("Got latest instrument prices for all instruments from Redis")
 
-    ts_lst = []
-    for timeseries_ in timeseries:
-        df_ts = pd.DataFrame(timeseries_[2], columns=["created_at", "price"])
-        df_ts["instrument_id"] = timeseries_[0]
-        ts_lst.append(df_ts)
-    df_latest_prices = pd.concat(ts_lst, ignore_index=True)
-    df_latest_prices["price"] = df_latest_prices["price"].astype("int")
-    df_latest_prices["created_at"] = pd.to_datetime(
-        df_latest_prices["created_at"], unit="ms"
-    )
-    df_latest_prices["created_at"] = df_latest_prices["created_at"].apply(
-        lambda x: x.replace(microsecond=0)
+    return decode_mrange(timeseries, TICK_INTERVAL_MS if floor_to_tick else None)
+
+
+def get_last_times(df_prices):
+    """Timestamp (in milliseconds) of the latest price of each instrument"""
+    return (
+        df_prices.groupby("instrument_id", observed=True)["created_at"]
+        .max()
+        .astype("int64")
+        // 1000000  # ns to ms
+    ).to_dict()
+
+
+def build_figure(df_instrument_prices, instruments):
+    """Price chart with a trace per instrument, in the order of instruments"""
+    fig = go.Figure(
+        layout=go.Layout(
+            xaxis=dict(showgrid=True, title="Time", color="darkred"),
+            yaxis=dict(showgrid=True, title="Price", color="darkblue"),
+        )
     )
-    return df_latest_prices
+
+    for instrument in instruments:
+        df_instrument = df_instrument_prices[
+            df_instrument_prices["instrument_id"] == instrument
+        ]
+        fig.add_trace(
+            go.Scatter(
+                x=df_instrument["created_at"],
+                y=df_instrument["price"],
+                name=instrument_view.name(instrument),
+            )
+        )
+    return fig
 
 
 @app.callback(
     Output(selected_instruments, "children"),
+    Output("time-series-chart", "figure"),
     Output("historical-data", "data"),
-    [State(dropdown, "value")],
+    [State(dropdown, "value"), State(history_range, "value")],
     Input(button, "n_clicks"),
     prevent_initial_call=True,
 )
-def get_data(dropdown, button):
+def get_data(dropdown, history_range, button):
     """
-    Get historical and latest data for selected trading instruments
+    Get historical and latest data for selected trading instruments and draw the price chart.
+    After that update_prices only appends new prices to the chart.
     """
+    started_at = time.perf_counter()
     prev_time = None
     selected_instruments = dropdown.copy()
-    df_instrument_prices = get_historical_data(selected_instruments)
-
-    if df_instrument_prices.shape[0] > 0:  # we have some historical data
-        prev_time = df_instrument_prices["created_at"].iloc[-1]
-        prev_time = int(prev_time.timestamp() * 1000)  # in miliseconds
-    df_latest_prices = get_latest_prices(selected_instruments, prev_time)
+    date_to = datetime.datetime.now() - datetime.timedelta(
+        hours=2
+    )  # because of postgresql time settings
+    date_from = date_to - datetime.timedelta(minutes=history_range)
+    # Latest prices of Redis retention period are drawn after historical ones,
+    # so buckets are chosen for both to fit the chart, with a partial bucket
+    # at the start of each of them
+    latest_period = datetime.timedelta(minutes=REDIS_RETENTION_PERIOD)
+    chart_width = CHART_WIDTH - 2
+    bucket_size = choose_bucket_size(
+        date_from, date_to + latest_period, chart_width, TICK_INTERVAL_MS
+    )
+    if FRONTEND_CONCURRENT_QUERIES:
+        # Redis is asked for its whole retention period while the database is queried,
+        # so the callback waits for the slower of them, not for both
+        latest_prices = data_access.submit(
+            get_latest_prices, selected_instruments, None, bucket_size, False
+        )
+        df_instrument_prices = get_historical_data(
+            selected_instruments, date_from, date_to, chart_width, latest_period
+        )
+        df_latest_prices = latest_prices.result()
+    else:
+        df_instrument_prices = get_historical_data(
+            selected_instruments, date_from, date_to, chart_width, latest_period
+        )
+        if df_instrument_prices.shape[0] > 0:  # we have some historical data
+            prev_time = df_instrument_prices["created_at"].iloc[-1]
+            prev_time = int(prev_time.timestamp() * 1000)  # in miliseconds
+        df_latest_prices = get_latest_prices(
+            selected_instruments, prev_time, bucket_size, floor_to_tick=False
+        )
+    # Prices after these timestamps will be appended to the chart by update_prices
+    last_times = {
+        **get_last_times(df_instrument_prices),
+        **get_last_times(df_latest_prices),
+    }
+    df_latest_prices["created_at"] = df_latest_prices["created_at"].dt.floor(
+        f"{TICK_INTERVAL_MS}ms"
+    )
+    # Historical buckets, which overlap latest prices of an instrument, are replaced by them
+    if df_latest_prices.shape[0] > 0:
+        latest_from = df_latest_prices.groupby(
+            df_latest_prices["instrument_id"].astype(str)
+        )["created_at"].min()
+        cutoff = df_instrument_prices["instrument_id"].astype(str).map(latest_from)
+        overlaps = cutoff.notna() & (
+            df_instrument_prices["created_at"] >= pd.to_datetime(cutoff)
+        )
+        df_instrument_prices = df_instrument_prices[~overlaps]
     df_instrument_prices_ = pd.concat(
         [df_instrument_prices, df_latest_prices], ignore_index=True
     )
@@ -181,66 +637,91 @@ def get_data(dropdown, button):
     df_instrument_prices = df_instrument_prices_.drop_duplicates(
         subset=["created_at", "instrument_id"], keep="first"
     )
-    return selected_instruments, df_instrument_prices.to_dict("records")
+    stream_state = {
+        "version": button,
+        "instruments": selected_instruments,
+        "last_times": last_times,
+    }
+    figure = build_figure(df_instrument_prices, selected_instruments)
+    CALLBACK_LATENCY.labels(callback="get_data").observe(time.perf_counter() - started_at)
+    return selected_instruments, figure, stream_state
+
+
+# Stream of new prices is opened for the instruments on the chart, when it is redrawn.
+# Interval is disabled while prices are streamed
+app.clientside_callback(
+    ClientsideFunction(namespace="stream", function_name="subscribe"),
+    Output("latest_prices", "disabled"),
+    Input("historical-data", "data"),
+    State("stream-config", "data"),
+)
 
 
 @app.callback(
-    Output("time-series-chart", "figure"),
+    Output("time-series-chart", "extendData"),
     Output("up-to-date-data", "data"),
     [Input("latest_prices", "n_intervals")],
     State("historical-data", "data"),
     State("up-to-date-data", "data"),
-    State(selected_instruments, "children"),
     prevent_initial_call=True,
 )
-def update_prices(n_intervals, historical_data, up_to_date_data, selected_instruments):
-    """This function redraw the price chart with trading instruments every second"""
-    if (
-        n_intervals == 0 or selected_instruments == [] or historical_data == {}
-    ):  # at the beginning
+def update_prices(n_intervals, historical_data, up_to_date_data):
+    """
+    This function appends prices, which came after the last update, to the price chart every second,
+    when they aren't streamed to the browser.
+    Only new prices are sent to the browser and the chart keeps
+    the last CHART_MAX_POINTS prices of each instrument.
+    """
+    if n_intervals == 0 or historical_data == {}:  # at the beginning
+        raise PreventUpdate
+    # If the user selected another set of instruments, the chart was redrawn by get_data
+    if up_to_date_data.get("version") != historical_data["version"]:
+        up_to_date_data = historical_data
+    selected_instruments = up_to_date_data["instruments"]
+    last_times = up_to_date_data["last_times"]
+    if selected_instruments == []:
         raise PreventUpdate
-    current_instruments = set(data["instrument_id"] for data in up_to_date_data)
-    # If the user selected another set of instruments  we need to get historical data for them
-    if current_instruments != set(selected_instruments):
-        up_to_date_data = historical_data.copy()
 
-    df_instrument_prices = pd.DataFrame.from_dict(up_to_date_data)
-    df_instrument_prices["created_at"] = pd.to_datetime(
-        df_instrument_prices["created_at"]
+    started_at = time.perf_counter()
+    prev_time = None
+    if len(last_times) == len(selected_instruments):
+        prev_time = min(last_times.values()) + 1
+    df_latest_prices = get_latest_prices(
+        selected_instruments, prev_time, floor_to_tick=False
     )
-    df_latest_prices = get_latest_prices(selected_instruments)
-
-    if df_latest_prices.shape[0] > 0:
-        df_instrument_prices_ = pd.concat(
-            [df_instrument_prices, df_latest_prices], ignore_index=True
-        )
-        df_instrument_prices_ = df_instrument_prices_.sort_values(
-            by=["created_at", "instrument_id"]
-        )
-        df_instrument_prices = df_instrument_prices_.drop_duplicates(
-            subset=["created_at", "instrument_id"], keep="first"
-        )
+    # Skip prices which are already on the chart
+    created_at_ms = df_latest_prices["created_at"].astype("int64") // 1000000
+    synced_at = df_latest_prices["instrument_id"].astype(str).map(last_times)
+    df_latest_prices = df_latest_prices[~(created_at_ms <= synced_at)]
+    if df_latest_prices.shape[0] == 0:
+        if up_to_date_data is historical_data:
+            return no_update, up_to_date_data
+        raise PreventUpdate
 
-    fig = go.Figure(
-        layout=go.Layout(
-            xaxis=dict(showgrid=True, title="Time", color="darkred"),
-            yaxis=dict(showgrid=True, title="Price", color="darkblue"),
-        )
+    last_times = {**last_times, **get_last_times(df_latest_prices)}
+    RENDER_LATENCY.observe(time.time() - max(last_times.values()) / 1000)
+    df_latest_prices = df_latest_prices.sort_values(by="created_at")
+    df_latest_prices["created_at"] = df_latest_prices["created_at"].dt.floor(
+        f"{TICK_INTERVAL_MS}ms"
     )
-
+    new_prices = {"x": [], "y": []}
     for instrument in selected_instruments:
-        df_instrument = df_instrument_prices[
-            df_instrument_prices["instrument_id"] == instrument
+        df_instrument = df_latest_prices[
+            df_latest_prices["instrument_id"] == instrument
         ]
-        df_instrument.sort_values(by="created_at")
-        fig.add_trace(
-            go.Scatter(
-                x=df_instrument["created_at"],
-                y=df_instrument["price"],
-                name=TRADING_INSTRUMENTS_WITH_NAMES[instrument],
-            )
-        )
-    return fig, df_instrument_prices.to_dict("records")
+        new_prices["x"].append(df_instrument["created_at"].astype(str).tolist())
+        new_prices["y"].append(df_instrument["price"].tolist())
+    CALLBACK_LATENCY.labels(callback="update_prices").observe(
+        time.perf_counter() - started_at
+    )
+    return (
+        (new_prices, list(range(len(selected_instruments))), CHART_MAX_POINTS),
+        {
+            "version": up_to_date_data["version"],
+            "instruments": selected_instruments,
+            "last_times": last_times,
+        },
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,243 @@
+"""
+In-process cache of the latest trading prices, fed by Redis pub/sub
+Copyright © 2022. All Rights are Reserved by Maria Chichkan
+"""
+
+import os
+import time
+import socket
+import threading
+from collections import deque
+
+from tick_codecs import CONSUMER_KEY_PREFIX, SUPPORTED, decode
+
+
+class Subscription:
+    """
+    Ticks of some instruments waiting to be streamed to a browser.
+    Only the latest ticks are kept, if the browser reads slower than they come.
+    """
+    def __init__(self, instruments, size):
+        self.instruments = set(instruments)
+        self.ticks = deque(maxlen=size)
+        self.condition = threading.Condition()
+
+    def put(self, ticks):
+        with self.condition:
+            self.ticks.extend(tick for tick in ticks if tick[0] in self.instruments)
+            if self.ticks:
+                self.condition.notify()
+
+    def get(self, timeout):
+        """All waiting ticks as list of (instrument, time, value), empty after timeout"""
+        with self.condition:
+            if not self.ticks:
+                self.condition.wait(timeout)
+            ticks = list(self.ticks)
+            self.ticks.clear()
+        return ticks
+
+
+class PriceCache:
+    """
+    This class keeps the latest prices of trading instruments in memory.
+    A background thread consumes the channels, to which price generator publishes prices,
+    into a bounded ring buffer per instrument, so callbacks read prices without querying Redis,
+    and passes them to subscriptions of streams as they arrive.
+    """
+    def __init__(
+        self,
+        redis_client,
+        instruments,
+        size,
+        logger,
+        batch_channel="",
+        register_interval=10,
+    ):
+        """
+        Args:
+            redis_client: Redis client, which doesn't decode responses (ticks may be binary)
+            instruments: list, channels are named after instruments
+            size: int, maximum number of prices kept per instrument
+            logger: Logger
+            batch_channel: string, channel with batched frames of all instruments if any
+            register_interval: int, how often (in seconds) the cache registers
+                formats of tick messages it can decode
+        """
+        self.redis = redis_client
+        self.instruments = list(instruments)
+        self.batch_channel = batch_channel
+        self.channels = self.instruments + ([batch_channel] if batch_channel else [])
+        # Instruments, which replace the current ones, set by update_instruments
+        self.pending = None
+        self.register_interval = register_interval
+        self.consumer_key = (
+            f"{CONSUMER_KEY_PREFIX}{socket.gethostname()}:{os.getpid()}"
+        )
+        self.size = size
+        self.buffers = {instr: deque(maxlen=size) for instr in self.instruments}
+        self.lock = threading.Lock()
+        self.subscriptions = set()
+        self.logger = logger
+        self.thread = None
+
+    def start(self):
+        """Start consuming prices in a background thread"""
+        if self.thread is None:
+            self.thread = threading.Thread(
+                target=self.consume, name="price-cache", daemon=True
+            )
+            self.thread.start()
+
+    def consume(self):
+        """
+        Consume prices from Redis channels, resubscribing after connection errors.
+        Formats of tick messages the cache can decode are registered for price generator.
+        """
+        while True:
+            try:
+                self.apply_instruments(None)
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                if self.channels:
+                    pubsub.subscribe(*self.channels)
+                self.logger.info(
+                    f"Price cache subscribed to {len(self.instruments)} instruments"
+                )
+                registered_at = 0
+                while True:
+                    self.apply_instruments(pubsub)
+                    if time.monotonic() - registered_at >= self.register_interval:
+                        self.redis.set(
+                            self.consumer_key, SUPPORTED, ex=3 * self.register_interval
+                        )
+                        registered_at = time.monotonic()
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is None:
+                        continue
+                    try:
+                        ticks = decode(message["data"], message["channel"].decode())
+                    except Exception as ex:
+                        # Undecodable messages are skipped, the subscription is fine
+                        self.logger.error(
+                            f"{ex} while decoding prices of {message['channel']}"
+                        )
+                        continue
+                    for instrument, created_at, price in ticks:
+                        if instrument in self.buffers:
+                            self.add(instrument, created_at, price)
+                    with self.lock:
+                        subscriptions = list(self.subscriptions)
+                    for subscription in subscriptions:
+                        subscription.put(ticks)
+            except Exception as ex:
+                self.logger.error(f"{ex} while consuming prices to price cache")
+            # Prices published while we were disconnected are lost, so buffers have a gap
+            self.clear()
+            time.sleep(1)
+
+    def update_instruments(self, instruments):
+        """Replace instruments, channels are changed by the consuming thread"""
+        with self.lock:
+            self.pending = list(instruments)
+
+    def apply_instruments(self, pubsub):
+        """
+        Subscribe to channels of added instruments and unsubscribe from removed ones
+        Args:
+            pubsub: PubSub or None while disconnected
+        """
+        with self.lock:
+            instruments, self.pending = self.pending, None
+        if instruments is None:
+            return
+        current = set(self.instruments)
+        added = [instr for instr in instruments if instr not in current]
+        removed = list(current.difference(instruments))
+        # Channels are resubscribed from the new state, if the connection fails
+        with self.lock:
+            for instrument in added:
+                self.buffers[instrument] = deque(maxlen=self.size)
+            for instrument in removed:
+                del self.buffers[instrument]
+            self.instruments = list(instruments)
+            self.channels = self.instruments + (
+                [self.batch_channel] if self.batch_channel else []
+            )
+        if pubsub is not None:
+            if added:
+                pubsub.subscribe(*added)
+            if removed:
+                pubsub.unsubscribe(*removed)
+        self.logger.info(
+            f"Price cache has {len(self.instruments)} instruments: "
+            f"{len(added)} added, {len(removed)} removed"
+        )
+
+    def add(self, instrument, created_at, price):
+        """
+        Args:
+            instrument: string
+            created_at: int, timestamp in milliseconds
+            price: int
+        """
+        with self.lock:
+            self.buffers[instrument].append((created_at, price))
+
+    def subscribe(self, instruments, size=10000, last_times=None):
+        """
+        Subscription, which receives ticks of instruments from now on.
+        Cached ticks after last_times are put to it first, so that none are missed
+        between them and the subscription. Some may be received twice.
+        Args:
+            instruments: list
+            size: int, number of ticks waiting to be read at most
+            last_times: dict, timestamp in milliseconds per instrument
+        """
+        subscription = Subscription(instruments, size)
+        with self.lock:
+            self.subscriptions.add(subscription)
+            for instrument, last_time in (last_times or {}).items():
+                buffer = self.buffers.get(instrument)
+                if buffer:
+                    subscription.put(
+                        [
+                            (instrument, created_at, price)
+                            for created_at, price in buffer
+                            if created_at > last_time
+                        ]
+                    )
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def clear(self):
+        with self.lock:
+            for buffer in self.buffers.values():
+                buffer.clear()
+
+    def get(self, instruments, prev_time):
+        """
+        Prices of instruments since prev_time in the format of TS.MRANGE reply.
+        Returns None if the cache doesn't have all of them yet,
+        e.g. just after start or if prev_time is older than the oldest cached price.
+        Args:
+            instruments: list
+            prev_time: int, timestamp in milliseconds
+        """
+        timeseries = []
+        with self.lock:
+            for instrument in instruments:
+                buffer = self.buffers.get(instrument)
+                # Every price since the oldest one in the buffer was received
+                if not buffer or buffer[0][0] > prev_time:
+                    return None
+                timeseries.append(
+                    [
+                        instrument,
+                        [],
+                        [list(tick) for tick in buffer if tick[0] >= prev_time],
+                    ]
+                )
+        return timeseries
@@ -0,0 +1,187 @@
+"""
+Resolution-aware queries of historical trading prices for charts
+Copyright © 2022. All Rights are Reserved by Maria Chichkan
+"""
+
+import datetime
+from sqlalchemy import bindparam, select, text
+
+from db_orm import TradingPrices
+
+# Bucket sizes (in seconds) which are used to downsample prices for charts
+BUCKET_SIZES = [
+    1, 2, 5, 10, 15, 30, 60, 120, 300, 600, 900, 1800, 3600, 7200, 14400, 43200, 86400
+]
+
+# Prices are aggregated per bucket: open, high, low, last (as price) and number of prices.
+# Buckets are counted from the epoch, so they are the same for every query
+OHLC_QUERY = """
+SELECT instrument_id,
+       TIMESTAMP 'epoch'
+       + FLOOR(EXTRACT(EPOCH FROM created_at) / :bucket_size) * :bucket_size
+       * INTERVAL '1 second' AS created_at,
+       (ARRAY_AGG(price ORDER BY created_at))[1] AS open,
+       MAX(price) AS high,
+       MIN(price) AS low,
+       (ARRAY_AGG(price ORDER BY created_at DESC))[1] AS price,
+       COUNT(*) AS count
+FROM trading_prices
+WHERE created_at BETWEEN :date_from AND :date_to {instrument_filter}
+GROUP BY 1, 2
+ORDER BY 2, 1
+"""
+
+# Rollups maintained by price db updater are aggregated further to the bucket size
+OHLC_ROLLUP_QUERY = """
+SELECT instrument_id,
+       TIMESTAMP 'epoch'
+       + FLOOR(EXTRACT(EPOCH FROM bucket) / :bucket_size) * :bucket_size
+       * INTERVAL '1 second' AS created_at,
+       (ARRAY_AGG(open ORDER BY bucket))[1] AS open,
+       MAX(high) AS high,
+       MIN(low) AS low,
+       (ARRAY_AGG(close ORDER BY bucket DESC))[1] AS price,
+       SUM(count) AS count
+FROM {table}
+WHERE bucket BETWEEN :date_from AND :date_to {instrument_filter}
+GROUP BY 1, 2
+ORDER BY 2, 1
+"""
+
+# Rollup tables and their bucket sizes (in seconds), from the biggest one
+ROLLUP_TABLES = [
+    ("trading_prices_1h", 3600),
+    ("trading_prices_5m", 300),
+    ("trading_prices_1m", 60),
+]
+
+# Statements are built once, so SQLAlchemy compiles each of them only once
+# and reuses it from its cache for every callback.
+# Prices of selected instruments are read by index-only scans of the covering index
+# (instrument_id, created_at) INCLUDE (price), time windows of all instruments
+# through BRIN index on created_at (see migrations of price db updater)
+RAW_PRICES = select(TradingPrices).where(
+    TradingPrices.created_at.between(bindparam("date_from"), bindparam("date_to"))
+)
+RAW_PRICES_OF_INSTRUMENTS = RAW_PRICES.where(
+    TradingPrices.instrument_id.in_(bindparam("instruments", expanding=True))
+)
+OHLC_PRICES = text(OHLC_QUERY.format(instrument_filter=""))
+OHLC_PRICES_OF_INSTRUMENTS = text(
+    OHLC_QUERY.format(instrument_filter="AND instrument_id IN :instruments")
+).bindparams(bindparam("instruments", expanding=True))
+OHLC_ROLLUPS = {
+    bucket_size: text(
+        OHLC_ROLLUP_QUERY.format(table=table, instrument_filter="")
+    )
+    for table, bucket_size in ROLLUP_TABLES
+}
+OHLC_ROLLUPS_OF_INSTRUMENTS = {
+    bucket_size: text(
+        OHLC_ROLLUP_QUERY.format(
+            table=table, instrument_filter="AND instrument_id IN :instruments"
+        )
+    ).bindparams(bindparam("instruments", expanding=True))
+    for table, bucket_size in ROLLUP_TABLES
+}
+
+
+# Timestamps (in milliseconds), up to which price db updater has saved prices
+SYNC_WATERMARKS = text("SELECT instrument_id, synced_at FROM sync_watermarks")
+
+
+def choose_bucket_size(date_from, date_to, chart_width, tick_interval_ms=1000):
+    """
+    The smallest bucket size (in seconds), which gives no more points per instrument
+    than the chart has pixels, or None if prices as they are stored fit the chart
+    Args:
+        date_from: datetime
+        date_to: datetime
+        chart_width: int, width of the chart in pixels
+        tick_interval_ms: int, interval between prices of an instrument
+    """
+    seconds = (date_to - date_from).total_seconds()
+    if seconds * 1000 / tick_interval_ms <= chart_width:
+        return None
+    for bucket_size in BUCKET_SIZES:
+        if seconds / bucket_size <= chart_width:
+            return bucket_size
+    return BUCKET_SIZES[-1]
+
+
+def rollup_size(bucket_size):
+    """Bucket size of the biggest rollup, which buckets of bucket_size are aggregated from"""
+    if bucket_size is None:
+        return None
+    for _, size in ROLLUP_TABLES:
+        if bucket_size % size == 0:
+            return size
+    return None
+
+
+def aggregate_prices(df_prices, bucket_size):
+    """
+    Aggregate prices per bucket as OHLC_QUERY does, e.g. prices read from archive
+    Args:
+        df_prices: DataFrame with instrument_id, created_at and price
+        bucket_size: int in seconds
+    """
+    df_prices = df_prices.sort_values("created_at")
+    grouped = df_prices.groupby(
+        [df_prices["instrument_id"], df_prices["created_at"].dt.floor(f"{bucket_size}s")]
+    )["price"]
+    return (
+        grouped.agg(open="first", high="max", low="min", price="last", count="count")
+        .reset_index()
+        .sort_values(["created_at", "instrument_id"])
+    )
+
+
+def history_query(instruments, date_from, date_to, bucket_size):
+    """
+    Statement and its parameters, which select prices of instruments as they are stored
+    or aggregated per bucket in the database.
+    Buckets of a minute and longer are aggregated from the biggest fitting rollup,
+    so long periods read a few hundred rows instead of millions.
+    Args:
+        instruments: list, all instruments if empty
+        date_from: datetime
+        date_to: datetime
+        bucket_size: int in seconds or None for prices as they are stored
+    """
+    if bucket_size is not None:
+        # Buckets are whole, the first one starts at or before date_from,
+        # so it has all prices and rollups of its period
+        epoch = datetime.datetime(1970, 1, 1)
+        date_from = epoch + datetime.timedelta(
+            seconds=(date_from - epoch).total_seconds() // bucket_size * bucket_size
+        )
+    params = {"date_from": date_from, "date_to": date_to}
+    if instruments:
+        params["instruments"] = list(instruments)
+    if bucket_size is None:
+        return (RAW_PRICES_OF_INSTRUMENTS if instruments else RAW_PRICES), params
+    params["bucket_size"] = bucket_size
+    size = rollup_size(bucket_size)
+    if size is not None:
+        statements = OHLC_ROLLUPS_OF_INSTRUMENTS if instruments else OHLC_ROLLUPS
+        return statements[size], params
+    return (OHLC_PRICES_OF_INSTRUMENTS if instruments else OHLC_PRICES), params
+
+
+def plan_nodes(plan):
+    """Nodes of a plan returned by DataAccess.explain, depth first from the top one"""
+    nodes = [plan.get("Plan", plan)]
+    while nodes:
+        node = nodes.pop()
+        yield node
+        nodes.extend(reversed(node.get("Plans", [])))
+
+
+def plan_scans(plan):
+    """Node types of scans of a plan with names of their indexes (None for other scans)"""
+    return [
+        (node["Node Type"], node.get("Index Name"))
+        for node in plan_nodes(plan)
+        if node["Node Type"].endswith("Scan")
+    ]
@@ -0,0 +1,131 @@
+"""
+Export of closed days of trading prices to Parquet archive
+Copyright © 2022. All Rights are Reserved by Maria Chichkan
+"""
+
+import asyncio
+import datetime
+import asyncpg
+
+from archive import DayWriter, archived_days
+
+# Every instrument with prices in the partition, including ones without watermarks
+# (e.g. prices moved from the legacy table or of instruments, which were removed)
+SELECT_INSTRUMENTS = "SELECT DISTINCT instrument_id FROM {partition} ORDER BY 1"
+
+# A day is exported by one replica of price db updater at a time, the others skip it
+LOCK_DAY = "SELECT pg_try_advisory_xact_lock(hashtext('trading_prices_archive'), $1)"
+
+SELECT_PRICES = """
+SELECT instrument_id, (EXTRACT(EPOCH FROM created_at) * 1000)::BIGINT, price
+FROM {partition}
+WHERE instrument_id = ANY($1::VARCHAR[])
+ORDER BY instrument_id, created_at
+"""
+
+
+class Archiver:
+    """
+    This class exports daily partitions of trading_prices to Parquet files,
+    partitioned by day and instrument and compressed, when days are closed.
+    Partitions are dropped by retention only after their days are archived.
+    """
+    def __init__(
+        self,
+        dsn,
+        partitions,
+        logger,
+        root,
+        after_hours=1,
+        compression="zstd",
+        batch_instruments=10,
+    ):
+        """
+        Args:
+            dsn: string, PostgreSQL connection string, the archiver has its own connection,
+                so that COPY of new prices doesn't wait for exports
+            partitions: PartitionManager
+            logger: Logger
+            root: string, folder of the archive
+            after_hours: int, a day is archived this number of hours after its end,
+                when late prices are saved
+            compression: string, Parquet compression codec
+            batch_instruments: int, number of instruments read from database at once
+        """
+        self.dsn = dsn
+        self.partitions = partitions
+        self.logger = logger
+        self.root = root
+        self.after_hours = after_hours
+        self.compression = compression
+        self.batch_instruments = batch_instruments
+
+    def due_days(self):
+        """Closed days with partitions, which aren't archived yet"""
+        now = datetime.datetime.utcnow()
+        archived = archived_days(self.root)
+        return sorted(
+            day
+            for day in self.partitions.days
+            if day not in archived
+            and datetime.datetime.combine(day, datetime.time())
+            + datetime.timedelta(days=1, hours=self.after_hours)
+            <= now
+        )
+
+    async def archive_day(self, day):
+        """
+        Export prices of the day instrument by instrument, sorted by time.
+        Returns False, if another replica is exporting or has exported the day.
+        """
+        loop = asyncio.get_running_loop()
+        partition = self.partitions.partition_name(day)
+        query = SELECT_PRICES.format(partition=partition)
+        conn = await asyncpg.connect(self.dsn)
+        try:
+            # The lock is held until the end of the transaction
+            async with conn.transaction():
+                if not await conn.fetchval(LOCK_DAY, day.toordinal()):
+                    return False
+                if day in archived_days(self.root):
+                    return False
+                instruments = [
+                    record[0]
+                    for record in await conn.fetch(
+                        SELECT_INSTRUMENTS.format(partition=partition)
+                    )
+                ]
+                # Files are written in threads, so that the pipeline isn't blocked
+                writer = await loop.run_in_executor(
+                    None, DayWriter, self.root, day, self.compression
+                )
+                rows = 0
+                try:
+                    for i in range(0, len(instruments), self.batch_instruments):
+                        records = await conn.fetch(
+                            query, instruments[i : i + self.batch_instruments]
+                        )
+                        if records:
+                            await loop.run_in_executor(
+                                None, writer.write, *zip(*records)
+                            )
+                            rows += len(records)
+                    committed = await loop.run_in_executor(None, writer.commit)
+                except BaseException:
+                    await loop.run_in_executor(None, writer.abort)
+                    raise
+        finally:
+            await conn.close()
+        if committed:
+            self.logger.info(f"Archived {rows} prices of {day}")
+        return committed
+
+    async def run(self, interval=600):
+        """Archive closed days every interval seconds"""
+        while True:
+            for day in self.due_days():
+                try:
+                    await self.archive_day(day)
+                except Exception as ex:
+                    self.logger.error(f"{ex} while archiving prices of {day}")
+            await asyncio.sleep(interval)
@@ -0,0 +1,97 @@
+"""
+Bulk loading of trading prices to PostgreSQL with binary COPY
+Copyright © 2022. All Rights are Reserved by Maria Chichkan
+"""
+
+import asyncio
+import asyncpg
+
+# Staging table lives as long as the connection and is emptied after every transaction
+CREATE_STAGING_TABLE = """
+CREATE TEMPORARY TABLE IF NOT EXISTS trading_prices_staging (
+    instrument_id VARCHAR(50),
+    created_at_ms BIGINT,
+    price INTEGER
+) ON COMMIT DELETE ROWS
+"""
+
+MERGE_STAGING_TABLE = """
+INSERT INTO trading_prices (instrument_id, created_at, price)
+SELECT instrument_id, TIMESTAMP 'epoch' + created_at_ms * INTERVAL '1 millisecond', price
+FROM trading_prices_staging
+ON CONFLICT (instrument_id, created_at) DO NOTHING
+"""
+
+
+class BulkLoader:
+    """
+    This class streams trading prices to a staging table with asyncpg binary COPY
+    and merges them into trading_prices, skipping rows which are already saved.
+    Batches are loaded concurrently, each one in its own connection and transaction.
+    """
+    def __init__(self, dsn, batch_size=50000, concurrency=4):
+        """
+        Args:
+            dsn: string, PostgreSQL connection string
+            batch_size: int, maximum number of rows in one COPY
+            concurrency: int, maximum number of batches loaded at the same time
+        """
+        self.dsn = dsn
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.pool = None
+
+    async def connect(self):
+        """Create pool of connections, one per concurrent batch"""
+        if self.pool is None:
+            self.pool = await asyncpg.create_pool(
+                self.dsn, min_size=1, max_size=self.concurrency
+            )
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def load_batch(self, records):
+        """
+        Copy one batch of rows and merge it into trading_prices.
+        Returns the number of inserted rows.
+        Args:
+            records: iterable of (instrument_id, created_at in ms, price) tuples
+        """
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(CREATE_STAGING_TABLE)
+                await conn.copy_records_to_table(
+                    "trading_prices_staging",
+                    records=records,
+                    columns=["instrument_id", "created_at_ms", "price"],
+                )
+                status = await conn.execute(MERGE_STAGING_TABLE)
+        # status looks like "INSERT 0 <number of rows>"
+        return int(status.split()[-1])
+
+    async def load(self, instrument_ids, created_at_ms, prices):
+        """
+        Load rows given as columns of the same length.
+        Returns the number of inserted rows.
+        Args:
+            instrument_ids: list of strings
+            created_at_ms: list of timestamps in milliseconds
+            prices: list of ints
+        """
+        await self.connect()
+        inserted = await asyncio.gather(
+            *(
+                self.load_batch(
+                    zip(
+                        instrument_ids[i : i + self.batch_size],
+                        created_at_ms[i : i + self.batch_size],
+                        prices[i : i + self.batch_size],
+                    )
+                )
+                for i in range(0, len(prices), self.batch_size)
+            )
+        )
+        return sum(inserted)
@@ -4,29 +4,97 @@ Copyright © 2022. All Rights are Reserved by Maria Chichkan
 """
 
 import sys
+import socket
 import datetime
 import asyncio
-import pandas as pd
 import aioredis
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, select
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
 sys.path.insert(0, "../utils")
-from db_orm import TradingPrices
+from db_orm import Base, SyncWatermarks
+from mrange import decode_mrange
+from archive import archived_days
 from settings import (
     REDIS_CLIENT,
     PSQL_CLIENT,
     PSQL_DB,
+    PSQL_COPY_BATCH_SIZE,
+    PSQL_COPY_CONCURRENCY,
+    PSQL_PARTITION_PRECREATE_DAYS,
+    PSQL_RETENTION_DAYS,
     REDIS_RETENTION_PERIOD,
+    DB_UPDATER_POLL_INTERVAL,
+    DB_UPDATER_FLUSH_INTERVAL,
+    DB_UPDATER_FLUSH_SIZE,
+    DB_UPDATER_WRITERS,
+    DB_UPDATER_QUEUE_SIZE,
+    INGESTION_MODE,
+    PRICE_STREAM,
+    PRICE_STREAM_GROUP,
+    PRICE_STREAM_CONSUMER,
+    PRICE_STREAM_READ_COUNT,
+    PRICE_STREAM_CLAIM_IDLE_MS,
+    PRICE_STREAM_DEAD_LETTER,
+    PRICE_STREAM_MAXLEN,
+    METRICS_PORT,
+    PSQL_ECHO,
+    ARCHIVE_DIR,
+    ARCHIVE_AFTER_HOURS,
+    ARCHIVE_COMPRESSION,
+    ARCHIVE_INTERVAL,
+    ARCHIVE_BATCH_INSTRUMENTS,
+    INSTRUMENT_REGISTRY_REFRESH,
+    TRADING_INSTRUMENTS_WITH_NAMES,
     _logging,
 )
+from metrics import REGISTRY, start_http_server
+from bulk_loader import BulkLoader
+from archiver import Archiver
+from instruments import InstrumentRegistry
+from migrations import apply_migrations
+from pipeline import AckTracker, Batch, decode_stream_entries
+from partitions import PartitionManager
+from rollups import RollupManager
+
+ROWS_READ = REGISTRY.counter("db_updater_rows_read", "Prices read from Redis")
+ROWS_INSERTED = REGISTRY.counter(
+    "db_updater_rows_inserted", "Prices inserted to database, without already saved ones"
+)
+BATCHES = REGISTRY.counter("db_updater_batches", "Batches written to database")
+DECODE_FAILURES = REGISTRY.counter(
+    "db_updater_decode_failures", "Reads and stream entries, which can't be decoded"
+)
+BATCH_FAILURES = REGISTRY.counter(
+    "db_updater_batch_failures", "Failed attempts to write a batch"
+)
+QUEUE_DEPTH = REGISTRY.gauge(
+    "db_updater_queue_depth", "Items waiting for the next stage", ("queue",)
+)
+LAG = REGISTRY.gauge(
+    "db_updater_lag_seconds", "Age of the oldest latest saved price of instruments"
+)
+WRITE_LATENCY = REGISTRY.histogram(
+    "db_updater_batch_write_seconds", "Time to save a batch with its rollups"
+)
+PERSIST_LATENCY = REGISTRY.histogram(
+    "db_updater_persist_latency_seconds",
+    "Time from generation of a price to its commit to database",
+)
 
 
 class DBUpdater:
     """
     This class updates table, which stores historical data of trading instruments prices.
-    The table is updated with Redis Time Series data.
+    The table is updated with Redis Time Series data or, in stream ingestion mode,
+    with Redis stream consumed by a consumer group, by a pipeline of stages:
+    reader of Redis, transform to batches and concurrent writers to PostgreSQL,
+    connected by bounded queues, so a slow database holds the reader back
+    instead of piling up prices in memory.
     """
     def __init__(self):
         """Get Redis and Postgresql clients and logger"""
@@ -38,80 +106,503 @@ class DBUpdater:
             encoding="utf-8",
             decode_responses=True,
         )
+        # Frames of the stream are binary
+        self.__redis_stream = aioredis.from_url(redis_url, password=REDIS_CLIENT.PASSWORD)
+        self.consumer = PRICE_STREAM_CONSUMER or socket.gethostname()
+        # Ids of stream entries, which are read but not acknowledged yet
+        self.in_flight = set()
 
-        psql_url = (
-            f"postgresql+asyncpg://{PSQL_CLIENT.USER}:{PSQL_CLIENT.PASSWORD}@"
+        psql_dsn = (
+            f"{PSQL_CLIENT.USER}:{PSQL_CLIENT.PASSWORD}@"
             + f"{PSQL_CLIENT.HOST}"
             + f"{':'+ PSQL_CLIENT.PORT if not PSQL_CLIENT.PORT in ['False', False] else ''}"
             + f"/{PSQL_DB}"
         )
 
-        psql_engine = create_async_engine(psql_url, echo=True)
+        self.__psql_engine = create_async_engine(
+            f"postgresql+asyncpg://{psql_dsn}", echo=PSQL_ECHO
+        )
         self.__psql_session = sessionmaker(
-            psql_engine, expire_on_commit=False, class_=AsyncSession
+            self.__psql_engine, expire_on_commit=False, class_=AsyncSession
+        )
+        # Timestamp (ms) of the latest saved price of each instrument, loaded from database
+        self.watermarks = {}
+        # Timestamp (ms) of the latest price of each instrument read from Redis
+        self.read_marks = {}
+        # Number of instruments, whose latest read prices are older than retention period
+        self.late_instruments = 0
+        self.acks = AckTracker()
+        # Prices are saved with binary COPY through its own pool of asyncpg connections
+        self.bulk_loader = BulkLoader(
+            f"postgresql://{psql_dsn}", PSQL_COPY_BATCH_SIZE, PSQL_COPY_CONCURRENCY
         )
         self.logger = _logging()
+        self.partitions = PartitionManager(
+            self.__psql_engine,
+            self.logger,
+            PSQL_PARTITION_PRECREATE_DAYS,
+            PSQL_RETENTION_DAYS,
+            (lambda: archived_days(ARCHIVE_DIR)) if ARCHIVE_DIR else None,
+        )
+        # Closed days are exported to Parquet archive
+        self.archiver = None
+        if ARCHIVE_DIR:
+            self.archiver = Archiver(
+                f"postgresql://{psql_dsn}",
+                self.partitions,
+                self.logger,
+                ARCHIVE_DIR,
+                ARCHIVE_AFTER_HOURS,
+                ARCHIVE_COMPRESSION,
+                ARCHIVE_BATCH_INSTRUMENTS,
+            )
+        # Rollups per minute, 5 minutes and hour are updated as each batch lands
+        self.rollups = RollupManager(self.__psql_engine, self.logger)
+        # Registry of instruments is mirrored to Redis for price generator and frontend
+        self.registry = InstrumentRegistry(
+            self.__psql_engine, self.__redis_session, self.logger
+        )
+
+    async def init_db(self):
+        """
+        Create missing tables and partitions, apply migrations
+        and load watermarks saved by the previous run.
+        trading_prices created before partitioning is moved to partitions.
+        """
+        async with self.__psql_engine.begin() as conn:
+            migrated = await self.partitions.migrate_legacy_table(conn)
+            await conn.run_sync(Base.metadata.create_all)
+            await self.registry.seed(conn, TRADING_INSTRUMENTS_WITH_NAMES)
+            await self.partitions.load(conn)
+            if migrated:
+                await self.partitions.fill_from_legacy_table(conn)
+            await apply_migrations(conn, self.logger)
+        await self.partitions.maintain()
+        async with self.__psql_session() as session:
+            result = await session.execute(
+                select(SyncWatermarks.instrument_id, SyncWatermarks.synced_at)
+            )
+            self.watermarks = dict(result.all())
+        self.read_marks = dict(self.watermarks)
+        await self.bulk_loader.connect()
+        self.logger.info(f"Loaded watermarks of {len(self.watermarks)} instruments")
 
     async def get_latest_prices(self):
-        """Get latest instrument prices from Redis time series"""
+        """
+        Get instrument prices from Redis time series, which are newer than the ones read before.
+        If nothing was read yet or the latest read prices are older than the retention period
+        (e.g. after downtime), the whole retention period is read.
+        Instruments without prices for the retention period (e.g. their generator is down)
+        don't hold back reads of the others.
+        """
         current_time = int(datetime.datetime.now().timestamp() * 1000)
-        # Get all trading_instruments data from redis for the last few minutes
-        # (1 minute is 60 000 ms)
+        # 1 minute is 60 000 ms
+        window_start = current_time - REDIS_RETENTION_PERIOD * 60000
+        from_time = window_start
+        read_marks = self.registered(self.read_marks)
+        recent_marks = [mark for mark in read_marks if mark >= window_start]
+        if recent_marks:
+            from_time = min(recent_marks) + 1
+        # Warned once, when the number of late instruments changes
+        late = len(read_marks) - len(recent_marks)
+        if late and late != self.late_instruments:
+            self.logger.warning(
+                f"Prices of {late} instruments are read more than "
+                f"{REDIS_RETENTION_PERIOD} minutes late, "
+                "some of them may have expired from Redis"
+            )
+        self.late_instruments = late
         timeseries = await self.__redis_session.execute_command(
             "TS.MRANGE",
-            current_time - REDIS_RETENTION_PERIOD * 60000,
+            from_time,
             current_time,
             "FILTER",
             "type=trading_instruments",
         )
-        self.logger.info(
-            f"Got instrument prices from Redis for the last {REDIS_RETENTION_PERIOD} minutes"
+        self.logger.debug(
+            f"Got instrument prices from Redis for the last {current_time - from_time} ms"
         )
-        ts_lst = []
         for timeseries_ in timeseries:
-            df_ts = pd.DataFrame(timeseries_[2], columns=["created_at", "price"])
-            df_ts["instrument_id"] = timeseries_[0]
-            ts_lst.append(df_ts)
-        df_latest_prices = pd.concat(ts_lst)
-        df_latest_prices["price"] = df_latest_prices["price"].astype("int")
-        df_latest_prices["created_at"] = pd.to_datetime(
-            df_latest_prices["created_at"], unit="ms"
+            samples = timeseries_[2]
+            # Samples are sorted by time, skip those which are already read
+            read_at = self.read_marks.get(timeseries_[0])
+            start = 0
+            if read_at is not None:
+                while start < len(samples) and samples[start][0] <= read_at:
+                    start += 1
+            timeseries_[2] = samples[start:]
+            if timeseries_[2]:
+                self.read_marks[timeseries_[0]] = timeseries_[2][-1][0]
+        return timeseries
+
+    def registered(self, marks):
+        """
+        Marks of registered instruments, of all instruments until the registry is loaded.
+        Marks of removed instruments don't change anymore and would hold back the others.
+        Args:
+            marks: dict, timestamp in ms per instrument
+        """
+        if self.registry.view.version < 0:
+            return list(marks.values())
+        names = self.registry.view.names
+        return [mark for instrument, mark in marks.items() if instrument in names]
+
+    def check_lag(self):
+        """Warn when saved prices fall behind, so that Redis may expire unsaved ones"""
+        watermarks = self.registered(self.watermarks)
+        if not watermarks:
+            return
+        current_time = int(datetime.datetime.now().timestamp() * 1000)
+        lag = current_time - min(watermarks)
+        LAG.set(lag / 1000)
+        if lag > 0.8 * REDIS_RETENTION_PERIOD * 60000:
+            self.logger.warning(
+                f"Saved prices are {lag / 1000:.0f} s behind, "
+                f"Redis keeps them for {REDIS_RETENTION_PERIOD} minutes"
+            )
+
+    async def read_prices(self, read_queue):
+        """Reader stage: put prices read from Redis to read_queue every poll interval"""
+        while True:
+            started_at = asyncio.get_running_loop().time()
+            try:
+                timeseries = await self.get_latest_prices()
+            except Exception as ex:
+                self.logger.error(f"{ex} while reading prices from Redis")
+            else:
+                # Waits while the queue is full, i.e. writers are behind
+                await read_queue.put((timeseries, ()))
+            self.check_lag()
+            elapsed = asyncio.get_running_loop().time() - started_at
+            await asyncio.sleep(max(DB_UPDATER_POLL_INTERVAL - elapsed, 0))
+
+    async def init_stream(self):
+        """Create the stream and the consumer group, if they don't exist"""
+        try:
+            await self.__redis_stream.xgroup_create(
+                PRICE_STREAM, PRICE_STREAM_GROUP, id="0", mkstream=True
+            )
+            self.logger.info(f"Created consumer group {PRICE_STREAM_GROUP}")
+        except aioredis.ResponseError as ex:
+            if "BUSYGROUP" not in str(ex):
+                raise
+
+    async def claim_stream_entries(self, start_id):
+        """
+        Claim entries, which were read by other consumers (e.g. failed replicas)
+        and not acknowledged for PRICE_STREAM_CLAIM_IDLE_MS.
+        Returns the id to continue from and list of (id, frame),
+        frame is None for entries trimmed from the stream.
+        """
+        reply = await self.__redis_stream.execute_command(
+            "XAUTOCLAIM",
+            PRICE_STREAM,
+            PRICE_STREAM_GROUP,
+            self.consumer,
+            PRICE_STREAM_CLAIM_IDLE_MS,
+            start_id,
+            "COUNT",
+            PRICE_STREAM_READ_COUNT,
         )
-        return df_latest_prices
+        entries = []
+        for entry in reply[1]:
+            if entry is None:
+                continue
+            entry_id, fields = entry
+            # Entries, which this consumer is still saving, are not read twice
+            if entry_id in self.in_flight:
+                continue
+            fields = dict(zip(fields[::2], fields[1::2])) if fields else {}
+            entries.append((entry_id, fields.get(b"frame")))
+        return reply[0], entries
+
+    async def read_stream(self, read_queue):
+        """
+        Reader stage of stream ingestion mode: put frames read from the stream
+        with consumer group to read_queue. Entries read by this consumer before restart
+        and not acknowledged are read first, idle entries of other consumers are claimed.
+        """
+        await self.init_stream()
+        loop = asyncio.get_running_loop()
+        # "0" reads pending entries of this consumer, ">" new entries
+        last_id = "0"
+        claim_id = "0-0"
+        claim_at = 0
+        while True:
+            try:
+                entries = []
+                if loop.time() >= claim_at:
+                    claim_id, entries = await self.claim_stream_entries(claim_id)
+                    if claim_id in ("0-0", b"0-0"):
+                        claim_at = loop.time() + PRICE_STREAM_CLAIM_IDLE_MS / 1000
+                reply = await self.__redis_stream.xreadgroup(
+                    PRICE_STREAM_GROUP,
+                    self.consumer,
+                    {PRICE_STREAM: last_id},
+                    count=PRICE_STREAM_READ_COUNT,
+                    block=None if last_id != ">" else int(DB_UPDATER_POLL_INTERVAL * 1000),
+                )
+                read = reply[0][1] if reply else []
+                if last_id != ">":
+                    last_id = read[-1][0] if read else ">"
+                entries += [
+                    (entry_id, fields.get(b"frame") if fields else None)
+                    for entry_id, fields in read
+                ]
+            except Exception as ex:
+                self.logger.error(f"{ex} while reading prices from Redis stream")
+                await asyncio.sleep(DB_UPDATER_POLL_INTERVAL)
+                continue
+            if entries:
+                entry_ids = [entry_id for entry_id, _ in entries]
+                self.in_flight.update(entry_ids)
+                # Waits while the queue is full, i.e. writers are behind
+                await read_queue.put(
+                    (
+                        [
+                            (entry_id, frame)
+                            for entry_id, frame in entries
+                            if frame is not None
+                        ],
+                        entry_ids,
+                    )
+                )
 
-    async def save_latest_prices(self, df_latest_prices):
-        """Save current trading data to database"""
-        if df_latest_prices.shape[0] == 0:  # no new data
-            self.logger.info(
-                f"No new data for the last {REDIS_RETENTION_PERIOD} minutes"
+    async def decode_prices(self, payload):
+        """
+        Decode what reader stage has read to DataFrame of prices.
+        Stream entries, which can't be decoded (e.g. of a newer format), are moved
+        to the dead-letter stream and acknowledged with the others, so that they
+        aren't read again and again.
+        """
+        if INGESTION_MODE != "stream":
+            try:
+                return decode_mrange(payload)
+            except Exception as ex:
+                DECODE_FAILURES.inc()
+                self.logger.error(f"{ex} while decoding prices read from Redis")
+                return decode_mrange([])
+        df_prices, failed = decode_stream_entries(payload)
+        for entry_id, frame, error in failed:
+            DECODE_FAILURES.inc()
+            self.logger.error(f"{error!r} while decoding stream entry {entry_id}")
+            try:
+                await self.__redis_stream.xadd(
+                    PRICE_STREAM_DEAD_LETTER,
+                    {"id": entry_id, "frame": frame, "error": repr(error)},
+                    maxlen=PRICE_STREAM_MAXLEN,
+                    approximate=True,
+                )
+            except Exception as ex:
+                self.logger.error(f"{ex} while moving stream entry {entry_id}")
+        return df_prices
+
+    async def transform_prices(self, read_queue, write_queue):
+        """
+        Transform stage: decode prices read from Redis and put them to write_queue
+        in batches of up to flush size rows, at least every flush interval
+        """
+        loop = asyncio.get_running_loop()
+        seq = 0
+        buffered = []
+        buffered_ids = []
+        n_buffered = 0
+        flush_at = None
+        while True:
+            timeout = None if flush_at is None else max(flush_at - loop.time(), 0)
+            try:
+                payload, entry_ids = await asyncio.wait_for(read_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                payload, entry_ids = None, ()
+            if payload is not None:
+                df_prices = await self.decode_prices(payload)
+                ROWS_READ.inc(df_prices.shape[0])
+                # Entries without prices still have to be acknowledged
+                if df_prices.shape[0] or entry_ids:
+                    buffered.append(df_prices)
+                    buffered_ids += entry_ids
+                    n_buffered += df_prices.shape[0]
+                    if flush_at is None:
+                        flush_at = loop.time() + DB_UPDATER_FLUSH_INTERVAL
+            if not buffered or (
+                n_buffered < DB_UPDATER_FLUSH_SIZE and loop.time() < flush_at
+            ):
+                continue
+            df_prices = (
+                buffered[0]
+                if len(buffered) == 1
+                else pd.concat(buffered, ignore_index=True)
+            )
+            # Rows are passed to COPY as plain columns, without building a dict per row
+            created_at_ms = (
+                df_prices["created_at"].values.astype("datetime64[ms]").astype("int64")
             )
+            starts = range(0, max(df_prices.shape[0], 1), DB_UPDATER_FLUSH_SIZE)
+            for i in starts:
+                batch = Batch(
+                    seq,
+                    df_prices.iloc[i : i + DB_UPDATER_FLUSH_SIZE],
+                    created_at_ms[i : i + DB_UPDATER_FLUSH_SIZE],
+                    # Entries are acknowledged after all their prices are written
+                    buffered_ids if i == starts[-1] else (),
+                )
+                seq += 1
+                await write_queue.put(batch)
+            buffered = []
+            buffered_ids = []
+            n_buffered = 0
+            flush_at = None
+
+    async def write_prices(self, write_queue):
+        """
+        Writer stage: save batches from write_queue, retrying failed ones,
+        so that database hiccups delay prices instead of losing them
+        """
+        while True:
+            batch = await write_queue.get()
+            failures = 0
+            while True:
+                try:
+                    await self.save_batch(batch)
+                    break
+                except Exception as ex:
+                    BATCH_FAILURES.inc()
+                    failures += 1
+                    delay = min(2 ** failures, 60)
+                    self.logger.error(
+                        f"{ex} while saving batch {batch.seq}, retrying in {delay} s"
+                    )
+                    await asyncio.sleep(delay)
+            watermarks, entry_ids = self.acks.ack(batch)
+            if entry_ids:
+                try:
+                    await self.__redis_stream.xack(
+                        PRICE_STREAM, PRICE_STREAM_GROUP, *entry_ids
+                    )
+                except Exception as ex:
+                    # Entries stay pending and are claimed and saved again later
+                    self.logger.error(f"{ex} while acknowledging stream entries")
+                self.in_flight.difference_update(entry_ids)
+            if not watermarks:
+                continue
+            try:
+                await self.save_watermarks(watermarks)
+            except Exception as ex:
+                # Watermarks of the next batches include these ones
+                self.logger.error(f"{ex} while saving watermarks")
+
+    async def save_batch(self, batch):
+        """Save batch of trading data to database and refresh rollups of its buckets"""
+        if len(batch) == 0:
             return
-        cols = list(
-            set(df_latest_prices.columns.to_list())
-            & set(TradingPrices.__table__.columns.keys())
+        started_at = datetime.datetime.now().timestamp()
+        # Prices after downtime may belong to days without partitions
+        async with self.__ddl_lock:
+            await self.partitions.ensure_partitions(
+                datetime.date(1970, 1, 1) + datetime.timedelta(days=int(day))
+                for day in np.unique(batch.created_at_ms // 86400000)  # ms in a day
+            )
+        inserted = await self.bulk_loader.load(
+            batch.df_prices["instrument_id"].tolist(),
+            batch.created_at_ms.tolist(),
+            batch.df_prices["price"].tolist(),
         )
-        df_latest_prices = df_latest_prices[cols]
-        insert_stmt = insert(TradingPrices).values(
-            df_latest_prices.to_dict(orient="records")
+        committed_at = datetime.datetime.now().timestamp()
+        PERSIST_LATENCY.observe_many(committed_at - batch.created_at_ms / 1000)
+        ROWS_INSERTED.inc(inserted)
+        self.logger.debug(
+            f"Updated database with batch {batch.seq}: {inserted} of "
+            f"{len(batch)} rows are new"
         )
-        on_update_stmt = insert_stmt.on_conflict_do_nothing(
-            index_elements=[
-                TradingPrices.__table__.columns.instrument_id,
-                TradingPrices.__table__.columns.created_at,
+        # Refreshes run one at a time, each after its prices are committed,
+        # so the last one of overlapping buckets sees prices of all batches
+        async with self.__rollup_lock:
+            await self.rollups.refresh(
+                batch.df_prices["created_at"].min().to_pydatetime(),
+                batch.df_prices["created_at"].max().to_pydatetime(),
+            )
+        BATCHES.inc()
+        WRITE_LATENCY.observe(datetime.datetime.now().timestamp() - started_at)
+
+    async def save_watermarks(self, watermarks):
+        """
+        Save timestamps of the latest saved prices of instruments.
+        They are saved only after prices are committed, so they never run ahead of the data.
+        Args:
+            watermarks: dict, timestamp in ms per instrument
+        """
+        insert_stmt = insert(SyncWatermarks).values(
+            [
+                {"instrument_id": instrument_id, "synced_at": value}
+                for instrument_id, value in watermarks.items()
             ]
         )
+        on_update_stmt = insert_stmt.on_conflict_do_update(
+            index_elements=[SyncWatermarks.__table__.columns.instrument_id],
+            set_={
+                "synced_at": func.greatest(
+                    SyncWatermarks.__table__.columns.synced_at,
+                    insert_stmt.excluded.synced_at,
+                )
+            },
+        )
         async with self.__psql_session() as session:
             await session.execute(on_update_stmt)
             await session.commit()
-            self.logger.info("Updated database with the latest data")
+        for instrument_id, value in watermarks.items():
+            self.watermarks[instrument_id] = max(
+                value, self.watermarks.get(instrument_id, value)
+            )
 
-    async def update_trading_prices(self):
-        """Get and save current trading data to database every minute"""
+    async def maintain_partitions(self):
+        """Create and drop partitions every minute"""
         while True:
-            # As the order is important
-            df_latest_prices = await self.get_latest_prices()
-            await self.save_latest_prices(df_latest_prices)
             await asyncio.sleep(60)
+            try:
+                async with self.__ddl_lock:
+                    await self.partitions.maintain()
+            except Exception as ex:
+                self.logger.error(f"{ex} while maintaining partitions")
+
+    async def watch_instruments(self):
+        """Mirror changes of the registry of instruments to Redis"""
+        while True:
+            try:
+                changes = await self.registry.refresh()
+                if changes:
+                    added, removed = changes
+                    self.logger.info(
+                        f"Registry of instruments version {self.registry.view.version}: "
+                        f"{len(added)} added, {len(removed)} removed"
+                    )
+            except Exception as ex:
+                self.logger.error(f"{ex} while refreshing registry of instruments")
+            await asyncio.sleep(INSTRUMENT_REGISTRY_REFRESH)
+
+    async def update_trading_prices(self):
+        """Get and save current trading data to database continuously"""
+        await self.init_db()
+        start_http_server(METRICS_PORT)
+        await self.run_pipeline()
+
+    async def run_pipeline(self):
+        """Run stages of the pipeline connected by bounded queues"""
+        self.__ddl_lock = asyncio.Lock()
+        self.__rollup_lock = asyncio.Lock()
+        read_queue = asyncio.Queue(maxsize=DB_UPDATER_QUEUE_SIZE)
+        write_queue = asyncio.Queue(maxsize=DB_UPDATER_QUEUE_SIZE)
+        QUEUE_DEPTH.labels(queue="read").set_function(read_queue.qsize)
+        QUEUE_DEPTH.labels(queue="write").set_function(write_queue.qsize)
+        await asyncio.gather(
+            self.read_stream(read_queue)
+            if INGESTION_MODE == "stream"
+            else self.read_prices(read_queue),
+            self.transform_prices(read_queue, write_queue),
+            *(self.write_prices(write_queue) for _ in range(DB_UPDATER_WRITERS)),
+            self.maintain_partitions(),
+            self.watch_instruments(),
+            *([self.archiver.run(ARCHIVE_INTERVAL)] if self.archiver else []),
+        )
 
 
 def main():
@@ -0,0 +1,56 @@
+"""
+Changes of the registry of trading instruments, which services pick up without restart.
+Examples:
+    python instrument_tool.py add ticker_996 Microsoft
+    python instrument_tool.py import instruments.csv
+    python instrument_tool.py remove ticker_996 ticker_995
+Copyright © 2022. All Rights are Reserved by Maria Chichkan
+"""
+
+import csv
+import argparse
+import asyncio
+
+from db_updater import DBUpdater
+
+
+async def run(args):
+    db_updater = DBUpdater()
+    # Registry tables are created as price db updater creates them
+    await db_updater.init_db()
+    try:
+        registry = db_updater.registry
+        if args.command == "add":
+            await registry.add({args.instrument: args.name})
+        elif args.command == "import":
+            with open(args.file, newline="") as file:
+                await registry.add({row[0]: row[1] for row in csv.reader(file) if row})
+        else:
+            await registry.remove(args.instruments)
+        # Services are notified right away instead of at the next refresh of price db updater
+        await registry.refresh()
+    finally:
+        await db_updater.bulk_loader.close()
+    print(
+        f"Registry version {registry.view.version} "
+        f"has {len(registry.view.names)} instruments"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Add or remove trading instruments")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("add", help="register an instrument or rename it")
+    add.add_argument("instrument")
+    add.add_argument("name")
+    import_ = commands.add_parser(
+        "import", help="register instruments from CSV file with instrument,name rows"
+    )
+    import_.add_argument("file")
+    remove = commands.add_parser("remove", help="remove instruments")
+    remove.add_argument("instruments", nargs="+")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Registry of trading instruments in trading_instruments table and its mirror in Redis
+Copyright © 2022. All Rights are Reserved by Maria Chichkan
+"""
+
+import aioredis
+from sqlalchemy import text
+
+from instrument_registry import VERSION_KEY, InstrumentView, queue_write
+
+# Version of the registry is a counter incremented by every change
+INIT_VERSION = text(
+    "INSERT INTO trading_instruments_version (id, version) VALUES (1, 0) "
+    "ON CONFLICT (id) DO NOTHING"
+)
+
+# Taken first in a transaction, so changes of the registry are committed one at a time
+INCREMENT_VERSION = text(
+    "UPDATE trading_instruments_version SET version = version + 1 WHERE id = 1"
+)
+
+SELECT_VERSION = text(
+    "SELECT COALESCE(MAX(version), 0) FROM trading_instruments_version"
+)
+
+SELECT_ACTIVE = text(
+    "SELECT instrument_id, name FROM trading_instruments WHERE active"
+)
+
+COUNT_INSTRUMENTS = text("SELECT COUNT(*) FROM trading_instruments")
+
+UPSERT_INSTRUMENT = text(
+    """
+INSERT INTO trading_instruments (instrument_id, name, active, updated_at)
+VALUES (:instrument_id, :name, TRUE, now())
+ON CONFLICT (instrument_id) DO UPDATE
+SET name = EXCLUDED.name, active = TRUE, updated_at = EXCLUDED.updated_at
+"""
+)
+
+DEACTIVATE_INSTRUMENTS = text(
+    """
+UPDATE trading_instruments SET active = FALSE, updated_at = now()
+WHERE instrument_id = ANY(:instruments) AND active
+"""
+)
+
+
+class InstrumentRegistry:
+    """
+    This class manages the registry of trading instruments in database
+    and mirrors it to Redis, where price generator and frontend read it.
+    Every change gets a new version, which is published to Redis channel,
+    so services update their views without restart.
+    """
+    def __init__(self, engine, redis_client, logger):
+        """
+        Args:
+            engine: AsyncEngine
+            redis_client: asyncio Redis client, which decodes responses
+            logger: Logger
+        """
+        self.engine = engine
+        self.redis = redis_client
+        self.logger = logger
+        self.view = InstrumentView(version=-1)
+
+    async def seed(self, conn, names):
+        """
+        Register instruments, if the registry is empty, e.g. the first time
+        Args:
+            conn: AsyncConnection
+            names: dict, name per instrument
+        """
+        await conn.execute(INIT_VERSION)
+        if (await conn.execute(COUNT_INSTRUMENTS)).scalar() or not names:
+            return
+        await conn.execute(INCREMENT_VERSION)
+        await conn.execute(
+            UPSERT_INSTRUMENT,
+            [{"instrument_id": instr, "name": name} for instr, name in names.items()],
+        )
+        self.logger.info(f"Registered {len(names)} instruments")
+
+    async def add(self, names):
+        """
+        Register instruments or rename registered ones
+        Args:
+            names: dict, name per instrument
+        """
+        async with self.engine.begin() as conn:
+            await conn.execute(INCREMENT_VERSION)
+            await conn.execute(
+                UPSERT_INSTRUMENT,
+                [{"instrument_id": instr, "name": name} for instr, name in names.items()],
+            )
+
+    async def remove(self, instruments):
+        """Remove instruments from the registry, their saved prices are kept"""
+        async with self.engine.begin() as conn:
+            await conn.execute(INCREMENT_VERSION)
+            await conn.execute(DEACTIVATE_INSTRUMENTS, {"instruments": list(instruments)})
+
+    async def refresh(self):
+        """
+        Load the registry, if it has changed, and mirror it to Redis, if the mirror is older.
+        Returns lists of added and removed instruments, None if nothing has changed.
+        """
+        async with self.engine.connect() as conn:
+            version = (await conn.execute(SELECT_VERSION)).scalar()
+            if version == self.view.version:
+                return None
+            names = dict((await conn.execute(SELECT_ACTIVE)).all())
+        if await self.mirror(version, names):
+            self.logger.info(
+                f"Mirrored registry version {version} of {len(names)} instruments to Redis"
+            )
+        return self.view.update(version, names)
+
+    async def mirror(self, version, names):
+        """
+        Replace the mirror in Redis, if it is older than version.
+        Other replicas of price db updater or the instrument tool may mirror the registry
+        at the same time, so the version is compared and the mirror replaced in one
+        transaction, which is retried if the version changes in between.
+        Returns True if the mirror is replaced.
+        """
+        while True:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                try:
+                    await pipe.watch(VERSION_KEY)
+                    if int(await pipe.get(VERSION_KEY) or 0) >= version:
+                        return False
+                    pipe.multi()
+                    await queue_write(pipe, version, names).execute()
+                    return True
+                except aioredis.WatchError:
+                    continue
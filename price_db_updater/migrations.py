@@ -0,0 +1,76 @@
+"""
+Schema migrations of price db updater, applied in order and recorded in schema_migrations
+Copyright © 2022. All Rights are Reserved by Maria Chichkan
+"""
+
+from sqlalchemy import text
+
+from db_orm import PRICES_COVERING_INDEX, PRICES_TIME_INDEX
+
+CREATE_MIGRATIONS_TABLE = text(
+    """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    description VARCHAR(200) NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT now()
+)
+"""
+)
+
+# Replicas of price db updater, which start together, apply migrations one at a time
+LOCK_MIGRATIONS = text("SELECT pg_advisory_xact_lock(hashtext('schema_migrations'))")
+
+APPLIED_MIGRATIONS = text("SELECT version FROM schema_migrations")
+
+RECORD_MIGRATION = text(
+    "INSERT INTO schema_migrations (version, description) VALUES (:version, :description)"
+)
+
+# Version, description and statements of every migration, versions are never reused.
+# Indexes of partitioned trading_prices are created on all its partitions,
+# and partitions created later get them too
+MIGRATIONS = [
+    (
+        1,
+        "BRIN index on created_at of trading_prices",
+        [
+            # Prices are appended in time order, so ranges of pages have narrow
+            # ranges of time. New ranges are summarized by autovacuum
+            f"CREATE INDEX IF NOT EXISTS {PRICES_TIME_INDEX} "
+            "ON trading_prices USING BRIN (created_at) WITH (autosummarize = on)"
+        ],
+    ),
+    (
+        2,
+        "Covering index on instrument_id and created_at of trading_prices with price",
+        [
+            f"CREATE INDEX IF NOT EXISTS {PRICES_COVERING_INDEX} "
+            "ON trading_prices (instrument_id, created_at) INCLUDE (price)"
+        ],
+    ),
+]
+
+
+async def apply_migrations(conn, logger, migrations=MIGRATIONS):
+    """
+    Apply migrations, which aren't recorded in schema_migrations yet, in order of versions.
+    They are applied in the transaction of conn, so a failed one leaves nothing behind.
+    Args:
+        conn: AsyncConnection
+        logger: Logger
+        migrations: list of (version, description, list of SQL statements)
+    """
+    await conn.execute(LOCK_MIGRATIONS)
+    await conn.execute(CREATE_MIGRATIONS_TABLE)
+    applied = set((await conn.execute(APPLIED_MIGRATIONS)).scalars().all())
+    for version, description, statements in sorted(
+        migrations, key=lambda migration: migration[0]
+    ):
+        if version in applied:
+            continue
+        for statement in statements:
+            await conn.execute(text(statement))
+        await conn.execute(
+            RECORD_MIGRATION, {"version": version, "description": description}
+        )
+        logger.info(f"Applied migration {version}: {description}")
@@ -0,0 +1,142 @@
+"""
+Daily partitions of trading_prices table
+Copyright © 2022. All Rights are Reserved by Maria Chichkan
+"""
+
+import datetime
+from sqlalchemy import text
+
+LIST_PARTITIONS = text(
+    """
+SELECT child.relname
+FROM pg_inherits
+JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+WHERE parent.relname = 'trading_prices'
+"""
+)
+
+TABLE_KIND = text("SELECT relkind FROM pg_class WHERE relname = 'trading_prices'")
+
+LEGACY_DAYS = text(
+    "SELECT DISTINCT created_at::date FROM trading_prices_legacy ORDER BY 1"
+)
+
+
+class PartitionManager:
+    """
+    This class keeps trading_prices partitioned by day: partitions are created in advance
+    and dropped, when they are older than retention period, without huge DELETE
+    """
+    def __init__(
+        self, engine, logger, precreate_days=2, retention_days=0, archived_days=None
+    ):
+        """
+        Args:
+            engine: AsyncEngine
+            logger: Logger
+            precreate_days: int, number of days ahead with created partitions
+            retention_days: int, partitions older than this number of days are dropped,
+                0 keeps them forever
+            archived_days: function returning set of archived days, if prices are archived,
+                only partitions of archived days are dropped then
+        """
+        self.engine = engine
+        self.logger = logger
+        self.precreate_days = precreate_days
+        self.retention_days = retention_days
+        self.archived_days = archived_days
+        # Days which already have partitions
+        self.days = set()
+
+    @staticmethod
+    def partition_name(day):
+        return f"trading_prices_{day:%Y%m%d}"
+
+    async def migrate_legacy_table(self, conn):
+        """
+        Move prices from trading_prices created before partitioning to daily partitions.
+        Has to be called before tables are created.
+        """
+        kind = (await conn.execute(TABLE_KIND)).scalar()
+        if kind != "r":  # doesn't exist or is already partitioned
+            return False
+        self.logger.info("Moving trading_prices to daily partitions")
+        await conn.execute(
+            text("ALTER TABLE trading_prices RENAME TO trading_prices_legacy")
+        )
+        # Name of the primary key is needed for the partitioned table
+        await conn.execute(
+            text(
+                "ALTER INDEX IF EXISTS trading_prices_pkey "
+                "RENAME TO trading_prices_legacy_pkey"
+            )
+        )
+        return True
+
+    async def fill_from_legacy_table(self, conn):
+        """Copy prices of legacy table to partitions and drop it"""
+        days = (await conn.execute(LEGACY_DAYS)).scalars().all()
+        await self.create_partitions(conn, days)
+        await conn.execute(
+            text("INSERT INTO trading_prices SELECT * FROM trading_prices_legacy")
+        )
+        await conn.execute(text("DROP TABLE trading_prices_legacy"))
+        self.logger.info(f"Moved prices of {len(days)} days to partitions")
+
+    async def load(self, conn):
+        """Load days which already have partitions"""
+        names = (await conn.execute(LIST_PARTITIONS)).scalars().all()
+        self.days = {
+            datetime.datetime.strptime(name[-8:], "%Y%m%d").date()
+            for name in names
+            if name.startswith("trading_prices_") and name[-8:].isdigit()
+        }
+
+    async def create_partitions(self, conn, days):
+        """Create partitions for days which don't have them"""
+        for day in sorted(set(days) - self.days):
+            day_after = day + datetime.timedelta(days=1)
+            await conn.execute(
+                text(
+                    f"CREATE TABLE IF NOT EXISTS {self.partition_name(day)} "
+                    "PARTITION OF trading_prices "
+                    f"FOR VALUES FROM ('{day}') TO ('{day_after}')"
+                )
+            )
+            self.days.add(day)
+            self.logger.info(f"Created partition {self.partition_name(day)}")
+
+    async def ensure_partitions(self, days):
+        """Create partitions for days of prices, which are going to be saved"""
+        days = set(days)
+        if days - self.days:
+            async with self.engine.begin() as conn:
+                await self.create_partitions(conn, days)
+
+    async def maintain(self):
+        """Create partitions for the next days and drop those older than retention period"""
+        # Prices are saved in UTC
+        today = datetime.datetime.utcnow().date()
+        await self.ensure_partitions(
+            today + datetime.timedelta(days=i) for i in range(self.precreate_days + 1)
+        )
+        if self.retention_days <= 0:
+            return
+        expired = [
+            day
+            for day in self.days
+            if day < today - datetime.timedelta(days=self.retention_days)
+        ]
+        if self.archived_days is not None:
+            archived = self.archived_days()
+            expired = [day for day in expired if day in archived]
+        if not expired:
+            return
+        async with self.engine.begin() as conn:
+            for day in sorted(expired):
+                await conn.execute(
+                    text(f"DROP TABLE IF EXISTS {self.partition_name(day)}")
+                )
+                self.logger.info(f"Dropped partition {self.partition_name(day)}")
+        self.days -= set(expired)
@@ -0,0 +1,94 @@
+"""
+Batches of trading prices passed between stages of price db updater
+Copyright © 2022. All Rights are Reserved by Maria Chichkan
+"""
+
+import numpy as np
+import pandas as pd
+
+from tick_codecs import decode
+
+
+def decode_stream_entries(entries):
+    """
+    Decode frames of Redis stream to DataFrame with instrument_id, created_at and price
+    in the same format as decode_mrange.
+    Returns the DataFrame and list of (id, frame, error) of entries, which can't be decoded.
+    Args:
+        entries: list of (id, frame in any supported tick format)
+    """
+    ticks = []
+    failed = []
+    for entry_id, frame in entries:
+        try:
+            ticks += decode(frame)
+        except Exception as ex:
+            failed.append((entry_id, frame, ex))
+    instruments, created_at, prices = zip(*ticks) if ticks else ((), (), ())
+    df_prices = pd.DataFrame(
+        {
+            "created_at": np.array(created_at, dtype="int64")
+            .astype("datetime64[ms]")
+            .astype("datetime64[ns]"),
+            "price": np.array(prices, dtype="int64"),
+            "instrument_id": pd.Categorical(instruments),
+        }
+    )
+    return df_prices, failed
+
+
+class Batch:
+    """
+    Prices to be saved in one go with their sequence number
+    and the latest timestamp of each instrument in them
+    """
+    def __init__(self, seq, df_prices, created_at_ms, entry_ids=()):
+        """
+        Args:
+            seq: int, batches are numbered in the order they are read from Redis
+            df_prices: DataFrame with instrument_id, created_at and price
+            created_at_ms: numpy array, created_at in milliseconds
+            entry_ids: ids of Redis stream entries, which are acknowledged
+                when this batch and all batches before it are written
+        """
+        self.seq = seq
+        self.entry_ids = list(entry_ids)
+        self.df_prices = df_prices
+        self.created_at_ms = created_at_ms
+        self.watermarks = (
+            df_prices.assign(created_at_ms=created_at_ms)
+            .groupby("instrument_id", observed=True)["created_at_ms"]
+            .max()
+            .to_dict()
+        )
+
+    def __len__(self):
+        return self.df_prices.shape[0]
+
+
+class AckTracker:
+    """
+    This class tracks batches written out of order by concurrent writers.
+    Watermarks move only up to the highest batch, all batches before which are written,
+    so a restart never skips prices of a batch, which failed or is still being written.
+    """
+    def __init__(self):
+        self.next_seq = 0
+        self.acked = {}
+
+    def ack(self, batch):
+        """
+        Mark batch as written. Returns watermarks, which are safe to save now,
+        and ids of stream entries, which are safe to acknowledge now
+        (both empty if an earlier batch is still being written).
+        """
+        self.acked[batch.seq] = (batch.watermarks, batch.entry_ids)
+        watermarks = {}
+        entry_ids = []
+        while self.next_seq in self.acked:
+            batch_watermarks, batch_entry_ids = self.acked.pop(self.next_seq)
+            for instrument_id, value in batch_watermarks.items():
+                watermarks[instrument_id] = max(value, watermarks.get(instrument_id, value))
+            entry_ids += batch_entry_ids
+            self.next_seq += 1
+        return watermarks, entry_ids
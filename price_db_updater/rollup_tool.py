@@ -0,0 +1,46 @@
+"""
+Backfill and repair of OHLC rollups of trading prices.
+Examples:
+    python rollup_tool.py backfill 2022-11-01 2022-11-08
+    python rollup_tool.py repair 2022-11-01T10:00 2022-11-01T12:00
+Copyright © 2022. All Rights are Reserved by Maria Chichkan
+"""
+
+import argparse
+import asyncio
+import datetime
+
+from db_updater import DBUpdater
+
+
+async def run(command, date_from, date_to):
+    db_updater = DBUpdater()
+    # Rollup tables and partitions are created as price db updater creates them
+    await db_updater.init_db()
+    try:
+        if command == "backfill":
+            await db_updater.rollups.backfill(date_from, date_to)
+        else:
+            await db_updater.rollups.repair(date_from, date_to)
+    finally:
+        await db_updater.bulk_loader.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Backfill or repair rollups of trading prices (times are in UTC)"
+    )
+    parser.add_argument(
+        "command",
+        choices=["backfill", "repair"],
+        help="backfill recalculates all buckets, "
+        "repair recalculates only minutes which don't match saved prices",
+    )
+    parser.add_argument("date_from", type=datetime.datetime.fromisoformat)
+    parser.add_argument("date_to", type=datetime.datetime.fromisoformat)
+    args = parser.parse_args()
+    asyncio.run(run(args.command, args.date_from, args.date_to))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+OHLC rollups of trading prices per minute, 5 minutes and hour
+Copyright © 2022. All Rights are Reserved by Maria Chichkan
+"""
+
+import datetime
+from sqlalchemy import text
+
+# Buckets are counted from the epoch, in the same way as in the frontend queries
+BUCKET = (
+    "TIMESTAMP 'epoch' + FLOOR(EXTRACT(EPOCH FROM {column}) / {bucket_size}) "
+    "* {bucket_size} * INTERVAL '1 second'"
+)
+
+UPSERT = """
+ON CONFLICT (instrument_id, bucket) DO UPDATE
+SET open = EXCLUDED.open,
+    high = EXCLUDED.high,
+    low = EXCLUDED.low,
+    close = EXCLUDED.close,
+    count = EXCLUDED.count
+"""
+
+ROLLUP_FROM_PRICES = """
+INSERT INTO {table} (instrument_id, bucket, open, high, low, close, count)
+SELECT instrument_id,
+       {bucket} AS bucket,
+       (ARRAY_AGG(price ORDER BY created_at))[1],
+       MAX(price),
+       MIN(price),
+       (ARRAY_AGG(price ORDER BY created_at DESC))[1],
+       COUNT(*)
+FROM trading_prices
+WHERE created_at >= :date_from AND created_at < :date_to
+GROUP BY 1, 2
+"""
+
+ROLLUP_FROM_ROLLUP = """
+INSERT INTO {table} (instrument_id, bucket, open, high, low, close, count)
+SELECT instrument_id,
+       {bucket} AS bucket,
+       (ARRAY_AGG(open ORDER BY bucket))[1],
+       MAX(high),
+       MIN(low),
+       (ARRAY_AGG(close ORDER BY bucket DESC))[1],
+       SUM(count)
+FROM {source}
+WHERE bucket >= :date_from AND bucket < :date_to
+GROUP BY 1, 2
+"""
+
+# Minutes, where the number of prices differs from the number in the minute rollup
+FIND_GAPS = text(
+    """
+SELECT DISTINCT prices.bucket
+FROM (
+    SELECT instrument_id, date_trunc('minute', created_at) AS bucket, COUNT(*) AS count
+    FROM trading_prices
+    WHERE created_at >= :date_from AND created_at < :date_to
+    GROUP BY 1, 2
+) prices
+LEFT JOIN trading_prices_1m rollup
+    ON rollup.instrument_id = prices.instrument_id AND rollup.bucket = prices.bucket
+WHERE rollup.count IS DISTINCT FROM prices.count
+ORDER BY 1
+"""
+)
+
+# Refreshes of price db updater replicas run one at a time, so that the last one
+# of overlapping buckets sees prices committed by all of them
+LOCK_ROLLUPS = text("SELECT pg_advisory_xact_lock(hashtext('trading_prices_rollups'))")
+
+# Table, bucket size in seconds and source: minutes are aggregated from prices,
+# bigger buckets from minutes
+ROLLUPS = [
+    ("trading_prices_1m", 60, None),
+    ("trading_prices_5m", 300, "trading_prices_1m"),
+    ("trading_prices_1h", 3600, "trading_prices_1m"),
+]
+
+
+def floor_time(value, bucket_size):
+    """Start of the bucket, which contains value"""
+    seconds = (value - datetime.datetime(1970, 1, 1)).total_seconds()
+    return datetime.datetime(1970, 1, 1) + datetime.timedelta(
+        seconds=seconds // bucket_size * bucket_size
+    )
+
+
+class RollupManager:
+    """
+    This class maintains tables with open, high, low, close and count of trading prices
+    per minute, 5 minutes and hour. Buckets touched by saved prices are recalculated,
+    so late prices and repeated batches give the same result.
+    """
+    def __init__(self, engine, logger):
+        """
+        Args:
+            engine: AsyncEngine
+            logger: Logger
+        """
+        self.engine = engine
+        self.logger = logger
+        self.statements = []
+        for table, bucket_size, source in ROLLUPS:
+            if source is None:
+                query = ROLLUP_FROM_PRICES.format(
+                    table=table,
+                    bucket=BUCKET.format(column="created_at", bucket_size=bucket_size),
+                )
+            else:
+                query = ROLLUP_FROM_ROLLUP.format(
+                    table=table,
+                    source=source,
+                    bucket=BUCKET.format(column="bucket", bucket_size=bucket_size),
+                )
+            self.statements.append((bucket_size, text(query + UPSERT)))
+
+    async def refresh(self, date_from, date_to):
+        """
+        Recalculate all buckets, which contain prices from date_from to date_to
+        Args:
+            date_from: datetime
+            date_to: datetime
+        """
+        async with self.engine.begin() as conn:
+            await conn.execute(LOCK_ROLLUPS)
+            for bucket_size, statement in self.statements:
+                await conn.execute(
+                    statement,
+                    {
+                        "date_from": floor_time(date_from, bucket_size),
+                        "date_to": floor_time(date_to, bucket_size)
+                        + datetime.timedelta(seconds=bucket_size),
+                    },
+                )
+
+    async def backfill(self, date_from, date_to, step=datetime.timedelta(hours=1)):
+        """
+        Recalculate rollups from date_from to date_to by steps,
+        so that each transaction stays small
+        """
+        start = floor_time(date_from, 3600)
+        while start < date_to:
+            end = min(start + step, date_to)
+            await self.refresh(start, end - datetime.timedelta(microseconds=1))
+            self.logger.info(f"Refreshed rollups from {start} to {end}")
+            start = end
+
+    async def repair(self, date_from, date_to):
+        """
+        Find minutes from date_from to date_to, where rollups don't match saved prices,
+        and recalculate their buckets. Returns the number of repaired minutes.
+        """
+        # Whole minutes are compared, partial ones would never match rollups
+        async with self.engine.connect() as conn:
+            gaps = (
+                await conn.execute(
+                    FIND_GAPS,
+                    {
+                        "date_from": floor_time(date_from, 60),
+                        "date_to": floor_time(date_to, 60)
+                        + datetime.timedelta(seconds=60),
+                    },
+                )
+            ).scalars().all()
+        for minute in gaps:
+            await self.refresh(minute, minute)
+        self.logger.info(f"Repaired rollups of {len(gaps)} minutes")
+        return len(gaps)
@@ -0,0 +1,168 @@
+"""
+Launcher of price generator workers.
+Trading instruments are split between containers and worker processes with consistent hashing,
+so adding a worker moves only a small part of instruments to it.
+Copyright © 2022. All Rights are Reserved by Maria Chichkan
+"""
+
+import sys
+import time
+import asyncio
+import bisect
+import hashlib
+import multiprocessing
+
+sys.path.insert(0, "../utils")
+from settings import (
+    TRADING_INSTRUMENTS,
+    PRICE_MODEL,
+    PRICE_MODEL_SEED,
+    PRICE_REPLAY_FILE,
+    PRICE_REPLAY_TICKS,
+    PRICE_GENERATOR_SHARDS,
+    PRICE_GENERATOR_SHARD,
+    PRICE_GENERATOR_WORKERS,
+    METRICS_PORT,
+    _logging,
+)
+import price_generator
+from price_models import ReplayModel
+
+# A worker, which has run for this time (in seconds), is healthy,
+# and its next restart isn't delayed for its earlier failures
+HEALTHY_PERIOD = 60
+
+
+class ConsistentHashRing:
+    """Ring of nodes with virtual replicas, a key belongs to the next node on the ring"""
+    def __init__(self, nodes, replicas=100, salt=""):
+        """
+        Args:
+            nodes: list of node names
+            replicas: int, number of points of each node on the ring
+            salt: string, makes rings with the same nodes independent
+        """
+        self.salt = salt
+        self.ring = sorted(
+            (self.hash(f"{node}:{replica}"), node)
+            for node in nodes
+            for replica in range(replicas)
+        )
+        self.points = [point for point, _ in self.ring]
+
+    def hash(self, key):
+        return int(hashlib.md5(f"{self.salt}{key}".encode()).hexdigest()[:16], 16)
+
+    def node(self, key):
+        """Node, which the key belongs to"""
+        i = bisect.bisect(self.points, self.hash(key)) % len(self.points)
+        return self.ring[i][1]
+
+
+def partition(instruments, n_parts, salt=""):
+    """Split instruments into n_parts lists with consistent hashing"""
+    ring = ConsistentHashRing(range(n_parts), salt=salt)
+    parts = [[] for _ in range(n_parts)]
+    for instrument in instruments:
+        parts[ring.node(instrument)].append(instrument)
+    return parts
+
+
+class Ownership:
+    """
+    Tells whether an instrument belongs to the worker of the shard,
+    in the same way as partition splits them, so that workers pick their part
+    of instruments added to the registry at runtime
+    """
+    def __init__(self, n_shards, shard, n_workers, worker):
+        self.shard_ring = ConsistentHashRing(range(n_shards), salt="shard")
+        self.worker_ring = ConsistentHashRing(range(n_workers), salt="worker")
+        self.shard = shard
+        self.worker = worker
+
+    def __call__(self, instrument):
+        return (
+            self.shard_ring.node(instrument) == self.shard
+            and self.worker_ring.node(instrument) == self.worker
+        )
+
+
+def run_worker(instruments, seed, metrics_port, owns, first_column):
+    """Entry point of a worker process: it has its own event loop and Redis pool"""
+    asyncio.run(
+        price_generator.main(instruments, seed, metrics_port, owns, first_column)
+    )
+
+
+def main():
+    """Start workers with their parts of instruments and restart them if they fail"""
+    logger = _logging()
+    instruments = partition(TRADING_INSTRUMENTS, PRICE_GENERATOR_SHARDS, "shard")[
+        PRICE_GENERATOR_SHARD
+    ]
+    parts = partition(instruments, PRICE_GENERATOR_WORKERS, "worker")
+    owners = [
+        Ownership(
+            PRICE_GENERATOR_SHARDS, PRICE_GENERATOR_SHARD, PRICE_GENERATOR_WORKERS, i
+        )
+        for i in range(len(parts))
+    ]
+    # Workers of all shards replay their own columns of the recording
+    n_workers = PRICE_GENERATOR_SHARDS * PRICE_GENERATOR_WORKERS
+    columns_per_worker = -(-len(TRADING_INSTRUMENTS) // n_workers)
+    if PRICE_MODEL == "replay":
+        # Recording is created once, so that workers don't write it at the same time
+        ReplayModel(
+            PRICE_REPLAY_FILE,
+            len(TRADING_INSTRUMENTS),
+            PRICE_REPLAY_TICKS,
+            PRICE_MODEL_SEED,
+        )
+    # Workers don't share the state of the parent process
+    context = multiprocessing.get_context("spawn")
+    workers = [None] * len(parts)
+    failures = [0] * len(parts)
+    started_at = [0.0] * len(parts)
+    restart_at = [0.0] * len(parts)
+    while True:
+        for i, part in enumerate(parts):
+            worker = workers[i]
+            if worker is not None and worker.is_alive():
+                continue
+            if worker is not None:
+                if time.monotonic() - started_at[i] >= HEALTHY_PERIOD:
+                    failures[i] = 0
+                failures[i] += 1
+                # Restarts of a failing worker are delayed more and more, up to a minute
+                restart_at[i] = time.monotonic() + min(2 ** failures[i], 60)
+                logger.error(
+                    f"Price generator worker {i} exited with code {worker.exitcode}"
+                )
+                workers[i] = None
+            if time.monotonic() < restart_at[i]:
+                continue
+            # Seeds and columns of the recording are unique across shards,
+            # so that they don't generate the same prices
+            worker_id = PRICE_GENERATOR_SHARD * PRICE_GENERATOR_WORKERS + i
+            seed = None if PRICE_MODEL_SEED is None else PRICE_MODEL_SEED + worker_id
+            # Workers without instruments are started too, they wait for them to be registered
+            workers[i] = context.Process(
+                target=run_worker,
+                args=(
+                    part,
+                    seed,
+                    METRICS_PORT + i if METRICS_PORT else 0,
+                    owners[i],
+                    worker_id * columns_per_worker,
+                ),
+                name=f"price-generator-{i}",
+                daemon=True,
+            )
+            workers[i].start()
+            started_at[i] = time.monotonic()
+            logger.info(f"Started price generator worker {i} with {len(part)} instruments")
+        time.sleep(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,76 +5,184 @@ Copyright © 2022. All Rights are Reserved by Maria Chichkan
 
 import sys
 import asyncio
-import json
+import logging
 from datetime import datetime
-from random import random
 import aioredis
 sys.path.insert(0, "../utils")
-from settings import REDIS_CLIENT, TRADING_INSTRUMENTS, REDIS_RETENTION_PERIOD, _logging
+from settings import (
+    REDIS_CLIENT,
+    TRADING_INSTRUMENTS,
+    REDIS_RETENTION_PERIOD,
+    TICK_INTERVAL_MS,
+    PRICE_EMISSION_MODE,
+    PRICE_BATCH_SIZE,
+    PRICE_MODEL,
+    PRICE_MODEL_SEED,
+    PRICE_INITIAL,
+    PRICE_GBM_DRIFT,
+    PRICE_GBM_VOLATILITY,
+    PRICE_REPLAY_FILE,
+    PRICE_REPLAY_TICKS,
+    TICK_CODEC,
+    TICK_BATCH_CHANNEL,
+    TICK_CODEC_NEGOTIATE_INTERVAL,
+    REDIS_MAX_CONNECTIONS,
+    INGESTION_MODE,
+    PRICE_STREAM,
+    PRICE_STREAM_MAXLEN,
+    METRICS_PORT,
+    LOG_TICK_EVERY,
+    INSTRUMENT_REGISTRY_REFRESH,
+    _logging,
+)
+from metrics import REGISTRY, start_http_server
+from instrument_registry import CHANNEL, VERSION_KEY, parse_read, queue_read
+from tick_codecs import (
+    ADVERTISEMENT_KEY,
+    CONSUMER_KEY_PREFIX,
+    BinaryCodec,
+    JsonCodec,
+    negotiate,
+)
+from price_models import PriceEngine, create_price_model
+
+TICKS = REGISTRY.counter("price_generator_ticks", "Ticks of price generator")
+SKIPPED_TICKS = REGISTRY.counter(
+    "price_generator_skipped_ticks", "Ticks skipped because of overload"
+)
+PRICES = REGISTRY.counter("price_generator_prices", "Prices sent to Redis")
+FAILED_PRICES = REGISTRY.counter(
+    "price_generator_failed_prices", "Prices Redis refused to add"
+)
+INSTRUMENTS = REGISTRY.gauge(
+    "price_generator_instruments", "Instruments, whose prices are generated"
+)
+PUBLISH_LATENCY = REGISTRY.histogram(
+    "price_generator_publish_latency_seconds",
+    "Time from the tick to prices added to Redis and published",
+)
 
 
 class PriceGenerator:
     """
     This class generates prices of trading instruments and sends them to Redis
     """
-    def __init__(self, trading_instruments: list):
+    def __init__(
+        self, trading_instruments: list, seed=PRICE_MODEL_SEED, owns=None, first_column=0
+    ):
         """
         Args:
-            trading_instruments: list
+            trading_instruments: list, instruments until the registry is read from Redis
+            seed: int or None, seed of the price model
+            owns: function telling whether a registered instrument belongs
+                to this generator, all of them belong to it if None
+            first_column: int, column of the recording of "replay" model,
+                which the first instrument replays
         """
         # Redis client bound to pool of connections (auto-reconnecting).
+        # Commands wait for a free connection when all REDIS_MAX_CONNECTIONS are busy
         self.__redis_url = f"redis://{REDIS_CLIENT.HOST}:{REDIS_CLIENT.PORT}"
-        self.redis = aioredis.from_url(
-            self.__redis_url,
-            password=REDIS_CLIENT.PASSWORD,
-            encoding="utf-8",
-            decode_responses=True,
+        self.redis = aioredis.Redis(
+            connection_pool=aioredis.BlockingConnectionPool.from_url(
+                self.__redis_url,
+                password=REDIS_CLIENT.PASSWORD,
+                max_connections=REDIS_MAX_CONNECTIONS,
+                encoding="utf-8",
+                decode_responses=True,
+            )
+        )
+        self.trading_instruments = list(trading_instruments)
+        self.owns = owns
+        # Version of the registry of instruments, which is applied
+        self.registry_version = 0
+        # Coroutines of instruments in "per_instrument" mode
+        self.instrument_tasks = {}
+        self.pubsub = None
+        # Prices of all instruments are kept in one NumPy array
+        self.engine = PriceEngine(
+            trading_instruments,
+            create_price_model(
+                PRICE_MODEL,
+                len(trading_instruments),
+                seed,
+                drift=PRICE_GBM_DRIFT,
+                volatility=PRICE_GBM_VOLATILITY,
+                path=PRICE_REPLAY_FILE,
+                ticks=PRICE_REPLAY_TICKS,
+                first_column=first_column,
+            ),
+            PRICE_INITIAL,
         )
-        self.trading_instruments = trading_instruments
-        self.trading_prices = {instr: 0 for instr in trading_instruments}
+        INSTRUMENTS.set_function(lambda: len(self.trading_instruments))
+        # Format of tick messages, json until consumers are checked
+        self.codec = JsonCodec
         self.logger = _logging()
 
-    async def subscribe(self):
-        """Subscribe to all trading instruments, listed in settings"""
+    async def subscribe(self, instruments=None):
+        """Subscribe to trading instruments, to all of them by default"""
         try:
-            pubsub = self.redis.pubsub()
-            for instr in self.trading_instruments:
-                await pubsub.psubscribe(instr)
+            if self.pubsub is None:
+                self.pubsub = self.redis.pubsub()
+            for instr in self.trading_instruments if instruments is None else instruments:
+                await self.pubsub.psubscribe(instr)
                 self.logger.info(f"Subscribed to instrument {instr}")
         except Exception as ex:
             self.logger.error(ex)
 
-    @staticmethod
-    def generate_movement():
-        """Let's imagine that the price of a trading instrument changes randomly by 1"""
-        movement = -1 if random() < 0.5 else 1
-        return movement
+    def generate_movement(self, instrument=None):
+        """
+        Move prices of all trading instruments with one vectorized draw of the price model
+        or only the price of the given instrument
+        Args:
+            instrument: string or None
+        """
+        self.engine.step(instrument)
+
+    async def ticks(self):
+        """
+        Yield timestamp (in milliseconds) of every tick.
+        Ticks are scheduled at fixed points of the event loop clock TICK_INTERVAL_MS apart,
+        so a late tick doesn't shift the next ones. Ticks missed under overload are skipped.
+        """
+        loop = asyncio.get_running_loop()
+        interval = TICK_INTERVAL_MS / 1000
+        next_tick = loop.time()
+        while True:
+            yield int(datetime.now().timestamp() * 1000)
+            next_tick += interval
+            delay = next_tick - loop.time()
+            if delay < 0:
+                missed = int(-delay // interval) + 1
+                next_tick += missed * interval
+                delay += missed * interval
+                SKIPPED_TICKS.inc(missed)
+                self.logger.warning(
+                    f"Skipped {missed} ticks, prices are generated slower "
+                    f"than every {TICK_INTERVAL_MS} ms"
+                )
+            await asyncio.sleep(delay)
 
     async def generate_trading_price(self, instrument):
         """
-        This function calculates a new price for the trading instrument every second,
+        This function calculates a new price for the trading instrument every tick,
         publishes it to Redis channel with the name equals to the instrument's name
         and also saves it to the Redis Time Series with the name equals to the instrument's name
         Args:
             instrument: string
         """
-        while True:
+        async for current_time in self.ticks():
             try:
-                if instrument not in self.trading_prices.keys():
-                    self.trading_prices[instrument] = 0
                 # Get current price of a trading instrument
-                self.trading_prices[instrument] += self.generate_movement()
-                self.logger.info(
-                    f"Instrument {instrument} has price {self.trading_prices[instrument]}"
-                )
-                current_time = int(datetime.now().timestamp() * 1000)
+                self.generate_movement(instrument)
+                price = self.engine.price(instrument)
+                self.logger.debug(f"Instrument {instrument} has price {price}")
                 # Add new value for Redis Time Series of a trading instrument
                 # 60000 ms equals 1 minute
                 await self.redis.execute_command(
                     "TS.ADD",
                     instrument,
                     current_time,
-                    self.trading_prices[instrument],
+                    price,
                     "RETENTION",
                     REDIS_RETENTION_PERIOD * 60000,
                     "ON_DUPLICATE",
@@ -87,29 +195,277 @@ class PriceGenerator:
                 )
 
                 await self.redis.publish(
-                    instrument,
-                    json.dumps(
-                        {"time": current_time, "value": self.trading_prices[instrument]}
-                    ),
+                    instrument, self.codec.encode_tick(instrument, current_time, price)
+                )
+                if INGESTION_MODE == "stream":
+                    await self.redis.xadd(
+                        PRICE_STREAM,
+                        {"frame": BinaryCodec.encode_tick(instrument, current_time, price)},
+                        maxlen=PRICE_STREAM_MAXLEN,
+                        approximate=True,
+                    )
+                PRICES.inc()
+                PUBLISH_LATENCY.observe(
+                    datetime.now().timestamp() - current_time / 1000
                 )
-                sleep_interval = (
-                    1000 - (int(datetime.now().timestamp() * 1000) - current_time)
-                ) / 1000
-                # New price have to be sent every second
-                await asyncio.sleep(sleep_interval if sleep_interval > 0 else 0)
             except Exception as ex:
                 self.logger.error(
                     f"{ex} while updating price for instrument {instrument}"
                 )
 
+    async def negotiate_codec(self):
+        """
+        Choose format of tick messages every TICK_CODEC_NEGOTIATE_INTERVAL seconds:
+        TICK_CODEC if all registered consumers can decode it and json otherwise.
+        The chosen format is advertised under ADVERTISEMENT_KEY.
+        """
+        while True:
+            try:
+                keys = [
+                    key async for key in self.redis.scan_iter(f"{CONSUMER_KEY_PREFIX}*")
+                ]
+                consumers = await self.redis.mget(keys) if keys else []
+                codec = negotiate(TICK_CODEC, [value for value in consumers if value])
+                if codec is not self.codec:
+                    self.logger.info(
+                        f"Tick messages are published in {codec.name} format "
+                        f"version {codec.version}"
+                    )
+                    self.codec = codec
+                await self.redis.set(
+                    ADVERTISEMENT_KEY, f"{codec.name}:{codec.version}"
+                )
+            except Exception as ex:
+                self.logger.error(f"{ex} while choosing format of tick messages")
+            await asyncio.sleep(TICK_CODEC_NEGOTIATE_INTERVAL)
+
+    async def create_timeseries(self, instruments=None):
+        """
+        Create Redis Time Series for every trading instrument or for the given ones.
+        TS.MADD can't create series with labels, so in "batch" mode they are created beforehand.
+        Series that already exist get the same retention and duplicate policy.
+        """
+        if instruments is None:
+            instruments = self.trading_instruments
+        # 60000 ms equals 1 minute
+        retention = REDIS_RETENTION_PERIOD * 60000
+        pipe = self.redis.pipeline(transaction=False)
+        for instrument in instruments:
+            pipe.execute_command(
+                "TS.CREATE",
+                instrument,
+                "RETENTION",
+                retention,
+                "DUPLICATE_POLICY",
+                "FIRST",
+                "LABELS",
+                "name",
+                instrument,
+                "type",
+                "trading_instruments",
+            )
+        results = await pipe.execute(raise_on_error=False)
+
+        pipe = self.redis.pipeline(transaction=False)
+        for instrument, result in zip(instruments, results):
+            if isinstance(result, Exception):
+                if "already exists" not in str(result):
+                    self.logger.error(f"{result} while creating time series {instrument}")
+                    continue
+                pipe.execute_command(
+                    "TS.ALTER",
+                    instrument,
+                    "RETENTION",
+                    retention,
+                    "DUPLICATE_POLICY",
+                    "FIRST",
+                )
+        for result in await pipe.execute(raise_on_error=False):
+            if isinstance(result, Exception):
+                self.logger.error(f"{result} while altering time series")
+        self.logger.info(f"Created time series for {len(instruments)} instruments")
+
+    async def send_trading_prices(self, instruments, prices, current_time):
+        """
+        Send prices of instruments to Redis in one pipeline:
+        one TS.MADD for all of them followed by a PUBLISH per instrument
+        or by one PUBLISH of batched frame to TICK_BATCH_CHANNEL
+        and in stream ingestion mode by XADD of binary batched frame to PRICE_STREAM.
+        Returns the number of samples Redis refused to add.
+        Args:
+            instruments: list
+            prices: list, prices of instruments in the same order
+            current_time: int, timestamp in milliseconds
+        """
+        madd_args = []
+        for instrument, price in zip(instruments, prices):
+            madd_args += [instrument, current_time, price]
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.execute_command("TS.MADD", *madd_args)
+        if TICK_BATCH_CHANNEL:
+            pipe.publish(
+                TICK_BATCH_CHANNEL,
+                self.codec.encode_batch(current_time, instruments, prices),
+            )
+        else:
+            for instrument, price in zip(instruments, prices):
+                pipe.publish(
+                    instrument, self.codec.encode_tick(instrument, current_time, price)
+                )
+        if INGESTION_MODE == "stream":
+            # Frames of the stream are read only by price db updater, which decodes binary
+            pipe.xadd(
+                PRICE_STREAM,
+                {"frame": BinaryCodec.encode_batch(current_time, instruments, prices)},
+                maxlen=PRICE_STREAM_MAXLEN,
+                approximate=True,
+            )
+        results = await pipe.execute(raise_on_error=False)
+        PUBLISH_LATENCY.observe(datetime.now().timestamp() - current_time / 1000)
+        added = results[0]
+        if isinstance(added, Exception):
+            self.logger.error(f"{added} while adding prices to Redis")
+            FAILED_PRICES.inc(len(instruments))
+            return len(instruments)
+        if INGESTION_MODE == "stream" and isinstance(results[-1], Exception):
+            self.logger.error(f"{results[-1]} while appending prices to Redis stream")
+        return sum(isinstance(sample, Exception) for sample in added)
+
+    async def generate_trading_prices(self):
+        """
+        This function calculates new prices for all trading instruments every tick
+        with a single scheduler and sends them to Redis in pipelines of PRICE_BATCH_SIZE instruments,
+        so the number of round trips doesn't grow with the number of instruments
+        """
+        await self.create_timeseries()
+        n_ticks = 0
+        async for current_time in self.ticks():
+            try:
+                # Instruments may be added and removed between ticks
+                instruments = self.trading_instruments
+                batches = range(0, len(instruments), PRICE_BATCH_SIZE)
+                self.generate_movement()
+                prices = self.engine.current_prices().tolist()
+                failed = sum(
+                    await asyncio.gather(
+                        *(
+                            self.send_trading_prices(
+                                instruments[i : i + PRICE_BATCH_SIZE],
+                                prices[i : i + PRICE_BATCH_SIZE],
+                                current_time,
+                            )
+                            for i in batches
+                        )
+                    )
+                )
+                TICKS.inc()
+                PRICES.inc(len(prices) - failed)
+                if failed:
+                    FAILED_PRICES.inc(failed)
+                    self.logger.error(f"Redis refused {failed} prices, recreating time series")
+                    await self.create_timeseries()
+                # Per-tick lines are sampled, timings are reported by metrics
+                n_ticks += 1
+                if n_ticks % LOG_TICK_EVERY == 0:
+                    level = logging.INFO
+                elif self.logger.isEnabledFor(logging.DEBUG):
+                    level = logging.DEBUG
+                else:
+                    continue
+                self.logger.log(
+                    level,
+                    f"Sent prices of {len(instruments)} instruments "
+                    f"in {len(batches)} batches",
+                )
+            except Exception as ex:
+                self.logger.error(f"{ex} while updating prices of trading instruments")
+
+    def start_instrument(self, instrument):
+        """Start coroutine of the instrument in "per_instrument" mode"""
+        self.instrument_tasks[instrument] = asyncio.ensure_future(
+            self.generate_trading_price(instrument)
+        )
+
+    async def apply_instruments(self, instruments):
+        """
+        Start generating prices of new instruments and stop generating removed ones.
+        Time series of removed instruments are left to expire with their retention.
+        Args:
+            instruments: list of instruments of this generator
+        """
+        current = set(self.trading_instruments)
+        added = [instr for instr in instruments if instr not in current]
+        removed = list(current.difference(instruments))
+        if not added and not removed:
+            return
+        if added:
+            await self.create_timeseries(added)
+            await self.subscribe(added)
+        self.engine.update(added, removed)
+        self.trading_instruments = list(self.engine.instruments)
+        if PRICE_EMISSION_MODE != "batch":
+            for instrument in removed:
+                self.instrument_tasks.pop(instrument).cancel()
+            for instrument in added:
+                self.start_instrument(instrument)
+        self.logger.info(
+            f"Instruments changed: {len(added)} added, {len(removed)} removed, "
+            f"{len(self.trading_instruments)} in total"
+        )
+
+    async def refresh_instruments(self):
+        """Apply the registry of instruments from Redis, if its version is newer"""
+        version = int(await self.redis.get(VERSION_KEY) or 0)
+        if version <= self.registry_version:
+            return
+        version, names = parse_read(
+            await queue_read(self.redis.pipeline(transaction=True)).execute()
+        )
+        await self.apply_instruments(
+            [instr for instr in sorted(names) if self.owns is None or self.owns(instr)]
+        )
+        self.registry_version = version
+
+    async def watch_instruments(self):
+        """
+        Follow changes of the registry of instruments, which price db updater
+        mirrors to Redis: on notifications and every INSTRUMENT_REGISTRY_REFRESH seconds,
+        in case a notification is missed. Until the registry is mirrored,
+        instruments given to the generator are used.
+        """
+        pubsub = None
+        while True:
+            try:
+                if pubsub is None:
+                    pubsub = self.redis.pubsub()
+                    await pubsub.subscribe(CHANNEL)
+                await self.refresh_instruments()
+                await pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=INSTRUMENT_REGISTRY_REFRESH
+                )
+            except Exception as ex:
+                self.logger.error(f"{ex} while refreshing instruments")
+                pubsub = None
+                await asyncio.sleep(INSTRUMENT_REGISTRY_REFRESH)
+
 
-async def main():
+async def main(
+    trading_instruments=TRADING_INSTRUMENTS,
+    seed=PRICE_MODEL_SEED,
+    metrics_port=METRICS_PORT,
+    owns=None,
+    first_column=0,
+):
     """Generate and save trading instruments prices to Redis cache"""
-    price_generator = PriceGenerator(TRADING_INSTRUMENTS)
+    start_http_server(metrics_port)
+    price_generator = PriceGenerator(trading_instruments, seed, owns, first_column)
     await price_generator.subscribe()
-    tasks = []
-    for instrument in TRADING_INSTRUMENTS:
-        tasks.append(price_generator.generate_trading_price(instrument))
+    tasks = [price_generator.negotiate_codec(), price_generator.watch_instruments()]
+    if PRICE_EMISSION_MODE == "batch":
+        tasks.append(price_generator.generate_trading_prices())
+    else:
+        for instrument in price_generator.trading_instruments:
+            price_generator.start_instrument(instrument)
     await asyncio.gather(*tasks, return_exceptions=True)
 
 
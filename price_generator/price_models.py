@@ -0,0 +1,206 @@
+"""
+Price models for trading instruments, vectorized with NumPy
+Copyright © 2022. All Rights are Reserved by Maria Chichkan
+"""
+
+import os
+import numpy as np
+
+
+class PriceModel:
+    """
+    Base class of price models.
+    A model moves prices of many instruments at once with one vectorized draw
+    """
+    def __init__(self, seed=None):
+        """
+        Args:
+            seed: int or None, fixed seed makes the generated prices reproducible
+        """
+        self.rng = np.random.default_rng(seed)
+
+    def step(self, prices, columns=slice(None)):
+        """
+        Move prices in place
+        Args:
+            prices: numpy array with prices of all instruments
+            columns: slice of instruments to move
+        """
+        raise NotImplementedError
+
+    def reindex(self, keep, n_added):
+        """
+        Follow changes of instruments, if the model keeps state per instrument
+        Args:
+            keep: numpy array with positions of kept instruments, in their new order
+            n_added: int, number of instruments added after them
+        """
+
+
+class RandomWalkModel(PriceModel):
+    """The price of a trading instrument changes randomly by 1"""
+    def step(self, prices, columns=slice(None)):
+        moved = prices[columns]
+        moved += self.rng.integers(0, 2, size=moved.shape) * 2 - 1
+
+
+class GeometricBrownianMotionModel(PriceModel):
+    """Geometric Brownian motion with drift and volatility given per tick"""
+    def __init__(self, drift=0.0, volatility=0.01, seed=None):
+        """
+        Args:
+            drift: float, expected return per tick
+            volatility: float, standard deviation of return per tick
+            seed: int or None
+        """
+        super().__init__(seed)
+        self.drift = drift
+        self.volatility = volatility
+
+    def step(self, prices, columns=slice(None)):
+        moved = prices[columns]
+        shocks = self.rng.standard_normal(moved.shape)
+        moved *= np.exp(
+            self.drift - 0.5 * self.volatility ** 2 + self.volatility * shocks
+        )
+
+
+class ReplayModel(PriceModel):
+    """
+    Replays movements recorded in a .npy file (ticks x instruments).
+    If the file doesn't exist, random walk movements are generated with the given seed
+    and saved there, so every next run replays exactly the same prices.
+    Instruments replay columns of the recording from first_column on,
+    so that workers given different ones don't move their instruments identically.
+    """
+    def __init__(self, path, n_instruments, ticks=3600, seed=None, first_column=0):
+        """
+        Args:
+            path: string, path to .npy file with movements
+            n_instruments: int
+            ticks: int, number of ticks to record if the file doesn't exist
+            seed: int or None
+            first_column: int, column of the recording replayed by the first instrument
+        """
+        super().__init__(seed)
+        if os.path.isfile(path):
+            self.recording = np.load(path)
+        else:
+            self.recording = (
+                self.rng.integers(0, 2, size=(ticks, max(n_instruments, 1))) * 2 - 1
+            ).astype(np.int8)
+            # Readers never see a partly written file
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as file:
+                np.save(file, self.recording)
+            os.replace(tmp_path, path)
+        # Recording with fewer instruments than we have is repeated across columns
+        self.movements = self.recording_columns(first_column, n_instruments)
+        # Column replayed by the next added instrument
+        self.next_column = first_column + n_instruments
+        self.ticks = np.zeros(n_instruments, dtype=np.int64)
+
+    def recording_columns(self, start, n):
+        return self.recording[:, np.arange(start, start + n) % self.recording.shape[1]]
+
+    def reindex(self, keep, n_added):
+        # Added instruments replay the next columns of the recording
+        self.movements = np.concatenate(
+            [
+                self.movements[:, keep],
+                self.recording_columns(self.next_column, n_added),
+            ],
+            axis=1,
+        )
+        self.next_column += n_added
+        self.ticks = np.concatenate(
+            [self.ticks[keep], np.zeros(n_added, dtype=np.int64)]
+        )
+
+    def step(self, prices, columns=slice(None)):
+        ticks = self.ticks[columns]
+        moved = prices[columns]
+        instruments = np.arange(self.ticks.shape[0])[columns]
+        moved += self.movements[ticks % self.movements.shape[0], instruments]
+        ticks += 1
+
+
+def create_price_model(name, n_instruments, seed=None, **params):
+    """
+    Create price model by its name: "random_walk", "gbm" or "replay"
+    Args:
+        name: string
+        n_instruments: int
+        seed: int or None
+        params: parameters of the model
+    """
+    if name == "random_walk":
+        return RandomWalkModel(seed)
+    if name == "gbm":
+        return GeometricBrownianMotionModel(
+            params.get("drift", 0.0), params.get("volatility", 0.01), seed
+        )
+    if name == "replay":
+        return ReplayModel(
+            params["path"],
+            n_instruments,
+            params.get("ticks", 3600),
+            seed,
+            params.get("first_column", 0),
+        )
+    raise ValueError(f"Unknown price model {name}")
+
+
+class PriceEngine:
+    """
+    Keeps prices of all trading instruments in one NumPy array
+    and moves them with a price model
+    """
+    def __init__(self, instruments, model, initial_price=0):
+        """
+        Args:
+            instruments: list
+            model: PriceModel
+            initial_price: float
+        """
+        self.instruments = list(instruments)
+        self.index = {instr: i for i, instr in enumerate(self.instruments)}
+        self.initial_price = float(initial_price)
+        self.prices = np.full(len(self.instruments), self.initial_price)
+        self.model = model
+
+    def update(self, added=(), removed=()):
+        """
+        Add and remove instruments, prices of the other ones keep moving from where they are
+        Args:
+            added: list, new instruments start from the initial price
+            removed: list
+        """
+        removed = set(removed)
+        added = [instr for instr in dict.fromkeys(added) if instr not in self.index]
+        keep = np.array(
+            [i for i, instr in enumerate(self.instruments) if instr not in removed],
+            dtype=np.int64,
+        )
+        self.instruments = [self.instruments[i] for i in keep] + added
+        self.index = {instr: i for i, instr in enumerate(self.instruments)}
+        self.prices = np.concatenate(
+            [self.prices[keep], np.full(len(added), self.initial_price)]
+        )
+        self.model.reindex(keep, len(added))
+
+    def step(self, instrument=None):
+        """Move prices of all instruments or only of the given one"""
+        if instrument is None:
+            self.model.step(self.prices)
+        else:
+            i = self.index[instrument]
+            self.model.step(self.prices, slice(i, i + 1))
+
+    def price(self, instrument):
+        """Current price of the instrument as it is sent to Redis"""
+        return int(round(self.prices[self.index[instrument]]))
+
+    def current_prices(self):
+        """Current prices of all instruments as they are sent to Redis"""
+        return np.rint(self.prices).astype(np.int64)
@@ -0,0 +1,200 @@
+"""
+Archive of closed days of trading prices in Parquet files
+Copyright © 2022. All Rights are Reserved by Maria Chichkan
+"""
+
+import os
+import errno
+import shutil
+import datetime
+import tempfile
+from urllib.parse import quote
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from pyarrow.fs import LocalFileSystem
+
+# Files are laid out as <root>/day=2022-11-01/instrument_id=<name>/part-0-0.parquet
+PARTITIONING = ds.partitioning(
+    pa.schema([("day", pa.string()), ("instrument_id", pa.string())]), flavor="hive"
+)
+INSTRUMENT_PARTITIONING = ds.partitioning(
+    pa.schema([("instrument_id", pa.string())]), flavor="hive"
+)
+# Marks days, which are archived completely
+SUCCESS = "_SUCCESS"
+COLUMNS = ["instrument_id", "created_at", "price"]
+
+
+def day_dir(root, day):
+    return os.path.join(root, f"day={day:%Y-%m-%d}")
+
+
+def instrument_dir(root, day, instrument):
+    # Values of hive partitions are URI-encoded in paths
+    return os.path.join(
+        day_dir(root, day), f"instrument_id={quote(instrument, safe='')}"
+    )
+
+
+def archived_days(root):
+    """Days, which are archived completely"""
+    if not root or not os.path.isdir(root):
+        return set()
+    return {
+        datetime.date.fromisoformat(name[len("day="):])
+        for name in os.listdir(root)
+        if name.startswith("day=")
+        and os.path.exists(os.path.join(root, name, SUCCESS))
+    }
+
+
+def to_ms_scalar(value):
+    """Timestamp scalar of the same unit as created_at column"""
+    return pa.scalar(
+        value.replace(microsecond=value.microsecond // 1000 * 1000), pa.timestamp("ms")
+    )
+
+
+def split_period(date_from, date_to, days):
+    """
+    Split period into parts, which are all in archived days or all out of them.
+    Returns list of (archived, date_from, date_to), bounds are included as in BETWEEN.
+    Args:
+        date_from: datetime
+        date_to: datetime
+        days: set of archived days
+    """
+    parts = []
+    start = date_from
+    while start <= date_to:
+        midnight = datetime.datetime.combine(
+            start.date() + datetime.timedelta(days=1), datetime.time()
+        )
+        end = min(midnight - datetime.timedelta(microseconds=1), date_to)
+        archived = start.date() in days
+        if parts and parts[-1][0] == archived:
+            parts[-1][2] = end
+        else:
+            parts.append([archived, start, end])
+        start = midnight
+    return [tuple(part) for part in parts]
+
+
+class DayWriter:
+    """
+    This class writes prices of a day to a temporary folder of its own,
+    which is renamed to the folder of the day, when all prices are written.
+    The folder of the day appears complete or not at all, and an archived day
+    isn't replaced, so replicas of price db updater don't break each other's files.
+    """
+    def __init__(self, root, day, compression="zstd"):
+        self.day = day
+        self.path = day_dir(root, day)
+        # Hidden from archived_days and readers, unique per writer
+        os.makedirs(root, exist_ok=True)
+        self.tmp_path = tempfile.mkdtemp(prefix=f".day={day:%Y-%m-%d}.tmp-", dir=root)
+        self.options = ds.ParquetFileFormat().make_write_options(compression=compression)
+        self.parts = 0
+
+    def write(self, instrument_ids, created_at_ms, prices):
+        """
+        Write prices given as columns, sorted by instrument and time,
+        so that statistics of row groups let readers skip them
+        """
+        table = pa.table(
+            {
+                "instrument_id": pa.array(instrument_ids, pa.string()),
+                "created_at": pa.array(created_at_ms, pa.int64()).cast(pa.timestamp("ms")),
+                "price": pa.array(prices, pa.int32()),
+            }
+        )
+        ds.write_dataset(
+            table,
+            self.tmp_path,
+            format="parquet",
+            partitioning=INSTRUMENT_PARTITIONING,
+            file_options=self.options,
+            basename_template=f"part-{self.parts}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+        self.parts += 1
+
+    def commit(self):
+        """Returns False, if the day has been archived by another process"""
+        open(os.path.join(self.tmp_path, SUCCESS), "w").close()
+        try:
+            # Fails, if the folder of the day isn't empty
+            os.rename(self.tmp_path, self.path)
+        except OSError as error:
+            if error.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                raise
+            if os.path.exists(os.path.join(self.path, SUCCESS)):
+                shutil.rmtree(self.tmp_path, ignore_errors=True)
+                return False
+            # An incomplete folder left by an interrupted export of older versions
+            shutil.rmtree(self.path)
+            os.rename(self.tmp_path, self.path)
+        return True
+
+    def abort(self):
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+
+def read_prices(root, instruments, date_from, date_to):
+    """
+    Archived prices of instruments from date_from to date_to as DataFrame
+    with instrument_id, created_at and price.
+    Only files of archived days and given instruments are opened, they are memory-mapped,
+    only needed columns are read, and row groups out of the period are skipped.
+    Args:
+        root: string, folder of the archive
+        instruments: list, all instruments if empty
+        date_from: datetime
+        date_to: datetime
+    """
+    days = archived_days(root)
+    files = []
+    day = date_from.date()
+    while day <= date_to.date():
+        if day in days:
+            folders = (
+                [instrument_dir(root, day, instrument) for instrument in instruments]
+                if instruments
+                else [
+                    os.path.join(day_dir(root, day), name)
+                    for name in os.listdir(day_dir(root, day))
+                    if name.startswith("instrument_id=")
+                ]
+            )
+            for folder in folders:
+                if os.path.isdir(folder):
+                    files += [
+                        os.path.join(folder, name)
+                        for name in sorted(os.listdir(folder))
+                        if name.endswith(".parquet")
+                    ]
+        day += datetime.timedelta(days=1)
+    if not files:
+        return pd.DataFrame(
+            {
+                "instrument_id": pd.Series(dtype=object),
+                "created_at": pd.Series(dtype="datetime64[ns]"),
+                "price": pd.Series(dtype="int64"),
+            }
+        )
+    dataset = ds.dataset(
+        files,
+        format="parquet",
+        filesystem=LocalFileSystem(use_mmap=True),
+        partitioning=PARTITIONING,
+        partition_base_dir=root,
+    )
+    created_at = ds.field("created_at")
+    table = dataset.to_table(
+        columns=COLUMNS,
+        filter=(created_at >= to_ms_scalar(date_from))
+        & (created_at <= to_ms_scalar(date_to)),
+    )
+    return table.to_pandas()
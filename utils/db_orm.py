@@ -2,17 +2,87 @@
 Database ORM classes for TradingApp project
 Copyright © 2022. All Rights are Reserved by Maria Chichkan
 """
-from sqlalchemy.dialects.postgresql import INTEGER, VARCHAR, TIMESTAMP
-from sqlalchemy import Column
+from sqlalchemy.dialects.postgresql import (
+    BIGINT,
+    BOOLEAN,
+    INTEGER,
+    SMALLINT,
+    VARCHAR,
+    TIMESTAMP,
+)
+from sqlalchemy import Column, func
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
 
+# Indexes of trading_prices created by migrations of price db updater:
+# BRIN for scans of time windows of all instruments and covering index
+# for index-only scans of prices of selected instruments
+PRICES_TIME_INDEX = 'trading_prices_created_at_brin'
+PRICES_COVERING_INDEX = 'trading_prices_instrument_created_at_price'
+
+
 class TradingPrices(Base):
     """Table with historical trading prices"""
     __tablename__ = 'trading_prices'
+    # Partitions by day are managed by price db updater
+    __table_args__ = {'postgresql_partition_by': 'RANGE (created_at)'}
     instrument_id = Column('instrument_id', VARCHAR(50), primary_key=True)
     created_at = Column('created_at', TIMESTAMP, primary_key=True)
     price = Column('price', INTEGER)
 
+
+class SyncWatermarks(Base):
+    """Timestamp (in milliseconds) of the latest price of each instrument saved to trading_prices"""
+    __tablename__ = 'sync_watermarks'
+    instrument_id = Column('instrument_id', VARCHAR(50), primary_key=True)
+    synced_at = Column('synced_at', BIGINT, nullable=False)
+
+
+class TradingInstruments(Base):
+    """Registry of trading instruments, removed ones are kept inactive"""
+    __tablename__ = 'trading_instruments'
+    instrument_id = Column('instrument_id', VARCHAR(50), primary_key=True)
+    name = Column('name', VARCHAR(100), nullable=False)
+    active = Column('active', BOOLEAN, nullable=False, server_default='true')
+    updated_at = Column(
+        'updated_at', TIMESTAMP, nullable=False, server_default=func.now(), index=True
+    )
+
+
+class TradingInstrumentsVersion(Base):
+    """
+    Version of the registry of trading instruments in its only row.
+    It is incremented in transactions changing the registry, which wait
+    for each other on the row, so versions grow in the order of commits.
+    """
+    __tablename__ = 'trading_instruments_version'
+    id = Column('id', SMALLINT, primary_key=True, autoincrement=False)
+    version = Column('version', BIGINT, nullable=False)
+
+
+class PriceRollup:
+    """Columns of tables with trading prices aggregated per bucket of time"""
+    instrument_id = Column('instrument_id', VARCHAR(50), primary_key=True)
+    bucket = Column('bucket', TIMESTAMP, primary_key=True)
+    open = Column('open', INTEGER, nullable=False)
+    high = Column('high', INTEGER, nullable=False)
+    low = Column('low', INTEGER, nullable=False)
+    close = Column('close', INTEGER, nullable=False)
+    count = Column('count', INTEGER, nullable=False)
+
+
+class TradingPrices1m(PriceRollup, Base):
+    """Trading prices aggregated per minute"""
+    __tablename__ = 'trading_prices_1m'
+
+
+class TradingPrices5m(PriceRollup, Base):
+    """Trading prices aggregated per 5 minutes"""
+    __tablename__ = 'trading_prices_5m'
+
+
+class TradingPrices1h(PriceRollup, Base):
+    """Trading prices aggregated per hour"""
+    __tablename__ = 'trading_prices_1h'
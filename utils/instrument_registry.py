@@ -0,0 +1,113 @@
+"""
+Registry of trading instruments mirrored from database to Redis
+Copyright © 2022. All Rights are Reserved by Maria Chichkan
+"""
+
+import threading
+
+# Hash of names of registered instruments, version of the registry
+# and channel, to which the version is published when the registry changes
+REGISTRY_KEY = "instruments:registry"
+VERSION_KEY = "instruments:version"
+CHANNEL = "instruments:changes"
+# Number of instruments per HSET, so that a huge registry isn't sent in one command
+WRITE_CHUNK = 10000
+
+
+def queue_read(pipe):
+    """Queue commands reading the registry to a transaction pipeline"""
+    pipe.get(VERSION_KEY)
+    pipe.hgetall(REGISTRY_KEY)
+    return pipe
+
+
+def parse_read(results):
+    """Version and names of instruments read by queue_read, version 0 if there are none"""
+    version, names = results
+    return int(version or 0), names or {}
+
+
+def queue_write(pipe, version, names):
+    """
+    Queue commands replacing the registry to a transaction pipeline,
+    readers see either the whole old or the whole new registry
+    Args:
+        pipe: pipeline
+        version: int
+        names: dict, name per instrument
+    """
+    tmp_key = REGISTRY_KEY + ":tmp"
+    pipe.delete(tmp_key)
+    items = list(names.items())
+    for i in range(0, len(items), WRITE_CHUNK):
+        pipe.hset(tmp_key, mapping=dict(items[i : i + WRITE_CHUNK]))
+    if items:
+        pipe.rename(tmp_key, REGISTRY_KEY)
+    else:
+        pipe.delete(REGISTRY_KEY)
+    pipe.set(VERSION_KEY, version)
+    pipe.publish(CHANNEL, version)
+    return pipe
+
+
+class InstrumentView:
+    """
+    This class keeps the registry of instruments in memory of a service.
+    It is replaced as a whole by newer versions, and instruments are kept sorted,
+    so that they can be searched and read page by page.
+    """
+    def __init__(self, names=None, version=0):
+        """
+        Args:
+            names: dict, name per instrument to start with
+            version: int
+        """
+        self.version = version
+        self.names = dict(names or {})
+        self.instruments = sorted(self.names)
+        # Lower-case "instrument name" lines searched by substring
+        self.search_keys = [
+            f"{instr} {self.names[instr]}".lower() for instr in self.instruments
+        ]
+        self.lock = threading.Lock()
+
+    def update(self, version, names):
+        """
+        Replace the view with a newer version.
+        Returns lists of added and removed instruments, None if the version isn't newer.
+        """
+        if version <= self.version:
+            return None
+        instruments = sorted(names)
+        search_keys = [f"{instr} {names[instr]}".lower() for instr in instruments]
+        with self.lock:
+            added = [instr for instr in instruments if instr not in self.names]
+            removed = [instr for instr in self.instruments if instr not in names]
+            self.version = version
+            self.names = dict(names)
+            self.instruments = instruments
+            self.search_keys = search_keys
+        return added, removed
+
+    def name(self, instrument):
+        """Name of the instrument, its id if it isn't registered anymore"""
+        return self.names.get(instrument, instrument)
+
+    def search(self, query="", offset=0, limit=100):
+        """
+        Page of instruments, whose id or name contains query (case-insensitive).
+        Returns list of (instrument, name) and the total number of matching instruments.
+        """
+        query = query.strip().lower()
+        with self.lock:
+            names = self.names
+            instruments = self.instruments
+            search_keys = self.search_keys
+        if query:
+            matches = [
+                instr for instr, key in zip(instruments, search_keys) if query in key
+            ]
+        else:
+            matches = instruments
+        page = matches[offset : offset + limit]
+        return [(instr, names[instr]) for instr in page], len(matches)
@@ -0,0 +1,242 @@
+"""
+Counters, gauges and histograms of services exposed in Prometheus text format
+Copyright © 2022. All Rights are Reserved by Maria Chichkan
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Buckets (in seconds) of latency histograms, from 1 ms to 5 minutes
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300
+)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Metric:
+    """Metric with values per combination of labels"""
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        """
+        Args:
+            name: string
+            documentation: string, shown as HELP
+            labelnames: tuple of names of labels
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.children = {}
+
+    def labels(self, **labels):
+        """Metric with the given values of labels"""
+        key = tuple((name, str(labels[name])) for name in self.labelnames)
+        with self.lock:
+            if key not in self.children:
+                self.children[key] = self.child()
+            return self.children[key]
+
+    def child(self):
+        raise NotImplementedError
+
+    def samples(self):
+        """List of (suffix, labels, value)"""
+        with self.lock:
+            children = list(self.children.items())
+        return [
+            (suffix, labels + extra, value)
+            for labels, child in children
+            for suffix, extra, value in child.samples()
+        ]
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(labels)} {value}")
+        return "\n".join(lines)
+
+
+class CounterValue:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        return [("_total", (), self.value)]
+
+
+class Counter(Metric):
+    """Value, which only grows, e.g. number of saved rows"""
+    kind = "counter"
+    child = CounterValue
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class GaugeValue:
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """Value is read from function, when metrics are collected"""
+        self.function = function
+
+    def samples(self):
+        return [("", (), self.function() if self.function else self.value)]
+
+
+class Gauge(Metric):
+    """Value, which goes up and down, e.g. depth of a queue"""
+    kind = "gauge"
+    child = GaugeValue
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def set_function(self, function):
+        self.labels().set_function(function)
+
+
+class HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = np.zeros(len(buckets) + 1, dtype="int64")
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = int(np.searchsorted(self.buckets, value))
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def observe_many(self, values):
+        """Observe array of values at once, e.g. latencies of all rows of a batch"""
+        values = np.asarray(values, dtype="float64")
+        counts = np.bincount(
+            np.searchsorted(self.buckets, values), minlength=len(self.counts)
+        )
+        with self.lock:
+            self.counts += counts
+            self.sum += float(values.sum())
+
+    def samples(self):
+        with self.lock:
+            cumulative = np.cumsum(self.counts)
+            total = self.sum
+        samples = [
+            ("_bucket", (("le", str(bound)),), int(count))
+            for bound, count in zip(self.buckets, cumulative)
+        ]
+        samples += [
+            ("_bucket", (("le", "+Inf"),), int(cumulative[-1])),
+            ("_sum", (), total),
+            ("_count", (), int(cumulative[-1])),
+        ]
+        return samples
+
+
+class Histogram(Metric):
+    """Distribution of values, e.g. latencies, counted in cumulative buckets"""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = np.array(sorted(buckets), dtype="float64")
+
+    def child(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def observe_many(self, values):
+        self.labels().observe_many(values)
+
+
+class Registry:
+    """Metrics of a service"""
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        """Add metric or return the registered one with the same name"""
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """All metrics in Prometheus text format"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes are not logged
+        pass
+
+
+def start_http_server(port, registry=REGISTRY):
+    """
+    Serve /metrics on port in a background thread, 0 disables the endpoint.
+    Returns the server or None.
+    """
+    if not port:
+        return None
+    handler = type("Handler", (MetricsHandler,), {"registry": registry})
+    server = ThreadingHTTPServer(("0.0.0.0", port), handler)
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, name="metrics", daemon=True
+    ).start()
+    return server
@@ -0,0 +1,45 @@
+"""
+Decoding of Redis Time Series TS.MRANGE replies to columns
+Copyright © 2022. All Rights are Reserved by Maria Chichkan
+"""
+
+from itertools import chain
+import numpy as np
+import pandas as pd
+
+
+def decode_mrange(timeseries, floor_ms=None):
+    """
+    Decode TS.MRANGE reply straight into preallocated NumPy columns.
+    Returns DataFrame with created_at (datetime), price (int) and instrument_id (categorical).
+    Args:
+        timeseries: list of [name, labels, [[timestamp in ms, value], ...]]
+        floor_ms: int or None, timestamps are floored to this number of milliseconds
+    """
+    names = [timeseries_[0] for timeseries_ in timeseries]
+    sizes = np.fromiter(
+        (len(timeseries_[2]) for timeseries_ in timeseries),
+        dtype=np.int64,
+        count=len(timeseries),
+    )
+    ends = np.cumsum(sizes)
+    created_at = np.empty(int(ends[-1]) if len(ends) else 0, dtype=np.int64)
+    prices = np.empty(created_at.shape[0], dtype=np.float64)
+    start = 0
+    for timeseries_, end in zip(timeseries, ends.tolist()):
+        if end > start:
+            # [[ts, value], [ts, value]] -> [ts, value, ts, value]
+            samples = list(chain.from_iterable(timeseries_[2]))
+            created_at[start:end] = samples[0::2]
+            prices[start:end] = samples[1::2]
+        start = end
+    if floor_ms:
+        created_at -= created_at % floor_ms
+    codes = np.repeat(np.arange(len(names), dtype=np.int32), sizes)
+    return pd.DataFrame(
+        {
+            "created_at": created_at.astype("datetime64[ms]").astype("datetime64[ns]"),
+            "price": prices.astype(np.int64),
+            "instrument_id": pd.Categorical.from_codes(codes, categories=names),
+        }
+    )
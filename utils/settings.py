@@ -29,11 +29,152 @@ class PostgreSQLCredentials(BaseSettings):
 
 REDIS_CLIENT = RedisCredentials()
 # period in minutes for which we store data for time series, by default it is 5 minutes
-REDIS_RETENTION_PERIOD = os.environ.get("REDIS_RETENTION_PERIOD", 5)
+REDIS_RETENTION_PERIOD = int(os.environ.get("REDIS_RETENTION_PERIOD", 5))
 PSQL_CLIENT = PostgreSQLCredentials()
 PSQL_DB = os.environ.get("PSQL_DB")
+# Maximum number of rows in one COPY batch of price db updater
+# and maximum number of batches loaded concurrently
+PSQL_COPY_BATCH_SIZE = int(os.environ.get("PSQL_COPY_BATCH_SIZE", 50000))
+PSQL_COPY_CONCURRENCY = int(os.environ.get("PSQL_COPY_CONCURRENCY", 4))
+# Price db updater reads Redis every DB_UPDATER_POLL_INTERVAL seconds and writes a batch
+# when it has DB_UPDATER_FLUSH_SIZE rows or is DB_UPDATER_FLUSH_INTERVAL seconds old.
+# Batches are written by DB_UPDATER_WRITERS concurrent writers,
+# and each stage waits when DB_UPDATER_QUEUE_SIZE batches wait for the next one
+DB_UPDATER_POLL_INTERVAL = float(os.environ.get("DB_UPDATER_POLL_INTERVAL", 1))
+DB_UPDATER_FLUSH_INTERVAL = float(os.environ.get("DB_UPDATER_FLUSH_INTERVAL", 5))
+DB_UPDATER_FLUSH_SIZE = int(os.environ.get("DB_UPDATER_FLUSH_SIZE", 100000))
+DB_UPDATER_WRITERS = int(os.environ.get("DB_UPDATER_WRITERS", 4))
+DB_UPDATER_QUEUE_SIZE = int(os.environ.get("DB_UPDATER_QUEUE_SIZE", 8))
+# trading_prices is partitioned by day: partitions are created this number of days ahead
+# and dropped when they are older than PSQL_RETENTION_DAYS (0 keeps them forever)
+PSQL_PARTITION_PRECREATE_DAYS = int(os.environ.get("PSQL_PARTITION_PRECREATE_DAYS", 2))
+PSQL_RETENTION_DAYS = int(os.environ.get("PSQL_RETENTION_DAYS", 0))
+# Closed days of prices are exported to Parquet files in ARCHIVE_DIR (empty turns it off)
+# ARCHIVE_AFTER_HOURS after their end, and the frontend reads them from there.
+# Archiver checks for closed days every ARCHIVE_INTERVAL seconds
+# and reads ARCHIVE_BATCH_INSTRUMENTS instruments from database at once
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "")
+ARCHIVE_AFTER_HOURS = int(os.environ.get("ARCHIVE_AFTER_HOURS", 1))
+ARCHIVE_COMPRESSION = os.environ.get("ARCHIVE_COMPRESSION", "zstd")
+ARCHIVE_INTERVAL = int(os.environ.get("ARCHIVE_INTERVAL", 600))
+ARCHIVE_BATCH_INSTRUMENTS = int(os.environ.get("ARCHIVE_BATCH_INSTRUMENTS", 10))
+# Connection pools of the frontend: kept and extra PostgreSQL connections,
+# Redis connections (also per price generator worker)
+# and threads running PostgreSQL and Redis lookups concurrently
+PSQL_POOL_SIZE = int(os.environ.get("PSQL_POOL_SIZE", 5))
+PSQL_MAX_OVERFLOW = int(os.environ.get("PSQL_MAX_OVERFLOW", 5))
+REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", 20))
+FRONTEND_QUERY_WORKERS = int(os.environ.get("FRONTEND_QUERY_WORKERS", 8))
+# Run PostgreSQL and Redis lookups of the frontend concurrently
+FRONTEND_CONCURRENT_QUERIES = (
+    os.environ.get("FRONTEND_CONCURRENT_QUERIES", "true").lower() == "true"
+)
+# Log every SQL statement of the frontend and price db updater
+PSQL_ECHO = os.environ.get("PSQL_ECHO", "false").lower() == "true"
+# Width of the price chart in pixels: historical prices are downsampled
+# so that there are no more points per instrument than pixels
+CHART_WIDTH = int(os.environ.get("CHART_WIDTH", 1000))
+# Maximum number of points per instrument kept on the chart while new prices are appended
+CHART_MAX_POINTS = int(os.environ.get("CHART_MAX_POINTS", 3600))
+# Interval between ticks of price generator in milliseconds, not less than 10 ms.
+# Timestamps keep millisecond precision in storage and in the frontend
+TICK_INTERVAL_MS = max(int(os.environ.get("TICK_INTERVAL_MS", 1000)), 10)
+# Maximum number of the latest prices per instrument kept in memory of the frontend,
+# which are received from Redis channels (0 turns the cache off). By default it keeps
+# a few ticks more than Redis retention period, so that loads of the whole period hit it
+PRICE_CACHE_SIZE = int(
+    os.environ.get(
+        "PRICE_CACHE_SIZE", REDIS_RETENTION_PERIOD * 60000 // TICK_INTERVAL_MS + 5
+    )
+)
+# New prices are pushed to charts with server-sent events (needs PRICE_CACHE_SIZE > 0)
+# instead of polling every second. Idle streams send keep-alive comments
+PRICE_STREAMING = os.environ.get("PRICE_STREAMING", "true").lower() == "true"
+STREAM_KEEPALIVE_SECONDS = int(os.environ.get("STREAM_KEEPALIVE_SECONDS", 15))
+# Historical prices of the frontend are cached in segments of HISTORY_CACHE_SEGMENT_POINTS
+# buckets or ticks: "memory" keeps up to HISTORY_CACHE_MAX_ROWS rows in process,
+# "redis" shares segments between processes for up to HISTORY_CACHE_REDIS_TTL seconds,
+# "off" turns the cache off. Segments, which ended HISTORY_CACHE_SETTLE_SECONDS ago
+# and before watermarks of price db updater, don't change anymore,
+# newer ones are cached for HISTORY_CACHE_OPEN_TTL seconds
+HISTORY_CACHE = os.environ.get("HISTORY_CACHE", "memory")
+HISTORY_CACHE_MAX_ROWS = int(os.environ.get("HISTORY_CACHE_MAX_ROWS", 5000000))
+HISTORY_CACHE_REDIS_TTL = int(os.environ.get("HISTORY_CACHE_REDIS_TTL", 86400))
+HISTORY_CACHE_SEGMENT_POINTS = int(os.environ.get("HISTORY_CACHE_SEGMENT_POINTS", 600))
+HISTORY_CACHE_SETTLE_SECONDS = int(os.environ.get("HISTORY_CACHE_SETTLE_SECONDS", 120))
+HISTORY_CACHE_OPEN_TTL = int(os.environ.get("HISTORY_CACHE_OPEN_TTL", 5))
 
-# In future the best approach will be to move this information to the database table
+# How price generator sends prices to Redis:
+# "batch" - one scheduler advances all instruments and sends them in pipelines every tick,
+# "per_instrument" - one coroutine per instrument with its own TS.ADD and PUBLISH
+PRICE_EMISSION_MODE = os.environ.get("PRICE_EMISSION_MODE", "batch")
+# Maximum number of instruments sent to Redis in one pipeline in "batch" mode
+PRICE_BATCH_SIZE = int(os.environ.get("PRICE_BATCH_SIZE", 1000))
+# Trading instruments are split between PRICE_GENERATOR_SHARDS containers
+# (this one is number PRICE_GENERATOR_SHARD, from 0) with consistent hashing,
+# and the part of a container is split between PRICE_GENERATOR_WORKERS processes
+PRICE_GENERATOR_SHARDS = int(os.environ.get("PRICE_GENERATOR_SHARDS", 1))
+PRICE_GENERATOR_SHARD = int(os.environ.get("PRICE_GENERATOR_SHARD", 0))
+PRICE_GENERATOR_WORKERS = int(os.environ.get("PRICE_GENERATOR_WORKERS", 1))
+# Price model of price generator: "random_walk" (price changes randomly by 1),
+# "gbm" (geometric Brownian motion) or "replay" (replays movements saved to PRICE_REPLAY_FILE)
+PRICE_MODEL = os.environ.get("PRICE_MODEL", "random_walk")
+# Fixed seed makes generated prices reproducible, e.g. for load tests
+PRICE_MODEL_SEED = (
+    int(os.environ["PRICE_MODEL_SEED"]) if os.environ.get("PRICE_MODEL_SEED") else None
+)
+PRICE_INITIAL = float(
+    os.environ.get("PRICE_INITIAL", 100 if PRICE_MODEL == "gbm" else 0)
+)
+# Drift and volatility of geometric Brownian motion per tick
+PRICE_GBM_DRIFT = float(os.environ.get("PRICE_GBM_DRIFT", 0.0))
+PRICE_GBM_VOLATILITY = float(os.environ.get("PRICE_GBM_VOLATILITY", 0.01))
+# File with recorded movements for "replay" model and number of ticks to record
+PRICE_REPLAY_FILE = os.environ.get("PRICE_REPLAY_FILE", "replay.npy")
+PRICE_REPLAY_TICKS = int(os.environ.get("PRICE_REPLAY_TICKS", 3600))
+# Format of tick messages published by price generator: "json" or "binary".
+# Binary is used only if every registered consumer can decode it, otherwise json
+TICK_CODEC = os.environ.get("TICK_CODEC", "json")
+# If set, prices of all instruments are published to this channel in batched frames
+# instead of a message per instrument channel
+TICK_BATCH_CHANNEL = os.environ.get("TICK_BATCH_CHANNEL", "")
+# How often (in seconds) consumers register supported formats and generator checks them
+TICK_CODEC_NEGOTIATE_INTERVAL = int(os.environ.get("TICK_CODEC_NEGOTIATE_INTERVAL", 10))
+# "timeseries": price db updater polls Redis time series, which keep prices
+# for REDIS_RETENTION_PERIOD minutes only.
+# "stream": price generator also appends batched binary frames to PRICE_STREAM
+# (trimmed to about PRICE_STREAM_MAXLEN entries), which price db updaters consume
+# through PRICE_STREAM_GROUP consumer group and acknowledge after saving to database
+INGESTION_MODE = os.environ.get("INGESTION_MODE", "timeseries")
+PRICE_STREAM = os.environ.get("PRICE_STREAM", "trading_prices_stream")
+PRICE_STREAM_MAXLEN = int(os.environ.get("PRICE_STREAM_MAXLEN", 1000000))
+PRICE_STREAM_GROUP = os.environ.get("PRICE_STREAM_GROUP", "db_updater")
+# Name of the consumer, unique per price db updater replica, hostname if empty
+PRICE_STREAM_CONSUMER = os.environ.get("PRICE_STREAM_CONSUMER", "")
+# Maximum number of entries per read and idle time (ms), after which entries
+# read but not acknowledged by another replica are claimed
+PRICE_STREAM_READ_COUNT = int(os.environ.get("PRICE_STREAM_READ_COUNT", 100))
+PRICE_STREAM_CLAIM_IDLE_MS = int(os.environ.get("PRICE_STREAM_CLAIM_IDLE_MS", 60000))
+# Entries, which price db updater can't decode, are moved to this stream and acknowledged
+PRICE_STREAM_DEAD_LETTER = os.environ.get(
+    "PRICE_STREAM_DEAD_LETTER", f"{PRICE_STREAM}:dead"
+)
+# Port of Prometheus /metrics endpoint of price generator and price db updater,
+# 0 disables it. Price generator worker number i listens on METRICS_PORT + i.
+# The frontend serves /metrics on its own port
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9100))
+# Level of logs. Per-tick lines are written at DEBUG level,
+# and at INFO level only every LOG_TICK_EVERY-th tick is logged
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_TICK_EVERY = int(os.environ.get("LOG_TICK_EVERY", 60))
+
+# Instruments are registered in trading_instruments table, which is filled with
+# TRADING_INSTRUMENTS_WITH_NAMES when it is empty. Price db updater mirrors changes to Redis
+# every INSTRUMENT_REGISTRY_REFRESH seconds and notifies price generator and frontend,
+# which also check the mirror at this interval. The dropdown of the frontend shows
+# up to INSTRUMENT_OPTIONS_LIMIT instruments matching the search
+INSTRUMENT_REGISTRY_REFRESH = int(os.environ.get("INSTRUMENT_REGISTRY_REFRESH", 30))
+INSTRUMENT_OPTIONS_LIMIT = int(os.environ.get("INSTRUMENT_OPTIONS_LIMIT", 100))
 TRADING_INSTRUMENTS_WITH_NAMES = {
     "ticker_999": "Tesla",
     "ticker_998": "Gold",
@@ -58,7 +199,7 @@ def _logging():
 
     # Create Logger
     logger = logging.getLogger(project_name)
-    logger.setLevel(logging.INFO)
+    logger.setLevel(LOG_LEVEL)
     if not logger.handlers:
         # Create handler to write logs to file
         # RotatingFileHandler controls maximum file size and keeps only the last logs
@@ -70,7 +211,7 @@ def _logging():
             delay=False,
         )
         # logger_handler = logging.FileHandler(filename)
-        logger_handler.setLevel(logging.INFO)
+        logger_handler.setLevel(LOG_LEVEL)
         # Create Formatter to format messages in log
         logger_formatter = logging.Formatter(
             "%(asctime)s - %(levelname)s - %(message)s"
@@ -0,0 +1,116 @@
+"""
+Wire formats of tick messages, which price generator publishes to Redis
+Copyright © 2022. All Rights are Reserved by Maria Chichkan
+"""
+
+import json
+import struct
+
+# Binary frames start with a magic byte, version of the format and kind of the frame
+MAGIC = 0xA7
+BINARY_VERSION = 1
+KIND_TICK = 1
+KIND_BATCH = 2
+HEADER = struct.Struct("<BBB")
+# Tick: time (ms) and value, followed by utf-8 name of the instrument
+TICK = struct.Struct("<qq")
+# Batch: time (ms) and number of instruments, followed by their values
+# and "\n"-separated utf-8 names
+BATCH = struct.Struct("<qI")
+
+# Consumers register formats they can decode under these keys, producer reads them
+CONSUMER_KEY_PREFIX = "tick_codec:consumer:"
+# Format chosen by producer
+ADVERTISEMENT_KEY = "tick_codec"
+
+
+class JsonCodec:
+    """Default format: {"time": ..., "value": ...} per instrument"""
+    name = "json"
+    version = 1
+
+    @staticmethod
+    def encode_tick(instrument, time, value):
+        # Instrument is the name of the channel
+        return json.dumps({"time": time, "value": value})
+
+    @staticmethod
+    def encode_batch(time, instruments, values):
+        return json.dumps({"time": time, "instruments": instruments, "values": values})
+
+
+class BinaryCodec:
+    """Compact struct-packed format"""
+    name = "binary"
+    version = BINARY_VERSION
+
+    @staticmethod
+    def encode_tick(instrument, time, value):
+        return (
+            HEADER.pack(MAGIC, BINARY_VERSION, KIND_TICK)
+            + TICK.pack(time, value)
+            + instrument.encode()
+        )
+
+    @staticmethod
+    def encode_batch(time, instruments, values):
+        return b"".join(
+            [
+                HEADER.pack(MAGIC, BINARY_VERSION, KIND_BATCH),
+                BATCH.pack(time, len(values)),
+                struct.pack(f"<{len(values)}q", *values),
+                "\n".join(instruments).encode(),
+            ]
+        )
+
+
+CODECS = {JsonCodec.name: JsonCodec, BinaryCodec.name: BinaryCodec}
+# Formats and their versions this code can decode, e.g. "json:1,binary:1"
+SUPPORTED = ",".join(f"{codec.name}:{codec.version}" for codec in CODECS.values())
+
+
+def decode(payload, channel=None):
+    """
+    Decode frame of any supported format to list of (instrument, time, value)
+    Args:
+        payload: string or bytes
+        channel: string, name of the instrument for single ticks in json format
+    """
+    if isinstance(payload, bytes) and payload[:1] == bytes([MAGIC]):
+        _, version, kind = HEADER.unpack_from(payload)
+        if version > BINARY_VERSION:
+            raise ValueError(f"Binary tick format version {version} is not supported")
+        offset = HEADER.size
+        if kind == KIND_TICK:
+            time, value = TICK.unpack_from(payload, offset)
+            return [(payload[offset + TICK.size :].decode(), time, value)]
+        if kind != KIND_BATCH:
+            raise ValueError(f"Binary tick frame kind {kind} is not supported")
+        time, count = BATCH.unpack_from(payload, offset)
+        offset += BATCH.size
+        values = struct.unpack_from(f"<{count}q", payload, offset)
+        instruments = payload[offset + 8 * count :].decode().split("\n")
+        return [(instr, time, value) for instr, value in zip(instruments, values)]
+    message = json.loads(payload)
+    if "instruments" in message:
+        return [
+            (instr, message["time"], value)
+            for instr, value in zip(message["instruments"], message["values"])
+        ]
+    return [(channel, message["time"], message["value"])]
+
+
+def negotiate(preferred, consumers):
+    """
+    Codec, which every consumer can decode: the preferred one if all of them support it
+    and json otherwise
+    Args:
+        preferred: string, name of the codec set in settings
+        consumers: list of strings with supported formats, e.g. ["json:1,binary:1"]
+    """
+    codec = CODECS[preferred]
+    required = f"{codec.name}:{codec.version}"
+    for supported in consumers:
+        if required not in supported.split(","):
+            return JsonCodec
+    return codec